@@ -0,0 +1,359 @@
+# agent_server.py
+"""Headless HTTP/SSE server mode for the agent.
+
+Serves an OpenAI-compatible POST /v1/chat/completions (streamed or not) plus
+POST /v1/commands for the slash commands. Every client session gets its own
+AgentSession (memory, system prompt). The RAG retriever and the upstream
+OpenRouter connection pool are shared by the whole process.
+
+Sessions are picked by the X-Session-Id header (or the request's "user" field); a new
+id is issued in the X-Session-Id response header when none is given.
+
+    AGENT_SERVER_TOKEN=... python agent_server.py --host 0.0.0.0 --port 8000
+
+A bearer token is required to listen on anything but loopback. Only the slash
+commands in SESSION_COMMANDS, which touch nothing but the caller's session (or
+read shared counters), are served, and the model gets no tools that read the
+host; AGENT_SERVER_LOCAL_EXEC=1 lifts both limits for a trusted, local setup.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import argparse
+import ipaddress
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import basic_agent_cloud as agent
+from openrouter_client import AllModelsFailed
+from sse_parser import QueueSink
+from instrumentation import metrics
+
+SESSION_TTL = 3600  # Seconds an idle session is kept
+MAX_SESSIONS = 10000
+SERVER_TOKEN = os.getenv("AGENT_SERVER_TOKEN")  # Bearer token clients must send; required off loopback
+LOCAL_EXEC = os.getenv("AGENT_SERVER_LOCAL_EXEC", "0") == "1"  # Allow every command and tool, host access included
+SESSION_COMMANDS = {"/history", "/clear", "/prompts", "/tokens", "/models", "/routing", "/stats",
+                    "/cache on", "/cache off"}  # Served as typed; everything else may touch the host or other clients
+SESSION_COMMAND_PREFIXES = ("/prompt ", "/custom ")  # Commands whose argument only changes the caller's session
+HOST_TOOLS = {"read_file", "list_files"}  # Tasks offered to the model (TOOL_CALLING) that read the server host
+
+
+class SessionManager:
+    """Thread-safe map of session id -> AgentSession with idle expiry."""
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id=None):
+        """Return (session_id, session), creating the session if needed."""
+        now = time.time()
+        with self._lock:
+            session_id = session_id or uuid.uuid4().hex
+            session = self._sessions.get(session_id)
+            if session is None:
+                self._expire(now)
+                session = self._sessions[session_id] = agent.AgentSession(session_id=session_id)
+            self._last_used[session_id] = now
+            return session_id, session
+
+    def _expire(self, now):
+        stale = [sid for sid, used in self._last_used.items() if now - used > self.ttl]
+        if len(self._sessions) - len(stale) >= self.max_sessions:
+            # Still full: drop the least recently used sessions too
+            by_age = sorted(self._last_used, key=self._last_used.get)
+            stale = by_age[:len(self._sessions) - self.max_sessions + 1]
+        for sid in stale:
+            self._sessions.pop(sid, None)
+            self._last_used.pop(sid, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+sessions = SessionManager()
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _allowed_command(command):
+    """True if the slash command is safe to run for a remote client."""
+    return LOCAL_EXEC or command in SESSION_COMMANDS or command.startswith(SESSION_COMMAND_PREFIXES)
+
+
+def _completion_chunk(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive for clients and load balancers
+    server_version = "BasicCloudAgent/1.0"
+
+    def log_message(self, format, *args):
+        pass  # Per-request logging would dominate under load
+
+    # --- helpers ---
+    def _send_json(self, status, payload, session_id=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if session_id:
+            self.send_header("X-Session-Id", session_id)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_metrics(self, as_json):
+        body = (metrics.to_json() if as_json else metrics.to_prometheus()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if as_json else "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {"error": {"message": message, "code": status}})
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            return None
+
+    def _authorized(self):
+        if not SERVER_TOKEN:
+            return True
+        if self.headers.get("Authorization") == f"Bearer {SERVER_TOKEN}":
+            return True
+        self._send_error(401, "invalid or missing bearer token")
+        return False
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _write_event(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        self._write_chunk(f"data: {data}\n\n".encode("utf-8"))
+
+    # --- routes ---
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "sessions": len(sessions)})
+        elif self.path in ("/metrics", "/metrics.json"):
+            if self._authorized():
+                self._send_metrics(self.path.endswith(".json"))
+        elif self.path == "/v1/models":
+            if self._authorized():
+                self._send_json(200, {"object": "list", "data": [
+                    {"id": model, "object": "model", "owned_by": "openrouter"} for model in agent.MODELS]})
+        else:
+            self._send_error(404, "not found")
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        body = self._read_json()
+        if not isinstance(body, dict):
+            self._send_error(400, "request body must be a JSON object")
+        elif self.path == "/v1/chat/completions":
+            self._chat_completions(body)
+        elif self.path == "/v1/commands":
+            self._command(body)
+        else:
+            self._send_error(404, "not found")
+
+    def _refuse_command(self, command):
+        """Send 403 for commands outside the server allowlist."""
+        if _allowed_command(command):
+            return False
+        self._send_error(403, f"{command} is not available in server mode; allowed: "
+                              + ", ".join(sorted(SESSION_COMMANDS) + ["/prompt <name>", "/custom <prompt>"]))
+        return True
+
+    def _command(self, body):
+        command = body.get("command")
+        if not isinstance(command, str) or not command.strip().startswith("/"):
+            self._send_error(400, "command must be a string starting with '/'")
+            return
+        command = command.strip()
+        if self._refuse_command(command):
+            return
+        session_id, session = sessions.get(self._session_id(body))
+        with session.lock:
+            output = agent.handle_command(command, session)
+        if output is None:
+            self._send_error(404, f"unknown command: {command}")
+        else:
+            self._send_json(200, {"output": output}, session_id)
+
+    def _session_id(self, body):
+        session_id = self.headers.get("X-Session-Id") or body.get("user")
+        return session_id if isinstance(session_id, str) else None
+
+    def _chat_options(self, body):
+        """Validated generation options, or None after sending a 400."""
+        max_tokens = body.get("max_tokens") or 500
+        temperature = body.get("temperature", 0.7)
+        if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1:
+            self._send_error(400, "max_tokens must be a positive integer")
+            return None
+        if isinstance(temperature, bool) or not isinstance(temperature, (int, float)) or not 0 <= temperature <= 2:
+            self._send_error(400, "temperature must be a number between 0 and 2")
+            return None
+        return {"max_tokens": max_tokens, "temperature": float(temperature),
+                "use_cache": "no-cache" not in (self.headers.get("Cache-Control") or "")}
+
+    def _chat_completions(self, body):
+        messages = body.get("messages")
+        if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+            self._send_error(400, "messages must be a list of message objects")
+            return
+        prompt = next((m.get("content") for m in reversed(messages) if m.get("role") == "user"), None)
+        if not prompt or not isinstance(prompt, str):
+            self._send_error(400, "messages must contain a user message")
+            return
+        options = self._chat_options(body)
+        if options is None:
+            return
+        session_id, session = sessions.get(self._session_id(body))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        stream = bool(body.get("stream"))
+
+        # Slash commands work through the chat endpoint too
+        if prompt.strip().startswith("/"):
+            if self._refuse_command(prompt.strip()):
+                return
+            with session.lock:
+                output = agent.handle_command(prompt.strip(), session)
+            if output is not None:
+                self._reply(completion_id, "agent-command", output, stream, session_id)
+                return
+
+        options["prefetched"] = agent.prefetch_if_queued(prompt, session)  # Retrieve while an earlier turn runs
+        if not stream:
+            try:
+                with session.lock:
+                    model, content = agent.generate_reply(prompt, agent.api_key, session, stream=False, **options)
+            except AllModelsFailed:
+                self._send_error(503, "all models are currently unavailable")
+                return
+            self._reply(completion_id, model, content, False, session_id)
+            return
+
+        self._stream_reply(prompt, session, session_id, completion_id, options)
+
+    def _reply(self, completion_id, model, content, stream, session_id):
+        if not stream:
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+            }, session_id)
+            return
+        self._start_stream(session_id)
+        self._write_event(_completion_chunk(completion_id, model, {"role": "assistant", "content": content}))
+        self._write_event(_completion_chunk(completion_id, model, {}, "stop"))
+        self._write_event("[DONE]")
+        self._write_chunk(b"")
+
+    def _start_stream(self, session_id):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Session-Id", session_id)
+        self.end_headers()
+
+    def _stream_reply(self, prompt, session, session_id, completion_id, options):
+        """Stream tokens as SSE while the turn runs in a worker thread."""
+        events = queue.Queue()
+        sink = QueueSink(events)
+
+        def run_turn():
+            try:
+                with session.lock:
+                    agent.generate_reply(
+                        prompt, agent.api_key, session, stream=True,
+                        on_start=sink.start, on_token=sink.write, **options)
+                events.put(("done", None))
+            except AllModelsFailed:
+                events.put(("failed", "all models are currently unavailable"))
+            except Exception as e:
+                events.put(("failed", str(e)))
+
+        threading.Thread(target=run_turn, daemon=True).start()
+        kind, value = events.get()
+        if kind == "failed":
+            self._send_error(503, value)
+            return
+
+        model = value
+        self._start_stream(session_id)
+        self._write_event(_completion_chunk(completion_id, model, {"role": "assistant"}))
+        try:
+            while True:
+                kind, value = events.get()
+                if kind == "token":
+                    self._write_event(_completion_chunk(completion_id, model, {"content": value}))
+                elif kind == "done":
+                    self._write_event(_completion_chunk(completion_id, model, {}, "stop"))
+                    break
+                else:
+                    self._write_event({"error": {"message": value}})
+                    break
+            self._write_event("[DONE]")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away; the turn still finishes and is kept in memory
+
+
+def serve(host="127.0.0.1", port=8000):
+    """Run the server until interrupted."""
+    if not agent.api_key:
+        print("❌ Missing OPENROUTER_API_KEY in your .env file")
+        return
+    if not SERVER_TOKEN and not _is_loopback(host):
+        print(f"❌ Refusing to listen on {host} without AGENT_SERVER_TOKEN; set a token or bind to 127.0.0.1")
+        return
+    if agent.RAG_WARMUP:
+        agent.warm_up()
+    agent.get_job_queue().start()  # Runs jobs queued locally (and /bg jobs when AGENT_SERVER_LOCAL_EXEC=1)
+    if not LOCAL_EXEC:
+        agent.disabled_tools.update(HOST_TOOLS)
+    server = ThreadingHTTPServer((host, port), AgentRequestHandler)
+    server.daemon_threads = True
+    print(f"🌐 Agent server listening on http://{host}:{port} (POST /v1/chat/completions)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        agent.model_router.save()
+        print("👋 Server stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the agent as an HTTP/SSE server")
+    parser.add_argument("--host", default=os.getenv("AGENT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("AGENT_PORT", "8000")))
+    args = parser.parse_args()
+    serve(args.host, args.port)
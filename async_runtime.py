@@ -0,0 +1,40 @@
+# async_runtime.py
+import asyncio
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """Return the shared background event loop, starting its thread on first use.
+
+    Long-lived async resources (HTTP connection pools) are bound to this loop, so
+    they survive between calls made from the synchronous CLI and server threads.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the background loop and return a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout=None):
+    """Run a coroutine on the background loop and block until it finishes.
+
+    If the caller is interrupted (Ctrl+C) the coroutine is cancelled as well.
+    """
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
@@ -1,16 +1,27 @@
 # basic_agent_cloud.py
-import requests
 import os
 import time
-import subprocess
 import json
+import re
 import sys
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
-import chromadb
-from sentence_transformers import SentenceTransformer
 
-from rag_pdf_loader import query_knowledge
+from rag_pdf_loader import query_knowledge, query_cache, warm_up, embed_query, is_embedding_model_loaded
+from rag_router import router as rag_router, RouteDecision, is_knowledge_query
+from response_cache import ResponseCache, RESPONSE_CACHE_DB
+from tool_executor import ToolExecutor, format_results, merge_for_prompt, MAX_TOOL_OUTPUT
+from task_registry import TaskRegistry
+from openrouter_client import OpenRouterClient, AllModelsFailed, StreamInterrupted, ChatCompletionsShim
+from sse_parser import TerminalSink, FileSink, TeeSink
+from model_router import ModelRouter
+from history_store import HistoryStore, HISTORY_DB_FILE
+from context_builder import build_context, context_budget, summarize_extractive
+from instrumentation import metrics
+from job_queue import make_queue, submit_index, submit_shell
 
 load_dotenv()
 api_key = os.getenv("OPENROUTER_API_KEY")
@@ -21,8 +32,21 @@ MODELS = [
     "meta-llama/llama-3-8b-instruct",
 ]
 
-HISTORY_FILE = "chat_history.json"
-MAX_HISTORY_MESSAGES = 10  # Keep last 5 exchanges (user + assistant = 10 messages)
+HEDGING_ENABLED = os.getenv("HEDGING", "1") != "0"  # Race the next model when one is slow to answer
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "1.0"))  # Seconds to wait for a first token before hedging
+
+RAG_WARMUP = os.getenv("RAG_WARMUP", "1") != "0"  # Load the embedding model in the background at start-up
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"  # Answer near-duplicate questions from cache
+TOOL_CALLING = os.getenv("TOOL_CALLING", "0") == "1"  # Offer the tasks/ tools to the model (needs tool-capable models)
+MAX_TOOL_ROUNDS = 3  # Tool-call round trips before the model must answer
+INTERRUPTED_NOTE = "\n\n⚠️ [Answer cut off: the model's stream was interrupted]"
+disabled_tools = set()  # Task names never offered to the model (server mode hides those that read the host)
+PIPELINE = os.getenv("PIPELINE", "1") != "0"  # Open the API connection while RAG retrieval runs
+PREFETCH_WORKERS = 4  # Threads retrieving context for prompts queued behind their session's current turn
+
+HISTORY_FILE = "chat_history.json"  # Legacy single-file history, imported once into the store
+CLI_SESSION_ID = os.getenv("AGENT_SESSION_ID", "default")
+MAX_HISTORY_MESSAGES = 50  # Upper bound kept in memory; the per-model token budget decides what is sent
 
 # System prompt presets
 SYSTEM_PROMPTS = {
@@ -35,53 +59,89 @@ SYSTEM_PROMPTS = {
     "analyst": "You are a data analyst. Provide structured, analytical responses with logical reasoning."
 }
 
-current_system_prompt = "default"
-streaming_enabled = True  # Toggle streaming on/off
+DEFAULT_SYSTEM_PROMPT = "default"
+STREAMING_DEFAULT = True  # Toggle streaming on/off
+STREAM_LOG = os.getenv("STREAM_LOG")  # Optional file that streamed answers are also appended to
 
 class ConversationMemory:
-    def __init__(self):
+    def __init__(self, session_id=CLI_SESSION_ID, store=None):
         self.messages = []
+        self.session_id = session_id
+        self.store = store  # HistoryStore; None keeps the conversation in memory only
         self.session_start = datetime.now().isoformat()
+        self.summary = ""  # Rolling summary of turns that no longer fit the context
+        self.summary_until = 0  # Id of the last message folded into the summary
+        self._next_id = 1
         self.load_history()
     
     def load_history(self):
-        """Load previous conversation from file."""
-        if os.path.exists(HISTORY_FILE):
+        """Load the recent tail of this session from the history store."""
+        if self.store is not None:
             try:
-                with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # Load only recent messages
-                    if 'messages' in data:
-                        self.messages = data['messages'][-MAX_HISTORY_MESSAGES:]
-                        print(f"📚 Loaded {len(self.messages)} messages from previous session")
+                # Load only recent messages
+                self.messages = self.store.tail(self.session_id, MAX_HISTORY_MESSAGES)
+                self.summary, self.summary_until = self.store.load_summary(self.session_id)
+                if self.messages:
+                    print(f"📚 Loaded {len(self.messages)} messages from previous session")
             except Exception as e:
                 print(f"⚠️ Could not load history: {e}")
     
     def save_history(self):
-        """Save conversation to file."""
-        try:
-            data = {
-                'session_start': self.session_start,
-                'last_updated': datetime.now().isoformat(),
-                'messages': self.messages
-            }
-            with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"⚠️ Could not save history: {e}")
+        """Messages are written to the store as they arrive; nothing is left to flush on exit."""
+        return None
     
     def add_message(self, role, content):
-        """Add a message to conversation history."""
-        self.messages.append({
+        """Add a message to conversation history and append it to the store."""
+        message = {
             "role": role,
             "content": content,
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        message_id = None
+        if self.store is not None:
+            try:
+                with metrics.span("history.save"):
+                    message_id = self.store.append(self.session_id, role, content, message["timestamp"])
+            except Exception as e:
+                print(f"⚠️ Could not save history: {e}")
+        if message_id is None:
+            message_id = max(self._next_id, self.messages[-1]["id"] + 1 if self.messages else 1)
+        self._next_id = message_id + 1
+        message["id"] = message_id
+        self.messages.append(message)
         
-        # Keep only last N messages
+        # Keep only last N messages; anything not yet summarized is folded in first
         if len(self.messages) > MAX_HISTORY_MESSAGES:
+            self._fold(self.messages[:-MAX_HISTORY_MESSAGES])
             self.messages = self.messages[-MAX_HISTORY_MESSAGES:]
     
+    def _fold(self, evicted):
+        """Add evicted messages the summary doesn't cover yet to the rolling summary."""
+        new = [m for m in evicted if m["id"] > self.summary_until]
+        if not new:
+            return
+        self.summary = summarize_extractive(self.summary, new)
+        self.summary_until = new[-1]["id"]
+        if self.store is not None:
+            try:
+                self.store.save_summary(self.session_id, self.summary, self.summary_until)
+            except Exception as e:
+                print(f"⚠️ Could not save summary: {e}")
+    
+    def build_context_messages(self, system_prompt, prompt, budget, rag_context=""):
+        """API messages packed into a token budget, plus a token report.
+
+        History that doesn't fit is folded into the rolling summary, which is sent instead.
+        """
+        history = [m for m in self.messages if m["id"] > self.summary_until]
+        messages, evicted, report = build_context(system_prompt, history, prompt, budget, rag_context, self.summary)
+        if evicted:
+            self._fold(evicted)
+            # Rebuild so the freshly folded turns show up in the summary message
+            history = [m for m in self.messages if m["id"] > self.summary_until]
+            messages, _, report = build_context(system_prompt, history, prompt, budget, rag_context, self.summary)
+        return messages, report
+    
     def get_context_messages(self):
         """Get messages formatted for API (without timestamps)."""
         return [{"role": m["role"], "content": m["content"]} for m in self.messages]
@@ -89,6 +149,9 @@ class ConversationMemory:
     def clear(self):
         """Clear current session memory."""
         self.messages = []
+        self.summary = ""
+        if self.store is not None:
+            self.store.clear(self.session_id)
         print("🧹 Memory cleared!")
     
     def show_history(self):
@@ -102,191 +165,497 @@ class ConversationMemory:
             output += f"\n{role_emoji} {msg['role'].upper()}: {msg['content'][:100]}...\n"
         return output
 
-memory = ConversationMemory()
-def is_knowledge_query(prompt: str) -> bool:
-    """Simple heuristic to decide if RAG should be triggered."""
-    keywords = ["explain", "describe", "summarize", "who", "what", "when", "where", "why", "how", "define", "regulation", "policy", "rule", "procedure"]
-    return any(kw in prompt.lower() for kw in keywords)
 
-def ask_agent(prompt, api_key):
-    """Ask AI with conversation context, RAG integration, and streaming support."""
-    
-    # 1️⃣ Optional: automatically enrich the prompt with RAG context
-    context_text = ""
-    if is_knowledge_query(prompt):
+class AgentSession:
+    """Per-user state: conversation memory, system prompt and streaming preference.
+
+    The CLI uses a single session; the HTTP server keeps one per client.
+    """
+
+    def __init__(self, memory=None, session_id="cli"):
+        self.session_id = session_id
+        self.memory = memory if memory is not None else ConversationMemory(session_id, get_history_store())
+        self.system_prompt = DEFAULT_SYSTEM_PROMPT
+        self.custom_prompt = None
+        self.streaming = STREAMING_DEFAULT
+        self.lock = threading.Lock()  # One turn at a time per session
+        self.requests = 0
+        self.tokens_sent = 0
+        self.last_context = None  # Token report of the last request
+        self.use_response_cache = RESPONSE_CACHE_ENABLED
+        self.pending_tool_output = []  # /read, /fetch and /run results attached to the next prompt
+
+    def system_prompt_text(self):
+        if self.system_prompt == "custom" and self.custom_prompt:
+            return self.custom_prompt
+        return SYSTEM_PROMPTS[self.system_prompt]
+
+
+model_router = ModelRouter(MODELS)
+response_cache = ResponseCache(RESPONSE_CACHE_DB)
+tool_executor = ToolExecutor()
+openrouter_client = None
+_client_lock = threading.Lock()
+prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="rag-prefetch")
+# Opened on first use, so importing the agent (server, batch runner, job worker) creates no databases
+history_store = None
+cli_session = None
+task_registry = None
+job_queue = None
+_state_lock = threading.RLock()
+
+
+def get_history_store():
+    """Return the shared HistoryStore, importing the legacy JSON history when it is first opened."""
+    global history_store
+    with _state_lock:
+        if history_store is None:
+            history_store = HistoryStore(HISTORY_DB_FILE)
+            history_store.import_legacy_json(HISTORY_FILE, CLI_SESSION_ID)
+        return history_store
+
+
+def get_cli_session():
+    """Return the terminal's session (CLI_SESSION_ID)."""
+    global cli_session
+    with _state_lock:
+        if cli_session is None:
+            cli_session = AgentSession(ConversationMemory(CLI_SESSION_ID, get_history_store()))
+        return cli_session
+
+
+def get_task_registry():
+    """Return the task registry; its tasks call the LLM through the shared OpenRouter client."""
+    global task_registry
+    with _state_lock:
+        if task_registry is None:
+            task_registry = TaskRegistry(client_factory=lambda: ChatCompletionsShim(
+                lambda messages, **options: get_openrouter_client(api_key).complete(
+                    messages, MODELS, stream=False, hedge=HEDGING_ENABLED, **options)))
+        return task_registry
+
+
+def get_job_queue():
+    """Return the background job queue (jobs.db); its workers only run once start() is called."""
+    global job_queue
+    with _state_lock:
+        if job_queue is None:
+            job_queue = make_queue(tasks=get_task_registry())
+        return job_queue
+
+
+def get_openrouter_client(api_key):
+    """Return the shared OpenRouter client (one connection pool per process)."""
+    global openrouter_client
+    with _client_lock:
+        if openrouter_client is None or openrouter_client.api_key != api_key:
+            openrouter_client = OpenRouterClient(api_key, hedge_delay=HEDGE_DELAY, router=model_router)
+        return openrouter_client
+
+def _log_model_error(model, error):
+    if isinstance(error, StreamInterrupted):
+        print(f"\n⚠️ {model} stopped mid-answer ({error})")
+    elif error.status == 429:
+        print(f"⚠️ Rate limit for {model}, trying next model...")
+    elif error.status:
+        print(f"❌ API Error {error.status} on {model}: {error}")
+    elif str(error) == "timeout":
+        print(f"⏱️ Timeout on model {model}, trying next...")
+    else:
+        print(f"⚠️ {model}: {error}, trying next...")
+
+
+def _embed_if_ready(text):
+    # Semantic lookups reuse the RAG model, but never wait for it to finish loading
+    return embed_query(text) if is_embedding_model_loaded() else None
+
+
+def _replay(model, content, stream, on_start, on_token):
+    """Send a cached answer through the same callbacks as a live one."""
+    if on_start:
+        on_start(model)
+    if stream and on_token:
+        for piece in re.findall(r"\s*\S+", content):
+            on_token(piece)
+
+
+def _complete_with_tools(api_key, messages, options):
+    """Let the model call tasks/ tools before answering. Returns (model, content, tools_used)."""
+    client = get_openrouter_client(api_key)
+    registry = get_task_registry()
+    tools = [schema for schema in registry.tool_schemas() if schema["function"]["name"] not in disabled_tools]
+    messages = list(messages)
+    tools_used = False
+    for _ in range(MAX_TOOL_ROUNDS):
+        model, reply = client.complete(messages, MODELS, tools=tools, **options)
+        if isinstance(reply, str):
+            return model, reply, tools_used
+        tools_used = True
+        messages.append({"role": "assistant", "content": None, "tool_calls": reply["tool_calls"]})
+        for call in reply["tool_calls"]:
+            name = call["function"]["name"]
+            try:
+                arguments = json.loads(call["function"].get("arguments") or "{}")
+                print(f"🛠️ {model} called {name}({arguments})")
+                output = (f"❌ Tool {name} is not available" if name in disabled_tools
+                          else registry.call(name, arguments))
+            except ValueError as e:
+                output = f"❌ Invalid arguments for {name}: {e}"
+            messages.append({"role": "tool", "tool_call_id": call.get("id"), "name": name,
+                             "content": output[:MAX_TOOL_OUTPUT]})
+    model, reply = client.complete(messages, MODELS, stream=False, **options)
+    return model, reply, tools_used
+
+
+def retrieve_context(prompt):
+    """Route a prompt and query the knowledge base if that can help.
+
+    Returns (route, rag_context, retrieval_seconds); failures fall back to no context.
+    """
+    rag_context = ""
+    try:
+        route = rag_router.route(prompt)
+    except Exception as e:
+        print(f"⚠️ RAG routing failed, using keywords: {e}")
+        route = RouteDecision(is_knowledge_query(prompt), "keyword")
+    retrieval_seconds = None
+    if route.retrieve:
         try:
             print("📚 Querying knowledge base...")
-            context_text = query_knowledge(prompt)
+            started = time.perf_counter()
+            context_text = query_knowledge(prompt, query_embedding=route.embedding, collection=route.collections or None)
+            retrieval_seconds = time.perf_counter() - started
             if "📭" not in context_text and len(context_text.strip()) > 50:
-                prompt = f"Use this knowledge to answer accurately:\n{context_text}\n\nQuestion: {prompt}"
+                rag_context = context_text
         except Exception as e:
             print(f"⚠️ RAG retrieval failed: {e}")
+    rag_router.record(route, prompt, retrieval_seconds)
+    return route, rag_context, retrieval_seconds
 
-    # 2️⃣ Build the message payload
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPTS[current_system_prompt]}
-    ]
-    messages.extend(memory.get_context_messages())
-    messages.append({"role": "user", "content": prompt.strip()})
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-
-    # 3️⃣ Iterate through fallback models
-    for model in MODELS:
-        print(f"🔁 Trying model: {model}")
+
+def prefetch_context(prompt):
+    """Start retrieve_context(prompt) on a worker thread; pass the Future to generate_reply(prefetched=...)."""
+    return prefetch_pool.submit(retrieve_context, prompt)
+
+
+def prefetch_if_queued(prompt, session):
+    """Prefetch context for a prompt that must wait for its session's current turn; None if it won't wait."""
+    return prefetch_context(prompt) if session.lock.locked() else None
+
+
+def _report_overlap(started, serial_seconds, retrieval_seconds, connecting):
+    """Wait for the warm-up connection and report what overlapping it with retrieval saved.
+
+    serial_seconds is the preparation work (routing, retrieval, cache lookup, context
+    packing) as it would have run before the connection was opened.
+    """
+    if connecting is None:
+        return
+    try:
+        connect_seconds = connecting.result(timeout=15)
+    except Exception:
+        connect_seconds = None  # The request itself will connect and report any error
+    wall = time.perf_counter() - started
+    saved = max(0.0, serial_seconds + (connect_seconds or 0.0) - wall)
+    metrics.observe("turn.prepare", wall)
+    metrics.observe("turn.overlap_saved", saved)
+    connect = ("reused" if connect_seconds == 0 else "failed" if connect_seconds is None
+               else f"{connect_seconds * 1000:.0f} ms")
+    print(f"⏱️ Prepared in {wall * 1000:.0f} ms: retrieval {retrieval_seconds * 1000:.0f} ms ‖ connect {connect}"
+          f" (overlap saved {saved * 1000:.0f} ms)")
+
+
+@metrics.timed("turn")
+def generate_reply(prompt, api_key, session, stream=True, on_token=None, on_start=None,
+                   max_tokens=500, temperature=0.7, use_cache=True, prefetched=None):
+    """Run one conversation turn for a session and return (model, content).
+
+    Enriches the prompt with RAG context, answers near-duplicate questions from the
+    response cache, otherwise packs it with the session's history into the token budget.
+    The API connection is opened while retrieval runs; `prefetched` is a Future from
+    prefetch_context() whose context is used instead of retrieving again.
+    Both messages are recorded in the session memory. An answer whose stream broke off
+    is returned with INTERRUPTED_NOTE appended and never cached. Raises AllModelsFailed.
+    """
+    started = time.perf_counter()
+    connecting = get_openrouter_client(api_key).warm_up() if PIPELINE else None
+
+    # 1️⃣ Optional: enrich the prompt with RAG context when the router says the knowledge base can help
+    waited = None
+    if prefetched is not None:
+        route, rag_context, retrieval_seconds = prefetched.result()
+        waited = time.perf_counter() - started  # Whatever retrieval was left when the prompt's turn came
+    else:
+        route, rag_context, retrieval_seconds = retrieve_context(prompt)
+    retrieval = route.seconds + (retrieval_seconds or 0.0)
+
+    attached = session.pending_tool_output
+    if attached:
+        tool_context = "Tool output:\n" + "\n\n".join(attached)
+        rag_context = f"{tool_context}\n\n{rag_context}" if rag_context else tool_context
+
+    # 2️⃣ Pack system prompt, summary, RAG context and history into the token budget
+    system_prompt = session.system_prompt_text()
+    budget = context_budget(MODELS, max_tokens)
+    with metrics.span("context.build"):
+        messages, report = session.memory.build_context_messages(
+            system_prompt, prompt, budget, rag_context)
+    history = messages[1:-1]  # Summary and kept turns: part of the cache scope, so sessions never share follow-ups
+
+    # 3️⃣ Near-duplicate of a recent question with the same prompt, context and history?
+    question_vector = None
+    if use_cache and session.use_response_cache:
+        with metrics.span("cache.lookup"):
+            embed = (lambda text: route.embedding) if route.embedding is not None else _embed_if_ready
+            hit, question_vector = response_cache.lookup(prompt, system_prompt, rag_context, embed=embed,
+                                                         history=history)
+        if hit:
+            model = f"{hit['model']} (cached)"
+            print(f"⚡ Answer served from response cache (similarity {hit['similarity']:.2f})")
+            _replay(model, hit["answer"], stream, on_start, on_token)
+            session.pending_tool_output = []
+            session.memory.add_message("user", prompt.strip())
+            session.memory.add_message("assistant", hit["answer"])
+            return model, hit["answer"]
+    else:
+        response_cache.note_bypass()
+
+    session.requests += 1
+    session.tokens_sent += report["total"]
+    session.last_context = report
+    print(f"🧮 Context: {report['total']}/{budget} tokens (history {report['history']} in "
+          f"{report['history_messages']} msgs, RAG {report['rag']}, summary {report['summary']})")
+    elapsed = time.perf_counter() - started
+    _report_overlap(started, elapsed if waited is None else elapsed - waited + retrieval, retrieval, connecting)
+
+    # 4️⃣ Race the fallback models over the pooled async client
+    options = dict(on_attempt=lambda model: print(f"🔁 Trying model: {model}"), on_error=_log_model_error,
+                   hedge=HEDGING_ENABLED, max_tokens=max_tokens, temperature=temperature)
+    tools_used = partial = False
+    if TOOL_CALLING:
+        model, content, tools_used = _complete_with_tools(api_key, messages, options)
+        _replay(model, content, stream, on_start, on_token)
+    else:
         try:
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "max_tokens": 500,
-                    "temperature": 0.7,
-                    "stream": streaming_enabled
-                },
-                timeout=45,
-                stream=streaming_enabled
-            )
-
-            if response.status_code == 200:
-                if streaming_enabled:
-                    # Handle streaming response
-                    print(f"\n💡 (🧠 Model: {model})\n", end='', flush=True)
-                    full_content = ""
-                    
-                    for line in response.iter_lines():
-                        if line:
-                            line_text = line.decode('utf-8')
-                            if line_text.startswith('data: '):
-                                data_str = line_text[6:]
-                                if data_str.strip() == '[DONE]':
-                                    break
-                                try:
-                                    data = json.loads(data_str)
-                                    if 'choices' in data and len(data['choices']) > 0:
-                                        delta = data['choices'][0].get('delta', {})
-                                        content_chunk = delta.get('content', '')
-                                        if content_chunk:
-                                            print(content_chunk, end='', flush=True)
-                                            full_content += content_chunk
-                                except json.JSONDecodeError:
-                                    continue
-                    print()
-                    
-                    if full_content:
-                        memory.add_message("user", prompt.strip())
-                        memory.add_message("assistant", full_content)
-                        return None
-                    else:
-                        print(f"\n⚠️ Empty response from {model}, trying next...")
-                        continue
-                else:
-                    data = response.json()
-                    if "choices" in data and len(data["choices"]) > 0:
-                        content = data["choices"][0]["message"].get("content", "").strip()
-                        if content:
-                            memory.add_message("user", prompt.strip())
-                            memory.add_message("assistant", content)
-                            return f"(🧠 Model: {model})\n{content}"
-                        else:
-                            print(f"⚠️ Empty response from {model}, trying next...")
-                            continue
-                    else:
-                        print(f"⚠️ Unexpected format from {model}")
-                        continue
-
-            elif response.status_code == 429:
-                print(f"⚠️ Rate limit for {model}, retrying next model...")
-                time.sleep(2)
-                continue
-            else:
-                print(f"❌ API Error {response.status_code}: {response.text[:200]}")
-                continue
+            model, content = get_openrouter_client(api_key).complete(
+                messages, MODELS, stream=stream, on_start=on_start, on_token=on_token, **options)
+        except StreamInterrupted as e:
+            # The partial answer is already on screen: flag it, keep it in memory, never cache it
+            model, content, partial = e.model, e.partial + INTERRUPTED_NOTE, True
+            if on_token:
+                on_token(INTERRUPTED_NOTE)
 
-        except requests.exceptions.Timeout:
-            print(f"⏱️ Timeout on model {model}, trying next...")
-            continue
-        except Exception as e:
-            print(f"❌ Unexpected error on {model}: {e}")
-            continue
+    if use_cache and session.use_response_cache and not tools_used and not partial:
+        response_cache.store(prompt, system_prompt, rag_context, model, content, question_vector, history)
+
+    # The raw question is stored: RAG context is re-fetched per turn rather than replayed from history
+    session.pending_tool_output = []
+    session.memory.add_message("user", prompt.strip())
+    session.memory.add_message("assistant", content)
+    return model, content
+
+
+def ask_agent(prompt, api_key, session=None):
+    """Ask AI with conversation context, RAG integration, and streaming support."""
+    session = session or get_cli_session()
+    prefetched = prefetch_if_queued(prompt, session)
 
-    return "❌ All models are currently unavailable. Please try again later."
+    try:
+        with session.lock:
+            if session.streaming:
+                sink = TerminalSink()
+                if STREAM_LOG:
+                    sink = TeeSink(sink, FileSink(STREAM_LOG))
+                try:
+                    generate_reply(prompt, api_key, session, stream=True, on_token=sink.write, on_start=sink.start,
+                                   prefetched=prefetched)
+                finally:
+                    sink.close()
+                print()
+                return None
+            model, content = generate_reply(prompt, api_key, session, stream=False, prefetched=prefetched)
+    except AllModelsFailed:
+        return "❌ All models are currently unavailable. Please try again later."
+    return f"(🧠 Model: {model})\n{content}"
 
 
 def run_local_command(command):
     """Safely execute small local commands."""
-    try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=10)
-        return result.stdout.strip() or result.stderr.strip() or "✅ Command executed successfully (no output)"
-    except Exception as e:
-        return f"❌ Command error: {e}"
+    return format_results([tool_executor.call("run", command)])
 
 def read_file(path):
     """Read contents of a local file (text only)."""
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()[:1000]
-    except Exception as e:
-        return f"❌ File read error: {e}"
+    return format_results([tool_executor.call("read", path)])
 
 def fetch_url(url):
     """Fetch data from a URL."""
+    return format_results([tool_executor.call("fetch", url)])
+
+def _split_targets(argument):
+    """Paths or URLs of a fan-out command; quote paths that contain spaces."""
+    if os.path.exists(argument):
+        return [argument]
     try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            return r.text[:1000]
-        else:
-            return f"❌ HTTP {r.status_code} - {r.text[:200]}"
-    except Exception as e:
-        return f"❌ Fetch error: {e}"
+        return shlex.split(argument)
+    except ValueError:
+        return argument.split()
 
-def handle_command(user_input):
+def run_tools(session, tool, targets):
+    """Run one tool over several targets in parallel and attach the outputs to the next prompt."""
+    results = tool_executor.execute([(tool, target) for target in targets])
+    merged = merge_for_prompt(results)
+    if merged:
+        session.pending_tool_output.append(merged)
+    output = format_results(results)
+    if merged:
+        output += "\n\n📎 Attached to your next message (/detach to drop it)"
+    return output
+
+def submit_background(command):
+    """Queue a /bg job: "/index <pdf, folder or glob> [collection]", a task command or a shell command."""
+    queue = get_job_queue()
+    queue.start()
+    if command.startswith("/index "):
+        try:
+            args = shlex.split(command.split(" ", 1)[1])
+        except ValueError:
+            args = command.split()[1:]
+        if not args:
+            return "❌ Usage: /bg /index <pdf, folder or glob> [collection]"
+        job_id = submit_index(queue, args[0], args[1] if len(args) > 1 else None)
+    elif command.startswith("/"):
+        name = command.split()[0]
+        if get_task_registry().get(name) is None:
+            return f"❌ Unknown task: {name} (see /tasks)"
+        job_id = queue.submit("task", {"command": command}, label=command)
+    else:
+        job_id = submit_shell(queue, command)
+    return f"🧵 Job #{job_id} queued – /job {job_id} to follow it, /cancel {job_id} to stop it"
+
+
+def handle_command(user_input, session=None):
     """Detect and execute local commands."""
-    global current_system_prompt
+    session = session or get_cli_session()
     
     if user_input.startswith("/read "):
-        path = user_input.split(" ", 1)[1].strip()
-        return read_file(path)
+        paths = _split_targets(user_input.split(" ", 1)[1].strip())
+        return run_tools(session, "read", paths)
     elif user_input.startswith("/fetch "):
-        url = user_input.split(" ", 1)[1].strip()
-        return fetch_url(url)
+        urls = _split_targets(user_input.split(" ", 1)[1].strip())
+        return run_tools(session, "fetch", urls)
     elif user_input.startswith("/run "):
         cmd = user_input.split(" ", 1)[1].strip()
-        return run_local_command(cmd)
+        return run_tools(session, "run", [cmd])
+    elif user_input == "/detach":
+        session.pending_tool_output = []
+        return "✅ Attached tool output dropped"
     elif user_input == "/history":
-        return memory.show_history()
+        return session.memory.show_history()
     elif user_input == "/clear":
-        memory.clear()
+        session.memory.clear()
+        session.pending_tool_output = []
         return "✅ Conversation memory cleared"
     elif user_input == "/prompts":
         output = "🎭 Available system prompts:\n" + "="*50 + "\n"
         for name, prompt in SYSTEM_PROMPTS.items():
-            marker = "👉" if name == current_system_prompt else "  "
+            marker = "👉" if name == session.system_prompt else "  "
             output += f"{marker} {name}: {prompt}\n"
+        if session.custom_prompt:
+            marker = "👉" if session.system_prompt == "custom" else "  "
+            output += f"{marker} custom: {session.custom_prompt}\n"
         return output
     elif user_input.startswith("/prompt "):
         prompt_name = user_input.split(" ", 1)[1].strip()
         if prompt_name in SYSTEM_PROMPTS:
-            current_system_prompt = prompt_name
+            session.system_prompt = prompt_name
             return f"✅ System prompt changed to: {prompt_name}\n💡 '{SYSTEM_PROMPTS[prompt_name]}'"
         else:
             return f"❌ Unknown prompt: {prompt_name}\nUse /prompts to see available options"
     elif user_input.startswith("/custom "):
         custom_prompt = user_input.split(" ", 1)[1].strip()
-        SYSTEM_PROMPTS["custom"] = custom_prompt
-        current_system_prompt = "custom"
+        session.custom_prompt = custom_prompt
+        session.system_prompt = "custom"
         return f"✅ Custom system prompt set:\n💡 '{custom_prompt}'"
+    elif user_input == "/tokens":
+        if not session.requests:
+            return "📭 No requests sent yet."
+        last = session.last_context
+        return (
+            "🧮 Context tokens:\n" + "="*50 + "\n"
+            f"Last request: {last['total']}/{last['budget']} tokens "
+            f"(system {last['system']}, summary {last['summary']}, history {last['history']} in "
+            f"{last['history_messages']} msgs, RAG {last['rag']}, prompt {last['prompt']})\n"
+            f"Session: {session.tokens_sent} tokens over {session.requests} requests "
+            f"(avg {session.tokens_sent // session.requests})\n"
+        )
+    elif user_input == "/models":
+        return model_router.report()
+    elif user_input == "/cache on" or user_input == "/cache off":
+        session.use_response_cache = user_input.endswith("on")
+        return f"⚡ Response cache {'enabled' if session.use_response_cache else 'bypassed'} for this session."
+    elif user_input == "/cache clear":
+        response_cache.clear()
+        return "🧹 Response cache cleared."
+    elif user_input == "/cache":
+        stats = query_cache.stats()
+        responses = response_cache.stats()
+        return (
+            "⚡ Knowledge base query cache:\n" + "="*50 + "\n"
+            f"Results:    {stats['result_hits']} hits / {stats['result_misses']} misses "
+            f"({stats['result_hit_rate']:.0%} hit rate, {stats['results_cached']} cached)\n"
+            f"Embeddings: {stats['embedding_hits']} hits / {stats['embedding_misses']} misses "
+            f"({stats['embeddings_cached']} cached)\n"
+            f"Disk hits:  {stats['disk_hits']} | Invalidations: {stats['invalidations']}\n"
+            "\n💬 Response cache" + ("" if session.use_response_cache else " (bypassed)") + ":\n" + "="*50 + "\n"
+            f"Hits:       {responses['exact_hits']} exact + {responses['semantic_hits']} similar / "
+            f"{responses['misses']} misses ({responses['hit_rate']:.0%} hit rate)\n"
+            f"Stored:     {responses['entries']} answers | {responses['evictions']} evicted | "
+            f"{responses['bypassed']} bypassed\n"
+            f"Scope:      system prompt, RAG context and the last {responses['history_turns']} exchange(s)\n"
+        )
+    elif user_input == "/tasks":
+        return get_task_registry().describe()
+    elif user_input.startswith("/bg "):
+        return submit_background(user_input.split(" ", 1)[1].strip())
+    elif user_input == "/jobs":
+        return get_job_queue().report()
+    elif user_input.startswith("/job "):
+        job_id = user_input.split(" ", 1)[1].strip().lstrip("#")
+        return get_job_queue().describe(int(job_id)) if job_id.isdigit() else "❌ Usage: /job <id>"
+    elif user_input.startswith("/cancel "):
+        job_id = user_input.split(" ", 1)[1].strip().lstrip("#")
+        return get_job_queue().cancel(int(job_id)) if job_id.isdigit() else "❌ Usage: /cancel <id>"
+    elif user_input == "/routing":
+        return rag_router.report()
+    elif user_input == "/stats":
+        return metrics.report()
+    elif user_input == "/stats reset":
+        metrics.reset()
+        return "🧹 Timings reset."
+    elif user_input.startswith("/stats export "):
+        path = user_input.split(" ", 2)[2].strip()
+        try:
+            metrics.export(path)
+        except OSError as e:
+            return f"❌ Could not write {path}: {e}"
+        return f"📤 Timings written to {path} ({'JSON' if path.endswith('.json') else 'Prometheus text'})"
     elif user_input == "/help":
         return (
             "🧩 Commands available:\n"
-            "/read <path>   – Read local file\n"
+            "/read <path>…  – Read local files (in parallel)\n"
             "/rag           – Query indexed pdf\n"
-            "/fetch <url>   – Fetch content from the web\n"
-            "/run <cmd>     – Run simple local command\n"
+            "/cache         – Show knowledge base and response cache counters\n"
+            "/cache on|off|clear – Use, bypass or empty the response cache\n"
+            "/models        – Show model health and routing order\n"
+            "/routing       – Show knowledge-base routing decisions and the retrieval time they saved\n"
+            "/tokens        – Show context tokens sent per request\n"
+            "/stats         – Show p50/p95/p99 latency per pipeline stage (/stats reset, /stats export <file>)\n"
+            "/fetch <url>…  – Fetch web pages (in parallel)\n"
+            "/run <cmd>     – Run simple local command (10s limit; /bg for longer ones)\n"
+            "/bg <cmd>      – Run in the background: a shell command, /index <pdf> [collection] or a task\n"
+            "/jobs          – List background jobs (/job <id> for details and output, /cancel <id>)\n"
+            "/detach        – Drop tool output attached to the next message\n"
+            "/tasks         – List tasks (/list_files, /disk_usage, /test_plan <feature>, …)\n"
             "/history       – Show conversation history\n"
             "/clear         – Clear conversation memory\n"
             "/prompts       – List available system prompts\n"
@@ -295,24 +664,40 @@ def handle_command(user_input):
             "/quit or exit  – Exit and save\n"
         )
     else:
-        return None
+        return get_task_registry().dispatch(user_input)
+
+def _note_unfinished_jobs():
+    unfinished = get_job_queue().unfinished()
+    if unfinished:
+        print(f"🧵 {unfinished} background job(s) unfinished; queued ones run when the agent "
+              "or `python job_queue.py work` next starts.")
+
 
 def main():
     print("🤖 Task Agent + Memory + Tools + Custom Prompts + Streaming")
     print("✅ Commands: /help /stream /prompts /prompt /custom /history /clear\n")
-    print(f"🎭 Current mode: {current_system_prompt}")
-    print(f"🌊 Streaming: {'enabled ✅' if streaming_enabled else 'disabled ❌'}\n")
+    session = get_cli_session()
+    print(f"🎭 Current mode: {session.system_prompt}")
+    print(f"🌊 Streaming: {'enabled ✅' if session.streaming else 'disabled ❌'}\n")
 
     if not api_key:
         print("❌ Missing OPENROUTER_API_KEY in your .env file")
         return
 
+    if RAG_WARMUP:
+        warm_up()  # Loads while the user types the first prompt
+    get_job_queue().start()  # Also resumes jobs left queued by an earlier run
+
     try:
         while True:
+            if PIPELINE:
+                get_openrouter_client(api_key).warm_up()  # Connect while the user types
             user_input = input("\n🧩 > ").strip()
             if user_input.lower() in ["exit", "quit", "/quit"]:
                 print("\n💾 Saving conversation...")
-                memory.save_history()
+                session.memory.save_history()
+                model_router.save()
+                _note_unfinished_jobs()
                 print("👋 Goodbye!")
                 break
             if not user_input:
@@ -332,7 +717,9 @@ def main():
     
     except KeyboardInterrupt:
         print("\n\n💾 Saving conversation...")
-        memory.save_history()
+        session.memory.save_history()
+        model_router.save()
+        _note_unfinished_jobs()
         print("👋 Goodbye!")
 
 if __name__ == "__main__":
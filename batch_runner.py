@@ -0,0 +1,233 @@
+# batch_runner.py
+"""Answer a JSONL file of questions offline, concurrently, writing one JSON line per answer.
+
+Input lines look like {"id": "q1", "prompt": "..."} ("question" is accepted too; the line
+number is used when there is no id). Output lines carry the answer, the model used,
+latency and token counts. The run is resumable: ids already answered in the output file
+are skipped, so an interrupted run simply picks up where it stopped.
+
+    python batch_runner.py questions.jsonl answers.jsonl --concurrency 8 --rpm 20 --rpm-model mistralai/mistral-7b-instruct=60
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+import async_runtime
+import basic_agent_cloud as agent
+import rag_pdf_loader as rag
+from rag_router import router as rag_router
+from openrouter_client import OpenRouterClient, AllModelsFailed
+from context_builder import build_context, context_budget, count_tokens
+
+BATCH_SIZE = 64  # Questions read, embedded and retrieved together; at most two batches are in memory
+CONCURRENCY = 4  # LLM requests in flight
+DEFAULT_RPM = 20  # Requests per minute per model (OpenRouter free tier)
+
+
+class RateLimiter:
+    """Spaces request starts per model so each stays under its requests-per-minute limit."""
+
+    def __init__(self, per_minute=DEFAULT_RPM, overrides=None):
+        self.per_minute = per_minute
+        self.overrides = overrides or {}
+        self._next_slot = {}
+        self._locks = {}
+
+    async def acquire(self, model):
+        rate = self.overrides.get(model, self.per_minute)
+        if not rate:
+            return
+        lock = self._locks.setdefault(model, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            slot = max(now, self._next_slot.get(model, now))
+            self._next_slot[model] = slot + 60.0 / rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+
+def read_batches(path, batch_size):
+    """Yield lists of {"id", "prompt"} from a JSONL file without loading it whole."""
+    batch = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠️ Skipping malformed line {line_number}")
+                continue
+            prompt = item.get("prompt") or item.get("question")
+            if not prompt:
+                continue
+            batch.append({"id": str(item.get("id", line_number)), "prompt": prompt})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def completed_ids(path):
+    """Ids that already have an answer in the output file."""
+    done = set()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn last line of an interrupted run
+                if not record.get("error"):
+                    done.add(record["id"])
+    return done
+
+
+def attach_rag_context(batch, use_rag):
+    """Retrieve knowledge-base context for the batch, embedding all its prompts in one encode call.
+
+    rag_router decides from those embeddings which prompts are worth a search.
+    """
+    for item in batch:
+        item["rag_context"] = ""
+    if not use_rag or not rag.retrieval_service.available():
+        return
+    embeddings = rag.get_embeddings([item["prompt"] for item in batch])
+    if embeddings is None:
+        return
+    for item, embedding in zip(batch, embeddings):
+        started = time.perf_counter()
+        route = rag_router.decide(embedding)
+        route.seconds = time.perf_counter() - started
+        if not route.retrieve:
+            rag_router.record(route, item["prompt"])
+            continue
+        started = time.perf_counter()
+        try:
+            hits = rag.retrieve(item["prompt"], 3, embedding, collections=route.collections or None)
+        except Exception as e:
+            print(f"⚠️ RAG retrieval failed for {item['id']}: {e}")
+            rag_router.record(route, item["prompt"])
+            continue
+        rag_router.record(route, item["prompt"], time.perf_counter() - started)
+        if hits:
+            item["rag_context"] = rag.format_hits(hits)
+
+
+class BatchRunner:
+    def __init__(self, output_path, client, system_prompt, concurrency=CONCURRENCY,
+                 max_tokens=500, temperature=0.7, hedge=False):
+        self.output_path = output_path
+        self.client = client
+        self.system_prompt = system_prompt
+        self.concurrency = concurrency
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.hedge = hedge
+        self.budget = context_budget(agent.MODELS, max_tokens)
+        self.counts = {"answered": 0, "failed": 0, "skipped": 0}
+        self._write_lock = threading.Lock()
+        self._semaphore = None
+
+    def _write(self, record):
+        with self._write_lock:
+            with open(self.output_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.counts["failed" if record["error"] else "answered"] += 1
+
+    async def _answer(self, item):
+        async with self._semaphore:
+            messages, _, report = build_context(self.system_prompt, [], item["prompt"], self.budget, item["rag_context"])
+            started = time.perf_counter()
+            record = {"id": item["id"], "prompt": item["prompt"], "answer": None, "model": None,
+                      "latency": None, "prompt_tokens": report["total"], "completion_tokens": 0,
+                      "rag": bool(item["rag_context"]), "error": None}
+            try:
+                model, content = await self.client.chat(
+                    messages, agent.MODELS, stream=False, hedge=self.hedge,
+                    max_tokens=self.max_tokens, temperature=self.temperature)
+                record.update(answer=content, model=model, completion_tokens=count_tokens(content))
+            except AllModelsFailed as e:
+                record["error"] = "; ".join(f"{error.model}: {error}" for error in e.errors) or str(e)
+            except Exception as e:
+                record["error"] = f"unexpected error: {e}"
+            record["latency"] = round(time.perf_counter() - started, 3)
+            self._write(record)
+
+    async def run_batch(self, batch):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._answer(item) for item in batch))
+
+
+def run(input_path, output_path, concurrency=CONCURRENCY, batch_size=BATCH_SIZE, rpm=DEFAULT_RPM,
+        rpm_overrides=None, prompt_name=agent.DEFAULT_SYSTEM_PROMPT, use_rag=True, max_tokens=500, hedge=False):
+    if not agent.api_key:
+        print("❌ Missing OPENROUTER_API_KEY in your .env file")
+        return None
+    done = completed_ids(output_path)
+    if done:
+        print(f"⏭️ Resuming: {len(done)} questions already answered")
+
+    client = OpenRouterClient(agent.api_key, hedge_delay=agent.HEDGE_DELAY, router=agent.model_router,
+                              rate_limiter=RateLimiter(rpm, rpm_overrides))
+    runner = BatchRunner(output_path, client, agent.SYSTEM_PROMPTS[prompt_name], concurrency,
+                         max_tokens=max_tokens, hedge=hedge)
+    started = time.perf_counter()
+    in_flight = None
+    try:
+        for batch in read_batches(input_path, batch_size):
+            todo = [item for item in batch if item["id"] not in done]
+            runner.counts["skipped"] += len(batch) - len(todo)
+            if not todo:
+                continue
+            attach_rag_context(todo, use_rag)  # Overlaps with the previous batch's LLM calls
+            if in_flight is not None:
+                in_flight.result()
+                _print_progress(runner.counts, started)
+            in_flight = async_runtime.submit(runner.run_batch(todo))
+        if in_flight is not None:
+            in_flight.result()
+    except KeyboardInterrupt:
+        if in_flight is not None:
+            in_flight.cancel()
+        print("\n⏸️ Interrupted; run again with the same output file to resume.")
+    finally:
+        agent.model_router.save()
+        async_runtime.run(client.aclose())
+    _print_progress(runner.counts, started)
+    return runner.counts
+
+
+def _print_progress(counts, started):
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(f"✅ {counts['answered']} answered, {counts['failed']} failed, {counts['skipped']} skipped "
+          f"| {counts['answered'] / elapsed:.2f} questions/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("output", help="JSONL file to append answers to")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM, help="requests per minute per model (0 = no limit)")
+    parser.add_argument("--rpm-model", action="append", default=[], metavar="MODEL=RPM",
+                        help="per-model override, repeatable")
+    parser.add_argument("--prompt", default=agent.DEFAULT_SYSTEM_PROMPT, choices=sorted(agent.SYSTEM_PROMPTS))
+    parser.add_argument("--max-tokens", type=int, default=500)
+    parser.add_argument("--no-rag", action="store_true", help="don't query the knowledge base")
+    parser.add_argument("--hedge", action="store_true", help="race slow models (more requests per question)")
+    args = parser.parse_args()
+
+    overrides = {}
+    for spec in args.rpm_model:
+        model, _, value = spec.rpartition("=")
+        overrides[model] = float(value)
+    run(args.input, args.output, args.concurrency, args.batch_size, args.rpm, overrides,
+        args.prompt, not args.no_rag, args.max_tokens, args.hedge)
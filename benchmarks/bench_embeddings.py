@@ -0,0 +1,96 @@
+# benchmarks/bench_embeddings.py
+"""Compare embedding backends: load time, query latency, batch throughput and retrieval recall.
+
+Recall@k is measured against the first backend listed (the PyTorch reference by default):
+the share of its top-k neighbours, over a synthetic policy corpus, that each backend also
+returns. Run each thread count you are considering:
+
+    python benchmarks/bench_embeddings.py [--backends torch,onnx,onnx-int8] [--threads 1,4] [--json]
+
+Set RAG_ONNX_MODEL_DIR to use local ONNX files instead of the Hub. Torch runs on the CPU
+like ONNX unless RAG_EMBEDDING_DEVICE says otherwise.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from embedding_backends import create_backend  # noqa: E402
+from bench_retrieval import make_corpus, percentile  # noqa: E402
+
+
+def top_k(corpus_vectors, query_vectors, k):
+    return np.argsort(-(query_vectors @ corpus_vectors.T), axis=1)[:, :k]
+
+
+def measure(name, threads, texts, queries, batch_size):
+    started = time.perf_counter()
+    backend = create_backend(name, threads, os.getenv("RAG_ONNX_MODEL_DIR"), os.getenv("RAG_EMBEDDING_DEVICE", "cpu"))
+    load_time = time.perf_counter() - started
+    backend.encode(texts[:batch_size], batch_size)  # Warm-up
+
+    started = time.perf_counter()
+    corpus_vectors = backend.encode(texts, batch_size)
+    batch_time = time.perf_counter() - started
+
+    latencies, query_vectors = [], []
+    for query in queries:
+        started = time.perf_counter()
+        query_vectors.append(backend.encode([query])[0])
+        latencies.append(time.perf_counter() - started)
+    return {
+        "backend": name, "threads": threads or "default", "load_seconds": load_time,
+        "texts_per_sec": len(texts) / batch_time, "query_p50": percentile(latencies, 50),
+        "query_p95": percentile(latencies, 95),
+    }, corpus_vectors, np.array(query_vectors)
+
+
+def run(backends, thread_counts, docs, n_queries, k, batch_size):
+    corpus = make_corpus(docs, seed=7)
+    texts = [text for _, _, _, text in corpus]
+    queries = [f"What does regulation {reg_id} say about {topic}?" for _, reg_id, topic, _ in corpus[:n_queries]]
+
+    results, reference = [], None
+    for name in backends:
+        for threads in thread_counts:
+            report, corpus_vectors, query_vectors = measure(name, threads, texts, queries, batch_size)
+            neighbours = top_k(corpus_vectors, query_vectors, k)
+            if reference is None:
+                reference = (corpus_vectors, neighbours)
+            report["recall_at_k"] = float(np.mean([len(set(mine) & set(theirs)) / k
+                                                   for mine, theirs in zip(neighbours, reference[1])]))
+            if corpus_vectors.shape == reference[0].shape:
+                report["mean_cosine_to_reference"] = float(np.mean(np.sum(corpus_vectors * reference[0], axis=1)))
+            results.append(report)
+    return {"docs": docs, "queries": n_queries, "k": k, "reference": backends[0], "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--threads", default="0", help="comma-separated thread counts; 0 = library default")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    report = run(args.backends.split(","), [int(t) or None for t in args.threads.split(",")],
+                 args.docs, args.queries, args.k, args.batch_size)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"\n🧪 {report['docs']} chunks, {report['queries']} queries, recall@{report['k']} vs {report['reference']}")
+        for row in report["results"]:
+            cosine = row.get("mean_cosine_to_reference")
+            print(f"  {row['backend']:<10} threads {str(row['threads']):<8} load {row['load_seconds']:.1f}s | "
+                  f"{row['texts_per_sec']:.0f} texts/s | query p50 {row['query_p50'] * 1000:.1f} ms "
+                  f"p95 {row['query_p95'] * 1000:.1f} ms | recall {row['recall_at_k']:.1%}"
+                  + (f" | cosine {cosine:.4f}" if cosine is not None else ""))
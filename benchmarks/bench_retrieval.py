@@ -0,0 +1,99 @@
+# benchmarks/bench_retrieval.py
+"""Recall and latency of dense-only vs hybrid (BM25 + vector) vs reranked retrieval.
+
+Builds a synthetic policy corpus in a temporary knowledge base: every chunk describes
+one regulation with a unique number (e.g. "Regulation 4471.2") over boilerplate text,
+and each query asks for one of them by number, the case dense embeddings handle worst.
+
+    python benchmarks/bench_retrieval.py [--docs 500] [--queries 100] [--k 3] [--json]
+
+Set RAG_RERANK_MODEL to include the cross-encoder stage.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ["data retention", "remote access", "expense claims", "incident reporting", "vendor onboarding",
+          "password rotation", "travel approval", "records disposal", "access reviews", "backup testing"]
+FILLER = ("Staff must follow the procedure described here and keep evidence of compliance. "
+          "Managers review exceptions every quarter and escalate repeated breaches to the compliance team. ")
+
+
+def make_corpus(docs, seed):
+    rng = random.Random(seed)
+    numbers = rng.sample(range(1000, 9999), docs)
+    corpus = []
+    for i, number in enumerate(numbers):
+        reg_id = f"{number}.{rng.randint(1, 9)}"
+        topic = rng.choice(TOPICS)
+        text = f"Regulation {reg_id} ({topic}): {FILLER * 2}Policy {reg_id} applies to all {topic} cases."
+        corpus.append((f"bench_{i}", reg_id, topic, text))
+    return corpus
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(docs, queries, k, seed):
+    os.environ["RAG_DB_PATH"] = tempfile.mkdtemp(prefix="bench_retrieval_")
+    sys.path.insert(0, REPO_ROOT)
+    import rag_pdf_loader as rag
+
+    corpus = make_corpus(docs, seed)
+    collection = rag.get_chroma_client().get_or_create_collection(name=rag.COLLECTION_NAME)
+    ids = [chunk_id for chunk_id, _, _, _ in corpus]
+    texts = [text for _, _, _, text in corpus]
+    started = time.perf_counter()
+    embeddings = rag.get_embeddings(texts)
+    collection.add(ids=ids, documents=texts, embeddings=embeddings,
+                   metadatas=[{"source": "bench", "chunk_index": i} for i in range(len(ids))])
+    rag.get_keyword_index().add(ids, texts)
+    build_time = time.perf_counter() - started
+
+    rng = random.Random(seed + 1)
+    sample = rng.sample(corpus, min(queries, len(corpus)))
+    modes = {"dense": {"hybrid": False, "rerank": False}, "hybrid": {"hybrid": True, "rerank": False}}
+    if rag.RERANK_MODEL:
+        modes["hybrid+rerank"] = {"hybrid": True, "rerank": True}
+
+    report = {"docs": docs, "queries": len(sample), "k": k, "build_seconds": build_time, "modes": {}}
+    for name, options in modes.items():
+        hits, latencies = 0, []
+        for chunk_id, reg_id, topic, _ in sample:
+            query = f"What does regulation {reg_id} say about {topic}?"
+            started = time.perf_counter()
+            results = rag.retrieve(query, k, **options)
+            latencies.append(time.perf_counter() - started)
+            hits += any(hit["id"] == chunk_id for hit in results or [])
+        report["modes"][name] = {"recall_at_k": hits / len(sample),
+                                 "latency_p50": percentile(latencies, 50),
+                                 "latency_p95": percentile(latencies, 95)}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    report = run(args.docs, args.queries, args.k, args.seed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"\n📚 {report['docs']} chunks indexed in {report['build_seconds']:.1f}s, "
+              f"{report['queries']} queries, recall@{report['k']}")
+        for name, stats in report["modes"].items():
+            print(f"  {name:<14} recall {stats['recall_at_k']:.2%} | p50 {stats['latency_p50'] * 1000:.1f} ms | "
+                  f"p95 {stats['latency_p95'] * 1000:.1f} ms")
@@ -0,0 +1,83 @@
+# benchmarks/bench_server_load.py
+"""Load-test a running agent_server: requests/sec and latency percentiles under concurrency.
+
+Each virtual user keeps its own session (X-Session-Id) and sends chat turns back to
+back for the given duration. Point OPENROUTER_URL of the server at a mock upstream
+to measure the server itself rather than OpenRouter.
+
+    python benchmarks/bench_server_load.py --url http://127.0.0.1:8000 --users 32 --duration 20 [--stream]
+"""
+import json
+import time
+import uuid
+import asyncio
+import argparse
+
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def virtual_user(client, url, deadline, stream, prompt, results):
+    session_id = uuid.uuid4().hex
+    body = {"model": "agent", "stream": stream, "messages": [{"role": "user", "content": prompt}]}
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        ttft = None
+        try:
+            async with client.stream("POST", f"{url}/v1/chat/completions", json=body,
+                                     headers={"X-Session-Id": session_id}) as response:
+                async for _ in response.aiter_bytes():
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        results.append((ok, time.perf_counter() - started, ttft))
+
+
+async def run_load(url, users, duration, stream, prompt):
+    results = []
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*(virtual_user(client, url, deadline, stream, prompt, results) for _ in range(users)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for ok, latency, _ in results if ok]
+    ttfts = [ttft for ok, _, ttft in results if ok and ttft is not None]
+    return {
+        "users": users, "duration": elapsed, "stream": stream,
+        "requests": len(results), "errors": sum(1 for ok, _, _ in results if not ok),
+        "requests_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 50), "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99), "ttft_p50": percentile(ttfts, 50),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--prompt", default="Say hello in one sentence.")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(args.url.rstrip("/"), args.users, args.duration, args.stream, args.prompt))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        def ms(value):
+            return f"{value * 1000:.0f} ms" if value is not None else "n/a"
+        print(f"🌐 {report['requests']} requests ({report['errors']} errors) from {args.users} users "
+              f"in {report['duration']:.1f}s")
+        print(f"🚀 {report['requests_per_sec']:.1f} req/s | p50 {ms(report['latency_p50'])} | "
+              f"p95 {ms(report['latency_p95'])} | p99 {ms(report['latency_p99'])} | TTFT p50 {ms(report['ttft_p50'])}")
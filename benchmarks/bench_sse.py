@@ -0,0 +1,184 @@
+# benchmarks/bench_sse.py
+"""Micro-benchmark of streamed-completion parsing on a recorded SSE stream.
+
+Compares the old per-line approach (decode every line, json.loads the str,
+`full_content += chunk`) with sse_parser.SSEParser (byte-buffer framing, only field
+values decoded, chunks joined once), both in memory and through an httpx response as
+OpenRouterClient reads it (aiter_lines before, aiter_bytes + SSEParser now). The stream
+is replayed in randomly sized network chunks so lines and CRLFs are split across reads,
+as they are on a real connection. JSON decoding is included, as it is per token.
+
+    python benchmarks/bench_sse.py [--tokens 20000] [--repeat 5] [--recording stream.sse] [--json]
+
+A real recording can be captured with
+`curl -N https://openrouter.ai/api/v1/chat/completions -H "Authorization: Bearer $KEY" -d '{..., "stream": true}' > stream.sse`.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from sse_parser import SSEParser, DONE  # noqa: E402
+
+WORDS = ["the", "policy", "applies", "to", "all", "staff", "and", "contractors", "who", "handle",
+         "customer", "records,", "including", "backups", "stored", "off-site.", "\n\n", "Exceptions", "need"]
+
+
+def make_recording(tokens, seed):
+    """An OpenRouter-style stream: keep-alive comments, one data event per token, CRLF line ends."""
+    rng = random.Random(seed)
+    parts = [b": OPENROUTER PROCESSING\r\n\r\n"] * 3
+    for i in range(tokens):
+        if i % 500 == 0:
+            parts.append(b": OPENROUTER PROCESSING\r\n\r\n")
+        chunk = {"id": "gen-bench", "object": "chat.completion.chunk", "created": 1700000000,
+                 "model": "mistralai/mistral-7b-instruct",
+                 "choices": [{"index": 0, "delta": {"role": "assistant", "content": rng.choice(WORDS) + " "},
+                              "finish_reason": None}]}
+        parts.append(b"data: " + json.dumps(chunk).encode() + b"\r\n\r\n")
+    parts.append(b"data: [DONE]\r\n\r\n")
+    return b"".join(parts)
+
+
+def split_reads(data, seed, low=16, high=1400):
+    rng = random.Random(seed)
+    reads, position = [], 0
+    while position < len(data):
+        size = rng.randint(low, high)
+        reads.append(data[position:position + size])
+        position += size
+    return reads
+
+
+def _content(data, append):
+    if data.get("choices"):
+        content_chunk = data["choices"][0].get("delta", {}).get("content")
+        if content_chunk:
+            append(content_chunk)
+
+
+def parse_line_based(reads):
+    """The old ask_agent approach: str lines, json.loads per line, string concatenation."""
+    full_content = ""
+    pending = ""
+    for raw in reads:
+        pending += raw.decode("utf-8", errors="ignore")
+        lines = pending.splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line.startswith("data: "):
+                continue
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                return full_content
+            try:
+                data = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            if data.get("choices"):
+                content_chunk = data["choices"][0].get("delta", {}).get("content")
+                if content_chunk:
+                    full_content += content_chunk
+    return full_content
+
+
+def parse_incremental(reads):
+    """SSEParser on raw bytes, chunks collected in a list."""
+    parser = SSEParser()
+    parts = []
+    for raw in reads:
+        for event in parser.feed(raw):
+            if event.data == DONE:
+                return "".join(parts)
+            _content(json.loads(event.data), parts.append)
+    return "".join(parts)
+
+
+async def _replay(reads):
+    for raw in reads:
+        yield raw
+
+
+async def client_aiter_lines(reads):
+    """The previous OpenRouterClient path: httpx aiter_lines, one async step per line."""
+    parts = []
+    async for line in httpx.Response(200, content=_replay(reads)).aiter_lines():
+        if not line.startswith("data: "):
+            continue
+        if line[6:].strip() == "[DONE]":
+            break
+        try:
+            _content(json.loads(line[6:]), parts.append)
+        except json.JSONDecodeError:
+            continue
+    return "".join(parts)
+
+
+async def client_sse_parser(reads):
+    """The current OpenRouterClient path: httpx aiter_bytes into SSEParser."""
+    parser = SSEParser()
+    parts = []
+    async for raw in httpx.Response(200, content=_replay(reads)).aiter_bytes():
+        for event in parser.feed(raw):
+            if event.data == DONE:
+                return "".join(parts)
+            _content(json.loads(event.data), parts.append)
+    return "".join(parts)
+
+
+def run(tokens, repeat, seed, recording=None):
+    data = recording if recording is not None else make_recording(tokens, seed)
+    reads = split_reads(data, seed)
+    parsers = {
+        "line_based": parse_line_based,
+        "incremental": parse_incremental,
+        "client_lines": lambda reads: asyncio.run(client_aiter_lines(reads)),
+        "client_sse": lambda reads: asyncio.run(client_sse_parser(reads)),
+    }
+    expected = parse_incremental(reads)
+    events = data.count(b"data:")
+    report = {"bytes": len(data), "reads": len(reads), "answer_chars": len(expected), "parsers": {}}
+    for name, parse in parsers.items():
+        if parse(reads) != expected:
+            print(f"⚠️ {name} produced a different answer (multi-line or CR-framed events?)")
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            parse(reads)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        report["parsers"][name] = {"seconds": best, "mb_per_sec": len(data) / best / 1e6,
+                                   "us_per_event": best / max(events, 1) * 1e6}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=20000, help="tokens in the synthetic stream")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--recording", help="raw SSE bytes captured from a real stream")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    recording = None
+    if args.recording:
+        with open(args.recording, "rb") as f:
+            recording = f.read()
+    report = run(args.tokens, args.repeat, args.seed, recording)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"\n🌊 {report['bytes'] / 1e6:.1f} MB in {report['reads']} reads, {report['answer_chars']} answer chars")
+        for name, stats in report["parsers"].items():
+            print(f"  {name:<12} {stats['seconds'] * 1000:.1f} ms | {stats['mb_per_sec']:.1f} MB/s | "
+                  f"{stats['us_per_event']:.2f} µs/event")
@@ -0,0 +1,98 @@
+# benchmarks/bench_startup.py
+"""Measure agent start-up cost: import time and peak memory of basic_agent_cloud.
+
+Compares the current lazy start-up against the old eager path (importing chromadb and
+sentence_transformers and loading the embedding model at import), each in a fresh
+interpreter. Usage: python benchmarks/bench_startup.py [--runs 5] [--json]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - started
+try:
+    import resource
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_kb //= 1024
+except ImportError:
+    peak_kb = None
+print(json.dumps({{"seconds": elapsed, "peak_rss_kb": peak_kb}}))
+"""
+
+SCENARIOS = {
+    "lazy_import": "import basic_agent_cloud",
+    "eager_import": (
+        "import chromadb\n"
+        "from sentence_transformers import SentenceTransformer\n"
+        "import basic_agent_cloud\n"
+        "import rag_pdf_loader\n"
+        "rag_pdf_loader.get_embedding_model()\n"
+        "rag_pdf_loader.get_chroma_client()"
+    ),
+}
+
+
+def run_probe(body):
+    """Run one scenario in a fresh interpreter and return its measurements."""
+    code = PROBE.format(root=REPO_ROOT, body=body)
+    env = dict(os.environ, RAG_WARMUP="0")
+    with tempfile.TemporaryDirectory() as workdir:  # The agent creates its history/cache files in the cwd
+        result = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env,
+                                capture_output=True, text=True, timeout=600)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "probe failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark(runs=5):
+    """Return median seconds and peak RSS per scenario."""
+    report = {}
+    for name, body in SCENARIOS.items():
+        try:
+            samples = [run_probe(body) for _ in range(runs)]
+        except RuntimeError as e:
+            report[name] = {"error": str(e)}
+            continue
+        report[name] = {
+            "runs": runs,
+            "median_seconds": statistics.median(s["seconds"] for s in samples),
+            "min_seconds": min(s["seconds"] for s in samples),
+            "peak_rss_kb": max((s["peak_rss_kb"] or 0) for s in samples) or None,
+        }
+    lazy, eager = report.get("lazy_import", {}), report.get("eager_import", {})
+    if "median_seconds" in lazy and "median_seconds" in eager:
+        report["speedup"] = eager["median_seconds"] / max(lazy["median_seconds"], 1e-9)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    report = benchmark(args.runs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, stats in report.items():
+            if name == "speedup":
+                print(f"🚀 Lazy start-up is {stats:.1f}x faster")
+            elif "error" in stats:
+                print(f"❌ {name}: {stats['error']}")
+            else:
+                rss = f"{stats['peak_rss_kb'] / 1024:.0f} MB" if stats["peak_rss_kb"] else "n/a"
+                print(f"⏱️ {name}: {stats['median_seconds'] * 1000:.0f} ms median "
+                      f"(min {stats['min_seconds'] * 1000:.0f} ms), peak RSS {rss}")
@@ -0,0 +1,115 @@
+# benchmarks/compare.py
+"""Compare two run_all.py result files and flag regressions.
+
+Metrics ending in _seconds or _kb are better when lower, _per_sec and recall_* when
+higher; other numbers (counts, sizes, maxima) are shown but never flagged. Timings that
+moved by less than --min-delta seconds are treated as noise. Only scenarios present in
+both files are compared. Exits with status 1 when any metric got worse by more than the
+threshold, so it can gate CI.
+
+    python benchmarks/compare.py results/base.json results/new.json [--threshold 0.15] [--all]
+"""
+import sys
+import json
+import argparse
+
+MIN_DELTA_SECONDS = 0.002  # Smaller absolute changes in a timing are noise
+
+
+def flatten(tree, prefix=""):
+    flat = {}
+    for key, value in tree.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def direction(name):
+    """-1 if lower is better, +1 if higher is better, 0 if informational."""
+    leaf = name.rsplit(".", 1)[-1]
+    if leaf == "wall_seconds" or leaf.endswith("_max_seconds"):
+        return 0  # Wall time includes interpreter start-up and corpus generation; maxima are single samples
+    if leaf.endswith(("_seconds", "_kb")):
+        return -1
+    if leaf.endswith("_per_sec") or leaf.startswith("recall"):
+        return 1
+    return 0
+
+
+def compare(base, new, threshold, min_delta=MIN_DELTA_SECONDS):
+    shared = set(base["results"]) & set(new["results"])
+    base_metrics = flatten({name: base["results"][name] for name in shared})
+    new_metrics = flatten({name: new["results"][name] for name in shared})
+    rows = []
+    for name in sorted(set(base_metrics) | set(new_metrics)):
+        before, after = base_metrics.get(name), new_metrics.get(name)
+        sense = direction(name)
+        change = None
+        status = ""
+        if before is not None and after is not None and before:
+            change = (after - before) / abs(before)
+            noisy = name.endswith("_seconds") and abs(after - before) < min_delta
+            if sense and not noisy:
+                worse = change * sense < -threshold
+                better = change * sense > threshold
+                status = "regression" if worse else "improved" if better else ""
+        elif before is None:
+            status = "new"
+        elif after is None:
+            status = "missing"
+        rows.append({"metric": name, "base": before, "new": after, "change": change, "status": status})
+    return rows
+
+
+def _format(value):
+    if value is None:
+        return "–"
+    if isinstance(value, int):
+        return str(value)
+    return f"{value:.4g}"
+
+
+def _describe(meta):
+    return f"{(meta.get('commit') or '?')[:10]}{'+dirty' if meta.get('dirty') else ''}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative change that counts (default 15%%)")
+    parser.add_argument("--min-delta", type=float, default=MIN_DELTA_SECONDS,
+                        help="ignore timing changes smaller than this many seconds")
+    parser.add_argument("--all", action="store_true", help="show unchanged metrics too")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    rows = compare(base, new, args.threshold, args.min_delta)
+    skipped = sorted(set(base["results"]) ^ set(new["results"]))
+    regressions = [row for row in rows if row["status"] == "regression"]
+
+    if args.json:
+        print(json.dumps({"base": base.get("meta"), "new": new.get("meta"), "rows": rows}, indent=2))
+    else:
+        print(f"\n📊 {_describe(base.get('meta', {}))} → {_describe(new.get('meta', {}))} "
+              f"(threshold {args.threshold:.0%})")
+        if base.get("meta", {}).get("config") != new.get("meta", {}).get("config"):
+            print("⚠️ The runs used different sizes; compare with care.")
+        if skipped:
+            print(f"⏭️ Only in one run (not compared): {', '.join(skipped)}")
+        marks = {"regression": "❌", "improved": "✅", "new": "🆕", "missing": "❔", "": "  "}
+        for row in rows:
+            if not args.all and not row["status"]:
+                continue
+            change = f"{row['change']:+.1%}" if row["change"] is not None else ""
+            print(f"{marks[row['status']]} {row['metric']:<48} {_format(row['base']):>10} → "
+                  f"{_format(row['new']):>10} {change:>8}")
+        print(f"\n{len(regressions)} regression(s)" if regressions else "\n✅ No regressions")
+    sys.exit(1 if regressions else 0)
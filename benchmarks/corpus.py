@@ -0,0 +1,122 @@
+# benchmarks/corpus.py
+"""Synthetic, reproducible test data: policy-style PDFs and question files.
+
+The PDFs are written directly (one Helvetica text stream per page), so no PDF library
+is needed to create them and pdfplumber extracts the same text on every machine. Each
+paragraph describes one numbered regulation, so questions have a known answer.
+
+    python benchmarks/corpus.py policies.pdf --pages 200 [--seed 7] [--questions questions.jsonl]
+"""
+import json
+import random
+import argparse
+
+TOPICS = ["data retention", "remote access", "expense claims", "incident reporting", "vendor onboarding",
+          "password rotation", "travel approval", "records disposal", "access reviews", "backup testing"]
+SENTENCES = [
+    "Staff must follow the procedure described here and keep evidence of compliance.",
+    "Managers review exceptions every quarter and escalate repeated breaches.",
+    "Records are kept for seven years unless a longer period is required by law.",
+    "Requests are approved in writing before any work starts.",
+    "The compliance team audits a sample of cases every month.",
+]
+LINES_PER_PAGE = 48
+CHARS_PER_LINE = 90
+
+
+def make_pages(pages, seed=7):
+    """[(lines, regulations)] per page; regulations are (reg_id, topic) described on that page."""
+    rng = random.Random(seed)
+    numbers = iter(rng.sample(range(1000, 10 ** 6), pages * LINES_PER_PAGE))
+    result = []
+    for _ in range(pages):
+        lines, regulations = [], []
+        while True:
+            reg_id = f"{next(numbers)}.{rng.randint(1, 9)}"
+            topic = rng.choice(TOPICS)
+            paragraph = _wrap(f"Regulation {reg_id} ({topic}): " + " ".join(rng.sample(SENTENCES, 3)), CHARS_PER_LINE)
+            if len(lines) + len(paragraph) > LINES_PER_PAGE:
+                break  # Paragraphs never continue on the next page
+            regulations.append((reg_id, topic))
+            lines.extend(paragraph + [""])
+        result.append((lines, regulations))
+    return result
+
+
+def _wrap(text, width):
+    lines, current = [], ""
+    for word in text.split():
+        if current and len(current) + 1 + len(word) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1", "replace")
+
+
+def write_pdf(path, pages):
+    """Write a minimal PDF with one page per list of text lines."""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    next_id = 4
+    for lines in pages:
+        page_id, content_id = next_id, next_id + 1
+        next_id += 2
+        kids.append(page_id)
+        stream = b"BT /F1 9 Tf 40 760 Td 14 TL " + b" ".join(b"(" + _escape(line) + b") '" for line in lines) + b" ET"
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for object_id in range(1, next_id):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % next_id
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (next_id, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def make_pdf(path, pages=50, seed=7):
+    """Write a synthetic policy PDF; returns every (reg_id, topic) it describes."""
+    content = make_pages(pages, seed)
+    write_pdf(path, [lines for lines, _ in content])
+    return [regulation for _, regulations in content for regulation in regulations]
+
+
+def make_questions(regulations, count, seed=7):
+    """Knowledge-base questions about regulations in the corpus, as {"id", "prompt"} dicts."""
+    rng = random.Random(seed)
+    picked = rng.sample(regulations, min(count, len(regulations)))
+    return [{"id": f"q{i}", "prompt": f"What does regulation {reg_id} in the policy document say about {topic}?",
+             "reg_id": reg_id} for i, (reg_id, topic) in enumerate(picked)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="PDF file to write")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--questions", help="also write a JSONL question file for batch_runner.py")
+    parser.add_argument("--count", type=int, default=100, help="questions to write")
+    args = parser.parse_args()
+
+    regulations = make_pdf(args.output, args.pages, args.seed)
+    print(f"📄 {args.output}: {args.pages} pages, {len(regulations)} regulations")
+    if args.questions:
+        with open(args.questions, "w", encoding="utf-8") as f:
+            for question in make_questions(regulations, args.count, args.seed):
+                f.write(json.dumps(question) + "\n")
+        print(f"❓ {args.questions}: {min(args.count, len(regulations))} questions")
@@ -0,0 +1,204 @@
+# benchmarks/mock_openrouter.py
+"""Local stand-in for the OpenRouter chat completions API, for benchmarks and offline runs.
+
+Each model name gets a behaviour: answer (streamed as SSE with keep-alive comments, or
+as one JSON body), fail with an HTTP status such as 429 (with Retry-After), answer only
+after a delay, fail a share of requests at random (seeded, so runs are repeatable), or
+drop the connection partway through a streamed answer.
+Unknown models use the default behaviour.
+
+    python benchmarks/mock_openrouter.py --port 8765 --model google/gemini-2.0-flash-exp:free=429 \\
+        --model mistralai/mistral-7b-instruct=ttft:1.5,tokens:80 --model meta-llama/llama-3-8b-instruct=ttft:0.05
+
+    OPENROUTER_URL=http://127.0.0.1:8765/v1/chat/completions python basic_agent_cloud.py
+
+Specs are "<status>" or comma-separated key:value pairs (status, ttft, tokens, token_delay,
+retry_after, error_rate, cut_after). GET /stats returns request counts per model. --connect-delay
+holds every new connection before its first request, like a TLS handshake to a far host.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ["The", "policy", "requires", "records", "to", "be", "kept", "for", "seven", "years,", "and",
+         "exceptions", "must", "be", "approved", "by", "the", "compliance", "team."]
+
+
+class Behaviour:
+    def __init__(self, status=200, ttft=0.05, tokens=40, token_delay=0.0, retry_after=30, error_rate=0.0,
+                 cut_after=None):
+        self.status = status  # HTTP status to answer with; 200 = a normal completion
+        self.ttft = ttft  # Seconds before the first byte of the answer
+        self.tokens = tokens  # Content chunks per answer
+        self.token_delay = token_delay  # Seconds between streamed chunks
+        self.retry_after = retry_after  # Sent with 429 responses
+        self.error_rate = error_rate  # Share of otherwise successful requests answered with 500
+        self.cut_after = cut_after  # Streamed chunks sent before the connection is dropped; None = never
+
+    @classmethod
+    def parse(cls, spec):
+        if spec.isdigit():
+            return cls(status=int(spec))
+        options = {}
+        for pair in filter(None, spec.split(",")):
+            key, _, value = pair.partition(":")
+            options[key.strip()] = int(value) if key.strip() in ("status", "tokens", "cut_after") else float(value)
+        return cls(**options)
+
+    def __repr__(self):
+        return (f"Behaviour(status={self.status}, ttft={self.ttft}, tokens={self.tokens}, "
+                f"token_delay={self.token_delay}, error_rate={self.error_rate}, cut_after={self.cut_after})")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockOpenRouter/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        if self.server.mock.connect_delay:
+            time.sleep(self.server.mock.connect_delay)  # Once per connection: later requests reuse it
+        with self.server.mock._lock:
+            self.server.mock.connections += 1
+
+    def do_HEAD(self):
+        self.send_response(405)  # Like the real API; clients use it to open a connection early
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._json(200, self.server.mock.stats())
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        model = body.get("model", "")
+        mock = self.server.mock
+        behaviour, status = mock.decide(model)
+        if status != 200:
+            headers = {"Retry-After": str(int(behaviour.retry_after))} if status == 429 else {}
+            self._json(status, {"error": {"message": f"mock {status} for {model}", "code": status}}, headers)
+            return
+        time.sleep(behaviour.ttft)
+        words = [WORDS[i % len(WORDS)] + " " for i in range(behaviour.tokens)]
+        if not body.get("stream"):
+            self._json(200, {"id": "gen-mock", "model": model, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": "".join(words).strip()},
+                 "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": behaviour.tokens}})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._chunk(b": OPENROUTER PROCESSING\n\n")
+        for sent, word in enumerate(words):
+            if sent == behaviour.cut_after:
+                self.close_connection = True
+                return  # Mid-stream drop: the chunked body never terminates
+            event = {"id": "gen-mock", "model": model, "choices": [{"index": 0, "delta": {"content": word}}]}
+            self._chunk(b"data: " + json.dumps(event).encode() + b"\n\n")
+            if behaviour.token_delay:
+                time.sleep(behaviour.token_delay)
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockOpenRouter:
+    """The mock server; start() runs it on a background thread and returns the completions URL."""
+
+    def __init__(self, behaviours=None, default=None, host="127.0.0.1", port=0, seed=0, connect_delay=0.0):
+        self.behaviours = behaviours or {}
+        self.default = default or Behaviour()
+        self.connect_delay = connect_delay  # Seconds every new connection waits before it is served
+        self.connections = 0
+        self.requests = Counter()
+        self.failures = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def decide(self, model):
+        """Behaviour for a request and the status it gets (error_rate is drawn here)."""
+        behaviour = self.behaviours.get(model, self.default)
+        with self._lock:
+            self.requests[model] += 1
+            status = behaviour.status
+            if status == 200 and behaviour.error_rate and self._rng.random() < behaviour.error_rate:
+                status = 500
+            if status != 200:
+                self.failures[model] += 1
+        return behaviour, status
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self.requests), "failures": dict(self.failures), "connections": self.connections}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openrouter", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--model", action="append", default=[], metavar="MODEL=SPEC",
+                        help="behaviour for one model, repeatable (e.g. name=429 or name=ttft:1.5,tokens:80)")
+    parser.add_argument("--default", default="", metavar="SPEC", help="behaviour for any other model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--connect-delay", type=float, default=0.0, help="seconds added to every new connection")
+    args = parser.parse_args()
+
+    behaviours = {}
+    for item in args.model:
+        name, _, spec = item.rpartition("=")
+        behaviours[name] = Behaviour.parse(spec)
+    mock = MockOpenRouter(behaviours, Behaviour.parse(args.default), args.host, args.port, args.seed, args.connect_delay)
+    print(f"🧪 Mock OpenRouter on {mock.url}")
+    for name, behaviour in behaviours.items():
+        print(f"   {name}: {behaviour}")
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,339 @@
+# benchmarks/run_all.py
+"""Run the reproducible benchmark suite and write machine-readable results.
+
+Needs no network and no real PDF: the LLM is the local mock OpenRouter server
+(mock_openrouter.py) and the knowledge base is a synthetic PDF (corpus.py). Every
+scenario runs in a fresh interpreter inside its own temporary directory, with fixed seeds.
+
+    python benchmarks/run_all.py --out results/$(git rev-parse --short HEAD).json [--quick] [--only index,query]
+    python benchmarks/compare.py results/base.json results/new.json
+
+Scenarios:
+  startup   import time and peak RSS of basic_agent_cloud (bench_startup.py)
+  index     index_pdf throughput on a synthetic PDF, and the no-change re-index
+  query     query_knowledge latency: first query, fresh queries, repeated (cached) queries
+  shards    retrieve latency and recall over the same corpus split into 1 and 4 shards (parallel fan-out)
+  mmap      cold open + first query, latency, recall and RSS of Chroma vs the exported memory-mapped index
+  fallback  turn latency when the first model answers 429 and the second is slow (hedging and routing)
+  history   append rate and ConversationMemory load time as the history grows
+
+Time metrics end in _seconds, rates in _per_sec and memory in _kb; compare.py relies on it.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+PRESETS = {
+    "full": {"pages": 200, "query_pages": 50, "queries": 100, "turns": 30, "history_sizes": [1000, 10000, 50000],
+             "startup_runs": 5},
+    "quick": {"pages": 20, "query_pages": 10, "queries": 20, "turns": 8, "history_sizes": [1000, 5000],
+              "startup_runs": 2},
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def latency_stats(prefix, samples):
+    return {f"{prefix}_p50_seconds": percentile(samples, 50), f"{prefix}_p95_seconds": percentile(samples, 95),
+            f"{prefix}_max_seconds": max(samples) if samples else None}
+
+
+# --- scenarios (each runs in a child process, cwd = its temporary directory) ---
+
+def scenario_startup(config):
+    from bench_startup import benchmark
+    report = benchmark(config["startup_runs"])
+    report.pop("speedup", None)
+    return report
+
+
+def scenario_index(config):
+    from corpus import make_pdf
+    import rag_pdf_loader as rag
+
+    regulations = make_pdf("corpus.pdf", config["pages"])
+    rag.get_embedding_model()  # Model load is the startup scenario's business, not indexing's
+    started = time.perf_counter()
+    totals = rag.index_pdf("corpus.pdf")
+    elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    rag.index_pdf("corpus.pdf")  # Unchanged file: should be a hash check only
+    unchanged = time.perf_counter() - started
+    return {
+        "pages": config["pages"], "regulations": len(regulations), "chunks": totals["indexed"],
+        "index_seconds": elapsed, "pages_per_sec": totals["pages"] / elapsed, "chunks_per_sec": totals["indexed"] / elapsed,
+        "extract_seconds": totals["extract_time"], "embed_seconds": totals["embed_time"],
+        "write_seconds": totals["write_time"], "reindex_unchanged_seconds": unchanged,
+    }
+
+
+def scenario_query(config):
+    from corpus import make_pdf, make_questions
+    import rag_pdf_loader as rag
+
+    regulations = make_pdf("corpus.pdf", config["query_pages"])
+    rag.index_pdf("corpus.pdf")
+    rag.reset_chroma_client()  # The first query opens the collection like a fresh agent would
+    questions = make_questions(regulations, config["queries"] + 1)
+
+    started = time.perf_counter()
+    rag.query_knowledge(questions[0]["prompt"])
+    first = time.perf_counter() - started
+
+    fresh, found = [], 0
+    for question in questions[1:]:
+        started = time.perf_counter()
+        context = rag.query_knowledge(question["prompt"])
+        fresh.append(time.perf_counter() - started)
+        found += question["reg_id"] in context
+    repeated = []
+    for question in questions[1:]:
+        started = time.perf_counter()
+        rag.query_knowledge(question["prompt"])
+        repeated.append(time.perf_counter() - started)
+    report = {"queries": len(fresh), "first_query_seconds": first, "recall_at_3": found / max(len(fresh), 1)}
+    report.update(latency_stats("fresh", fresh))
+    report.update(latency_stats("cached", repeated))
+    return report
+
+
+def scenario_shards(config):
+    from corpus import make_pdf, make_questions
+    import rag_pdf_loader as rag
+
+    os.makedirs("corpus", exist_ok=True)
+    regulations = []
+    for i in range(8):  # Shards hold whole documents, so the corpus is split into several PDFs
+        regulations += make_pdf(f"corpus/part{i}.pdf", max(1, config["query_pages"] // 8), seed=i)
+    questions = make_questions(regulations, config["queries"])
+    embeddings = rag.get_embeddings([question["prompt"] for question in questions])
+    report = {"cpus": os.cpu_count()}
+    for shards in (1, 4):
+        name = f"bench-{shards}"
+        rag.index_pdf("corpus", collection=name, shards=shards)
+        rag.retrieve(questions[0]["prompt"], 3, embeddings[0], collections=name)  # Loads the HNSW segments
+        samples, found = [], 0
+        for question, embedding in zip(questions, embeddings):
+            started = time.perf_counter()
+            hits = rag.retrieve(question["prompt"], 3, embedding, collections=name)
+            samples.append(time.perf_counter() - started)
+            found += any(question["reg_id"] in hit["document"] for hit in hits)
+        report[f"{shards}_shards"] = dict(latency_stats("retrieve", samples), recall_at_3=found / len(questions))
+    return report
+
+
+MMAP_PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import rag_pdf_loader as rag
+questions = json.load(open("questions.json"))
+rag.retrieve(questions[0]["prompt"], 3, questions[0]["embedding"])
+report = {"open_seconds": time.perf_counter() - started, "chromadb_loaded": "chromadb" in sys.modules}
+samples, found = [], 0
+for question in questions:
+    started = time.perf_counter()
+    hits = rag.retrieve(question["prompt"], 3, question["embedding"])
+    samples.append(time.perf_counter() - started)
+    found += any(question["reg_id"] in hit["document"] for hit in hits)
+with open("/proc/self/status") as f:  # VmHWM starts afresh at exec, unlike ru_maxrss
+    peak_kb = next((int(line.split()[1]) for line in f if line.startswith("VmHWM")), None)
+report.update(samples=samples, recall_at_3=found / len(questions), peak_rss_kb=peak_kb)
+print(json.dumps(report))
+"""
+
+
+def scenario_mmap(config):
+    from corpus import make_pdf, make_questions
+    import rag_pdf_loader as rag
+
+    regulations = make_pdf("corpus.pdf", config["query_pages"])
+    rag.index_pdf("corpus.pdf")
+    questions = make_questions(regulations, config["queries"])
+    for question, embedding in zip(questions, rag.get_embeddings([question["prompt"] for question in questions])):
+        question["embedding"] = [float(value) for value in embedding]
+    with open("questions.json", "w", encoding="utf-8") as f:
+        json.dump(questions, f)
+    variants = {"chroma": {"RAG_BACKEND": "chroma"}}
+    for dtype, lists in (("float16", 0), ("int8", 0), ("float16", 16)):
+        name = f"mmap_{dtype}" + (f"_ivf{lists}" if lists else "")
+        path = os.path.abspath(name)
+        rag.export_mmap_index(path, dtype, lists)
+        variants[name] = {"RAG_BACKEND": "mmap", "RAG_MMAP_INDEX": path}
+    report = {"chunks": rag.retrieval_service.collection().count()}
+    for name, overrides in variants.items():  # Each backend is opened cold by a fresh worker process
+        result = subprocess.run([sys.executable, "-c", MMAP_PROBE], env=dict(os.environ, **overrides),
+                                capture_output=True, text=True, timeout=600)
+        if result.returncode != 0:
+            raise RuntimeError(f"{name}: {result.stderr.strip().splitlines()[-1] if result.stderr else 'probe failed'}")
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        report[name] = dict(latency_stats("retrieve", probe.pop("samples")), **probe)
+        if name != "chroma":
+            path = overrides["RAG_MMAP_INDEX"]
+            report[name]["index_kb"] = sum(entry.stat().st_size for entry in os.scandir(path)) // 1024
+    return report
+
+
+def scenario_fallback(config):
+    from mock_openrouter import MockOpenRouter, Behaviour
+    models = ["mock/rate-limited", "mock/slow", "mock/fast"]
+    mock = MockOpenRouter({
+        "mock/rate-limited": Behaviour(status=429, retry_after=60),
+        "mock/slow": Behaviour(ttft=2.5, tokens=40),
+        "mock/fast": Behaviour(ttft=0.05, tokens=40, token_delay=0.002),
+    })
+    os.environ["OPENROUTER_URL"] = mock.start()
+    import basic_agent_cloud as agent
+
+    agent.MODELS[:] = models
+    session = agent.AgentSession(session_id="bench")
+    session.use_response_cache = False
+    first_tokens, turns, winners = [], [], {}
+    for i in range(config["turns"]):
+        started = time.perf_counter()
+        marks = {}
+        model, _ = agent.generate_reply(f"Say hello, turn {i}.", agent.api_key, session, stream=True,
+                                        on_token=lambda chunk: marks.setdefault("first", time.perf_counter()))
+        turns.append(time.perf_counter() - started)
+        first_tokens.append(marks.get("first", time.perf_counter()) - started)
+        winners[model] = winners.get(model, 0) + 1
+    agent.get_openrouter_client(agent.api_key).close()
+    upstream = mock.stats()
+    mock.stop()
+    report = {"turns": len(turns), "first_turn_seconds": turns[0], "winners": winners,
+              "upstream_requests": upstream["requests"], "upstream_failures": upstream["failures"]}
+    report.update(latency_stats("turn", turns[1:] or turns))
+    report.update(latency_stats("first_token", first_tokens[1:] or first_tokens))
+    return report
+
+
+def scenario_history(config):
+    from history_store import HistoryStore
+    import basic_agent_cloud as agent
+
+    store = HistoryStore("bench_history.db")
+    report = {}
+    written = 0
+    for size in config["history_sizes"]:
+        started = time.perf_counter()
+        batch = size - written
+        while written < size:
+            store.append("bench", "user" if written % 2 == 0 else "assistant", f"Message {written} " + "lorem " * 30)
+            written += 1
+        appends_per_sec = batch / max(time.perf_counter() - started, 1e-9)
+        started = time.perf_counter()
+        agent.ConversationMemory("bench", store)  # Loads the recent tail and the summary
+        report[str(size)] = {"messages": size, "appends_per_sec": appends_per_sec,
+                             "load_seconds": time.perf_counter() - started}
+    store.close()
+    return report
+
+
+SCENARIOS = {
+    "startup": scenario_startup,
+    "index": scenario_index,
+    "query": scenario_query,
+    "shards": scenario_shards,
+    "mmap": scenario_mmap,
+    "fallback": scenario_fallback,
+    "history": scenario_history,
+}
+
+
+# --- orchestration ---
+
+def run_child(name, config, verbose=False):
+    """Run one scenario in a fresh interpreter in a temporary directory; returns its report."""
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    env = dict(os.environ, RAG_WARMUP="0", RESPONSE_CACHE="0", RAG_DB_PATH=os.path.join(workdir, "rag_db"),
+               OPENROUTER_API_KEY="mock-key", AGENT_SESSION_ID="bench",
+               PYTHONPATH=os.pathsep.join(filter(None, [BENCH_DIR, REPO_ROOT, os.getenv("PYTHONPATH")])))
+    command = [sys.executable, os.path.abspath(__file__), "--child", name, "--config", json.dumps(config)]
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True, timeout=3600)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if verbose and result.stderr:
+        print(result.stderr, file=sys.stderr)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        return {"error": error}
+    report = json.loads(lines[-1])
+    report["wall_seconds"] = time.perf_counter() - started
+    return report
+
+
+def _child(name, config):
+    sys.path[:0] = [BENCH_DIR, REPO_ROOT]
+    with contextlib.redirect_stdout(sys.stderr):  # Progress output of the code under test
+        report = SCENARIOS[name](config)
+    print(json.dumps(report))
+
+
+def environment():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True,
+                                  timeout=10).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def run(names, preset="full", verbose=False):
+    config = dict(PRESETS[preset])
+    results = {}
+    for name in names:
+        print(f"⏱️ {name}...", file=sys.stderr, flush=True)
+        results[name] = run_child(name, config, verbose)
+        if "error" in results[name]:
+            print(f"❌ {name}: {results[name]['error']}", file=sys.stderr)
+    return {"meta": dict(environment(), preset=preset, config=config), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", help=f"comma-separated scenarios ({', '.join(SCENARIOS)})")
+    parser.add_argument("--quick", action="store_true", help="small sizes, for CI or a quick check")
+    parser.add_argument("--out", help="write results JSON here (default: stdout)")
+    parser.add_argument("--verbose", action="store_true", help="show the scenarios' own output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, json.loads(args.config))
+        sys.exit(0)
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    report = run(names, "quick" if args.quick else "full", args.verbose)
+    output = json.dumps(report, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"💾 Results written to {args.out}", file=sys.stderr)
+    else:
+        print(output)
@@ -0,0 +1,127 @@
+# bm25_index.py
+import re
+import math
+import sqlite3
+import pathlib
+import threading
+from collections import Counter
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was were "
+    "what when where which who why will with does do did can".split()
+)
+# Keeps identifiers such as "395.8", "2016/679", "iso-27001" or "sec.4(b)" together
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[./\-:§][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[./\-:§]")
+
+
+def tokenize(text):
+    """Lower-cased terms; compound identifiers are indexed whole and as their parts."""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token not in STOP_WORDS:
+            terms.append(token)
+        if _SPLIT_RE.search(token):
+            terms.extend(part for part in _SPLIT_RE.split(token) if part and part not in STOP_WORDS)
+    return terms
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked id lists: score(id) = sum over lists of 1 / (k + rank). Best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, 1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring, kept in a small SQLite file next to the vector store.
+
+    Postings carry the document length, so a query only reads the posting lists of its
+    own terms. Updates are incremental: add() replaces a chunk's postings, remove() drops them.
+    With read_only=True an existing file is opened for search only (mode=ro), without
+    switching it to WAL or creating tables, so it works on read-only filesystems.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._local = threading.local()
+        if read_only:
+            return
+        conn = self._conn()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, chunk_id TEXT NOT NULL, "
+                         "tf INTEGER NOT NULL, doc_len INTEGER NOT NULL, PRIMARY KEY (term, chunk_id)) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS docs (chunk_id TEXT PRIMARY KEY, doc_len INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk_id)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(pathlib.Path(self.path).absolute().as_uri() + "?mode=ro", timeout=10, uri=True)
+            else:
+                conn = sqlite3.connect(self.path, timeout=10)
+                conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, ids, texts):
+        """Index (or re-index) chunks."""
+        conn = self._conn()
+        with conn:
+            self._delete(conn, ids)
+            for chunk_id, text in zip(ids, texts):
+                counts = Counter(tokenize(text))
+                doc_len = sum(counts.values())
+                conn.execute("INSERT INTO docs VALUES (?, ?)", (chunk_id, doc_len))
+                conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)",
+                                 [(term, chunk_id, tf, doc_len) for term, tf in counts.items()])
+
+    def remove(self, ids):
+        conn = self._conn()
+        with conn:
+            self._delete(conn, ids)
+
+    def _delete(self, conn, ids):
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            marks = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({marks})", batch)
+            conn.execute(f"DELETE FROM docs WHERE chunk_id IN ({marks})", batch)
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM docs")
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query, k=10):
+        """Top-k (chunk_id, score) pairs for a query."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        conn = self._conn()
+        total_docs, total_len = conn.execute("SELECT COUNT(*), COALESCE(SUM(doc_len), 0) FROM docs").fetchone()
+        if not total_docs:
+            return []
+        avg_len = total_len / total_docs
+
+        scores = {}
+        for term in terms:
+            postings = conn.execute("SELECT chunk_id, tf, doc_len FROM postings WHERE term = ?", (term,)).fetchall()
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for chunk_id, tf, doc_len in postings:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -0,0 +1,144 @@
+# context_builder.py
+import re
+
+DEFAULT_CONTEXT_BUDGET = 8000  # Tokens for models without an entry below
+MODEL_CONTEXT_BUDGETS = {
+    "google/gemini-2.0-flash-exp:free": 32000,
+    "mistralai/mistral-7b-instruct": 8000,
+    "meta-llama/llama-3-8b-instruct": 8000,
+}
+MESSAGE_OVERHEAD = 4  # Tokens per message for role/formatting
+SUMMARY_TOKEN_BUDGET = 400  # Upper bound on the rolling summary of evicted turns
+SUMMARY_LINE_CHARS = 200  # Characters kept per summarized message
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+TRUNCATION_MARKER = " …[truncated]"
+RAG_PROMPT_TEMPLATE = "Use this knowledge to answer accurately:\n{context}\n\nQuestion: {prompt}"
+
+_encoding = None
+_encoding_loaded = False
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None  # Fall back to the regex estimate below
+    return _encoding
+
+
+def count_tokens(text):
+    """Token count with tiktoken's cl100k_base if installed, otherwise a fast word/punctuation estimate."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Long words split into several BPE tokens; ~4 chars per token is the usual rule of thumb
+    return sum(max(1, len(piece) // 4) for piece in _TOKEN_RE.findall(text))
+
+
+def context_budget(models, max_tokens=500):
+    """Prompt budget that fits every model in the fallback list, leaving room for the reply."""
+    smallest = min(MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET) for model in models)
+    return max(256, smallest - max_tokens)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens, keeping the beginning (the truncation marker included)."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    max_tokens -= count_tokens(TRUNCATION_MARKER)
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + TRUNCATION_MARKER
+
+
+def summarize_extractive(summary, messages):
+    """Fold evicted messages into the rolling summary: one short line per message.
+
+    Incremental: only the newly evicted messages are processed. When the summary
+    exceeds SUMMARY_TOKEN_BUDGET its oldest lines are dropped.
+    """
+    lines = summary.splitlines() if summary else []
+    for message in messages:
+        text = " ".join(message["content"].split())
+        first_sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+        lines.append(f"- {message['role']}: {first_sentence[:SUMMARY_LINE_CHARS]}")
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def build_user_content(prompt, rag_context=""):
+    if rag_context:
+        return RAG_PROMPT_TEMPLATE.format(context=rag_context, prompt=prompt)
+    return prompt
+
+
+def build_context(system_prompt, history, prompt, budget, rag_context="", summary=""):
+    """Pack system prompt, summary, RAG context, history and the new prompt into `budget` tokens.
+
+    The system prompt and the question are always sent, and the RAG context is
+    truncated if it alone would overflow. History is added newest first until the
+    budget runs out. Returns (messages, evicted, report): evicted lists the oldest
+    history messages that didn't fit, for the caller to fold into the summary.
+    In the report, "prompt" is the final user message (question and RAG template) less its "rag" part.
+    """
+    prompt = prompt.strip()
+    report = {"budget": budget, "system": count_tokens(system_prompt) + MESSAGE_OVERHEAD,
+              "prompt": 0, "rag": 0, "summary": 0, "history": 0}
+
+    if rag_context:
+        template = count_tokens(RAG_PROMPT_TEMPLATE.format(context="", prompt=prompt)) + MESSAGE_OVERHEAD
+        rag_context = truncate_to_tokens(rag_context, max(0, budget - report["system"] - template))
+        report["rag"] = count_tokens(rag_context)
+    user_content = build_user_content(prompt, rag_context)
+    report["prompt"] = count_tokens(user_content) + MESSAGE_OVERHEAD - report["rag"]
+
+    summary_message = None
+    if summary:
+        # Keep the newest summary lines that still fit next to the mandatory parts
+        summary_room = (budget - report["system"] - report["prompt"] - report["rag"]
+                        - MESSAGE_OVERHEAD - count_tokens(SUMMARY_HEADER))
+        lines = summary.splitlines()
+        while lines and count_tokens("\n".join(lines)) > summary_room:
+            lines.pop(0)
+        summary = "\n".join(lines)
+    if summary:
+        summary_message = {"role": "system", "content": SUMMARY_HEADER + summary}
+        report["summary"] = count_tokens(summary_message["content"]) + MESSAGE_OVERHEAD
+
+    remaining = budget - report["system"] - report["prompt"] - report["rag"] - report["summary"]
+    kept = []
+    cutoff = len(history)
+    for index in range(len(history) - 1, -1, -1):
+        cost = count_tokens(history[index]["content"]) + MESSAGE_OVERHEAD
+        if cost > remaining:
+            break
+        remaining -= cost
+        report["history"] += cost
+        kept.append({"role": history[index]["role"], "content": history[index]["content"]})
+        cutoff = index
+    kept.reverse()
+    evicted = history[:cutoff]
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary_message:
+        messages.append(summary_message)
+    messages.extend(kept)
+    messages.append({"role": "user", "content": user_content})
+
+    report["history_messages"] = len(kept)
+    report["evicted_messages"] = len(evicted)
+    report["total"] = report["system"] + report["summary"] + report["history"] + report["rag"] + report["prompt"]
+    return messages, evicted, report
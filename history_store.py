@@ -0,0 +1,125 @@
+# history_store.py
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+HISTORY_DB_FILE = "chat_history.db"
+
+
+class HistoryStore:
+    """Append-only conversation log in SQLite (WAL mode), shared by all sessions.
+
+    Every message is committed as it arrives, so a crash loses at most the message in
+    flight, and several agent processes can write to the same file. Messages are
+    indexed by (session_id, id), so loading the last N messages of a session reads
+    N rows no matter how large the log grows. /clear only moves the session's
+    "cleared_after" marker; nothing is rewritten.
+    """
+
+    def __init__(self, path=HISTORY_DB_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # Durable across app crashes, cheap appends
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS messages ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+                         "role TEXT NOT NULL, content TEXT NOT NULL, timestamp TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "session_id TEXT PRIMARY KEY, started TEXT, cleared_after INTEGER NOT NULL DEFAULT 0)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+            if "summary" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+                conn.execute("ALTER TABLE sessions ADD COLUMN summary_until INTEGER NOT NULL DEFAULT 0")
+
+    def _ensure_session(self, conn, session_id):
+        conn.execute("INSERT OR IGNORE INTO sessions (session_id, started) VALUES (?, ?)",
+                     (session_id, datetime.now().isoformat()))
+
+    def append(self, session_id, role, content, timestamp=None):
+        """Write one message and return its row id."""
+        conn = self._conn()
+        with conn:
+            self._ensure_session(conn, session_id)
+            cursor = conn.execute("INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                                  (session_id, role, content, timestamp or datetime.now().isoformat()))
+        return cursor.lastrowid
+
+    def tail(self, session_id, limit):
+        """The last `limit` messages of a session since its last clear, oldest first."""
+        rows = self._conn().execute(
+            "SELECT id, role, content, timestamp FROM messages "
+            "WHERE session_id = ? AND id > COALESCE((SELECT cleared_after FROM sessions WHERE session_id = ?), 0) "
+            "ORDER BY id DESC LIMIT ?", (session_id, session_id, limit)).fetchall()
+        return [{"id": row_id, "role": role, "content": content, "timestamp": ts}
+                for row_id, role, content, ts in reversed(rows)]
+
+    def clear(self, session_id):
+        """Hide everything written so far from future loads of this session."""
+        conn = self._conn()
+        with conn:
+            self._ensure_session(conn, session_id)
+            conn.execute("UPDATE sessions SET summary = '', cleared_after = "
+                         "(SELECT COALESCE(MAX(id), 0) FROM messages WHERE session_id = ?) WHERE session_id = ?",
+                         (session_id, session_id))
+
+    def load_summary(self, session_id):
+        """(summary, id of the last message it covers) for a session."""
+        row = self._conn().execute("SELECT summary, summary_until FROM sessions WHERE session_id = ?",
+                                   (session_id,)).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def save_summary(self, session_id, summary, summary_until):
+        conn = self._conn()
+        with conn:
+            self._ensure_session(conn, session_id)
+            conn.execute("UPDATE sessions SET summary = ?, summary_until = ? WHERE session_id = ?",
+                         (summary, summary_until, session_id))
+
+    def count(self, session_id=None):
+        if session_id is None:
+            return self._conn().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return self._conn().execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def import_legacy_json(self, json_path, session_id):
+        """One-time import of the old chat_history.json into a session. The file is left untouched."""
+        if not os.path.exists(json_path):
+            return 0
+        conn = self._conn()
+        key = f"imported:{os.path.abspath(json_path)}"
+        if conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+            return 0
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                messages = json.load(f).get("messages", [])
+        except Exception as e:
+            print(f"⚠️ Could not import {json_path}: {e}")
+            return 0
+        with conn:
+            self._ensure_session(conn, session_id)
+            conn.executemany("INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                             [(session_id, m["role"], m["content"], m.get("timestamp") or datetime.now().isoformat())
+                              for m in messages if "role" in m and "content" in m])
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (key, datetime.now().isoformat()))
+        return len(messages)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,197 @@
+# instrumentation.py
+"""Lightweight latency instrumentation for the request pipeline.
+
+    with metrics.span("rag.query"):
+        ...
+    metrics.observe("llm.first_token", seconds, model=model)
+
+Every span name (plus optional labels) feeds a log-bucketed histogram: recording is a
+perf_counter() pair, a bisect and a few additions under a lock, and memory is fixed no
+matter how many samples arrive. p50/p95/p99 are read from the buckets (within ~5%).
+Results are shown by /stats and exported as Prometheus text or JSON.
+"""
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"  # Set METRICS=0 to make spans no-ops
+METRIC_PREFIX = "agent_"  # Prometheus metric name prefix
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Bucket upper bounds from 10µs to ~10 minutes, ~9% apart
+_GROWTH = 2 ** (1 / 8)
+BUCKET_BOUNDS = [1e-5 * _GROWTH ** i for i in range(8 * 26)]
+
+
+class Histogram:
+    """Count, sum, min, max and a log-bucketed distribution of durations in seconds."""
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if i == len(BUCKET_BOUNDS):
+                    return self.max
+                lower = BUCKET_BOUNDS[i - 1] if i else 0.0
+                # Geometric middle of the bucket, clamped to what was actually observed
+                estimate = (lower * BUCKET_BOUNDS[i]) ** 0.5 if lower else BUCKET_BOUNDS[i]
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        result = {"count": self.count, "sum": self.total, "mean": self.total / self.count if self.count else None,
+                  "min": self.min, "max": self.max if self.count else None}
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = self.quantile(q)
+        return result
+
+
+class _Span:
+    __slots__ = ("registry", "key", "started")
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry._record(self.key, time.perf_counter() - self.started)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Metrics:
+    """Registry of latency histograms keyed by (span name, labels). Safe to share between threads."""
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.started = time.time()
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **labels):
+        """Context manager timing its block into the `name` histogram."""
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, (name, tuple(sorted(labels.items()))) if labels else (name, ()))
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration measured elsewhere (e.g. time to first token)."""
+        if self.enabled:
+            self._record((name, tuple(sorted(labels.items()))) if labels else (name, ()), seconds)
+
+    def timed(self, name):
+        """Decorator form of span()."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _record(self, key, seconds):
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.add(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        """[{"name", "labels", "count", "sum", "mean", "min", "max", "p50", "p95", "p99"}] sorted by name."""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            rows = [dict(name=name, labels=dict(labels), **histogram.summary()) for (name, labels), histogram in items]
+        return rows
+
+    def to_json(self):
+        return json.dumps({"since": self.started, "unit": "seconds", "spans": self.snapshot()}, indent=2)
+
+    def to_prometheus(self):
+        """Prometheus text exposition: one summary (quantiles, _sum, _count) per span name."""
+        lines = []
+        current = None
+        for row in self.snapshot():
+            metric = METRIC_PREFIX + row["name"].replace(".", "_").replace("-", "_") + "_seconds"
+            if metric != current:
+                current = metric
+                lines.append(f"# HELP {metric} Latency of {row['name']}")
+                lines.append(f"# TYPE {metric} summary")
+            labels = [f'{key}="{_escape(value)}"' for key, value in row["labels"].items()]
+            for q in QUANTILES:
+                quantile_labels = ",".join(labels + [f'quantile="{q}"'])
+                lines.append(f"{metric}{{{quantile_labels}}} {row[f'p{int(q * 100)}']:.6g}")
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{metric}_sum{suffix} {row['sum']:.6g}")
+            lines.append(f"{metric}_count{suffix} {row['count']}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Table for the /stats command."""
+        rows = self.snapshot()
+        if not rows:
+            return "📭 No timings recorded yet." if self.enabled else "📭 Instrumentation is disabled (METRICS=0)."
+        output = "⏱️ Latency (ms):\n" + "=" * 78 + "\n"
+        output += f"{'span':<34}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>10}\n"
+        for row in rows:
+            label = row["name"] + ("".join(f" {value}" for value in row["labels"].values()))
+            output += (f"{label[:33]:<34}{row['count']:>7}{row['p50'] * 1000:>9.1f}{row['p95'] * 1000:>9.1f}"
+                       f"{row['p99'] * 1000:>9.1f}{row['max'] * 1000:>10.1f}\n")
+        return output
+
+    def export(self, path):
+        """Write JSON (.json) or Prometheus text (anything else) to path."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_json() if path.endswith(".json") else self.to_prometheus())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+span = metrics.span
+observe = metrics.observe
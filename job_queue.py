@@ -0,0 +1,470 @@
+# job_queue.py
+"""Durable background jobs: PDF indexing, tasks/ commands and shell commands off the chat thread.
+
+Jobs are rows in a SQLite file (WAL mode), so they survive restarts and any process
+using the same file can queue, watch or cancel them. Worker threads claim queued jobs
+of the kinds they have a handler for, at most `limit` of a kind running at once across
+all processes. A failed job is retried with exponential back-off up to its attempt
+limit; a job whose process died is put back in the queue when workers next start.
+
+    python job_queue.py work            # run queued jobs in the foreground
+    python job_queue.py list | show <id> | cancel <id>
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+
+from tool_executor import kill_process_tree
+
+JOBS_DB_FILE = os.getenv("JOBS_DB", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # Worker threads per process
+JOB_SHELL_TIMEOUT = float(os.getenv("JOB_SHELL_TIMEOUT", "3600"))  # Seconds before a background command is killed
+RETRY_DELAY = 5.0  # Seconds before the first retry, doubled for each one after
+POLL_INTERVAL = 1.0  # Seconds an idle worker waits before looking for jobs queued by other processes
+SAVE_INTERVAL = 0.5  # Seconds between progress writes of a running job
+MAX_JOB_LOG = 20000  # Characters of output kept per job (the tail)
+
+STATUS_ICONS = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "❌", "cancelled": "🚫"}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job (by JobContext.progress/check) once it has been cancelled."""
+
+
+class JobFailed(Exception):
+    """A failure that retrying won't fix, such as a missing file."""
+
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True  # Can't tell for another machine; leave its jobs alone
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobContext:
+    """Handed to a job's handler: its payload, plus progress reporting and cancellation checks."""
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.id = job["id"]
+        self.payload = job["payload"]
+        self.attempt = job["attempts"]
+        self.fraction = job["progress"]
+        self.message = ""
+        self._log = deque()
+        self._log_size = 0
+        self._saved = 0.0
+        self._lock = threading.Lock()
+
+    def progress(self, fraction=None, message=None):
+        """Record progress (0-1) and/or a status line; raises JobCancelled if the job was cancelled."""
+        with self._lock:
+            if fraction is not None:
+                self.fraction = max(0.0, min(1.0, fraction))
+            if message:
+                self.message = message.strip()[:200]
+        self.save()
+        self.check()
+
+    def log(self, text):
+        """Append output to the job's log (a print() stand-in for handlers); its last line becomes the status message."""
+        if not text.endswith("\n"):
+            text += "\n"
+        with self._lock:
+            self._log.append(text)
+            self._log_size += len(text)
+            while self._log_size > MAX_JOB_LOG and len(self._log) > 1:
+                self._log_size -= len(self._log.popleft())
+            lines = [line for line in text.splitlines() if line.strip()]
+            if lines:
+                self.message = lines[-1].strip()[:200]
+        self.save()
+
+    def output(self):
+        with self._lock:
+            return "".join(self._log)[-MAX_JOB_LOG:]
+
+    def save(self, force=False):
+        now = time.monotonic()
+        if force or now - self._saved >= SAVE_INTERVAL:
+            self._saved = now
+            self.queue._save_progress(self.id, self.fraction, self.message, self.output())
+
+    def cancelled(self):
+        return self.queue._cancel_requested(self.id)
+
+    def check(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+
+class JobQueue:
+    """SQLite-backed job queue with a pool of worker threads.
+
+    Handlers are registered per kind: handler(context) returns the job's result text, or
+    raises (JobFailed for a permanent failure). Output meant for the job's log goes through
+    context.log(), not print(), since workers share the process's stdout. start() launches the workers; submit(),
+    get(), list() and cancel() work with or without them.
+    """
+
+    def __init__(self, path=JOBS_DB_FILE, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._handlers = {}  # kind -> (handler, limit, attempts)
+        self._local = threading.local()
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._init_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, label TEXT NOT NULL, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, "
+            "max_attempts INTEGER NOT NULL DEFAULT 1, not_before REAL NOT NULL DEFAULT 0, "
+            "cancel_requested INTEGER NOT NULL DEFAULT 0, owner TEXT, progress REAL, message TEXT NOT NULL DEFAULT '', "
+            "log TEXT NOT NULL DEFAULT '', result TEXT, error TEXT, "
+            "created TEXT NOT NULL, started TEXT, finished TEXT)")
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+
+    def _row(self, row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    # --- handlers and workers ---
+    def register(self, kind, handler, limit=1, attempts=1):
+        """Run jobs of `kind` with handler(context); `limit` of them at once, each tried up to `attempts` times."""
+        self._handlers[kind] = (handler, limit, attempts)
+
+    def start(self):
+        """Start the worker threads (once) after re-queueing jobs whose process died."""
+        with self._lock:
+            if self._threads:
+                return
+            self._recover()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        """Ask the workers to exit after their current job (running jobs are re-queued on the next start)."""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._stop.clear()
+
+    def _recover(self):
+        conn = self._conn()
+        for row in conn.execute("SELECT id, owner, attempts, max_attempts FROM jobs WHERE status = 'running'").fetchall():
+            if _owner_alive(row["owner"]):
+                continue
+            if row["attempts"] < row["max_attempts"]:
+                conn.execute("UPDATE jobs SET status = 'queued', owner = NULL, message = 'worker died, re-queued' "
+                             "WHERE id = ? AND status = 'running'", (row["id"],))
+            else:
+                conn.execute("UPDATE jobs SET status = 'failed', owner = NULL, error = 'worker died', finished = ? "
+                             "WHERE id = ? AND status = 'running'", (datetime.now().isoformat(), row["id"]))
+
+    def _claim(self):
+        """Atomically take the oldest runnable job whose kind is under its concurrency limit."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            running = {row["kind"]: row["count"] for row in conn.execute(
+                "SELECT kind, COUNT(*) AS count FROM jobs WHERE status = 'running' GROUP BY kind")}
+            kinds = [kind for kind, (_, limit, _) in self._handlers.items() if running.get(kind, 0) < limit]
+            row = None
+            if kinds:
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ? "
+                    f"AND kind IN ({', '.join('?' * len(kinds))}) ORDER BY id LIMIT 1", (time.time(), *kinds)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', owner = ?, attempts = attempts + 1, started = ?, "
+                             "message = '' WHERE id = ?", (_owner(), datetime.now().isoformat(), row["id"]))
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self._row(row) if row is not None else None
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.OperationalError as e:  # Locked by another process for longer than the timeout
+                print(f"⚠️ Job queue busy: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        handler = self._handlers[job["kind"]][0]
+        context = JobContext(self, job)
+        try:
+            result = handler(context)
+        except JobCancelled:
+            self._finish(context, "cancelled", error="cancelled")
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}" if not isinstance(e, JobFailed) else str(e)
+            retry = (not isinstance(e, JobFailed) and job["attempts"] < job["max_attempts"]
+                     and not context.cancelled())
+            if retry:
+                delay = RETRY_DELAY * 2 ** (job["attempts"] - 1)
+                self._finish(context, "queued", error=error, not_before=time.time() + delay)
+            else:
+                self._finish(context, "cancelled" if context.cancelled() else "failed", error=error)
+        else:
+            context.fraction = 1.0
+            self._finish(context, "done", result=None if result is None else str(result)[-MAX_JOB_LOG:])
+
+    def _finish(self, context, status, result=None, error=None, not_before=0.0):
+        finished = None if status == "queued" else datetime.now().isoformat()
+        message = f"retry in {not_before - time.time():.0f}s: {error}" if status == "queued" else context.message
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, owner = NULL, progress = ?, message = ?, log = ?, result = ?, error = ?, "
+            "not_before = ?, finished = ? WHERE id = ?",
+            (status, context.fraction, message or "", context.output(), result, error, not_before, finished,
+             context.id))
+
+    def _save_progress(self, job_id, fraction, message, log):
+        self._conn().execute("UPDATE jobs SET progress = ?, message = ?, log = ? WHERE id = ?",
+                             (fraction, message or "", log, job_id))
+
+    def _cancel_requested(self, job_id):
+        row = self._conn().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    # --- public API ---
+    def submit(self, kind, payload, label=None, attempts=None):
+        """Queue a job and return its ID; the kind must have a handler registered."""
+        if kind not in self._handlers:
+            raise ValueError(f"no handler registered for job kind {kind!r}")
+        if attempts is None:
+            attempts = self._handlers[kind][2]
+        cursor = self._conn().execute(
+            "INSERT INTO jobs (kind, label, payload, max_attempts, created) VALUES (?, ?, ?, ?, ?)",
+            (kind, label or kind, json.dumps(payload), attempts, datetime.now().isoformat()))
+        self._wake.set()
+        return cursor.lastrowid
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row is not None else None
+
+    def list(self, limit=20):
+        """Unfinished jobs and the most recent finished ones, newest first."""
+        rows = self._conn().execute(
+            "SELECT * FROM jobs WHERE status IN ('queued', 'running') "
+            "UNION SELECT * FROM (SELECT * FROM jobs ORDER BY id DESC LIMIT ?) ORDER BY id DESC", (limit,)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def unfinished(self):
+        """Number of queued and running jobs."""
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def cancel(self, job_id):
+        """Cancel a job: a queued one at once, a running one at its next progress check. Returns a status line."""
+        conn = self._conn()
+        job = self.get(job_id)
+        if job is None:
+            return f"❌ No job {job_id}"
+        if job["status"] == "queued":
+            conn.execute("UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished = ? "
+                         "WHERE id = ? AND status = 'queued'", (datetime.now().isoformat(), job_id))
+            return f"🚫 Job {job_id} cancelled"
+        if job["status"] == "running":
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return f"🚫 Job {job_id} will stop at its next checkpoint"
+        return f"ℹ️ Job {job_id} already {job['status']}"
+
+    def report(self, limit=20):
+        """Table for /jobs."""
+        jobs = self.list(limit)
+        if not jobs:
+            return "📭 No background jobs."
+        lines = ["🧵 Background jobs:", "=" * 70]
+        for job in jobs:
+            progress = f"{job['progress'] * 100:3.0f}%" if job["progress"] is not None else "    "
+            detail = job["error"] if job["status"] == "failed" else job["message"] or job["result"]
+            lines.append(f"{STATUS_ICONS.get(job['status'], '?')} #{job['id']:<4} {job['kind']:<6} {progress} "
+                         f"{job['label'][:32]:<32} {(detail or '')[:60]}")
+        if not self._threads:
+            lines.append("\nℹ️ No workers in this process; queued jobs run in the agent or `python job_queue.py work`.")
+        return "\n".join(lines) + "\n"
+
+    def describe(self, job_id, tail=2000):
+        """Details and the end of the output, for /job <id>."""
+        job = self.get(job_id)
+        if job is None:
+            return f"❌ No job {job_id}"
+        lines = [f"{STATUS_ICONS.get(job['status'], '?')} Job #{job['id']} ({job['kind']}): {job['label']}",
+                 f"Status:   {job['status']} (attempt {job['attempts']}/{job['max_attempts']})"]
+        if job["progress"] is not None:
+            lines.append(f"Progress: {job['progress'] * 100:.0f}% {job['message']}")
+        elif job["message"]:
+            lines.append(f"Message:  {job['message']}")
+        lines.append(f"Queued:   {job['created']}")
+        if job["started"]:
+            lines.append(f"Started:  {job['started']}")
+        if job["finished"]:
+            lines.append(f"Finished: {job['finished']}")
+        if job["error"]:
+            lines.append(f"Error:    {job['error']}")
+        if job["result"]:
+            lines.append(f"Result:   {job['result'][-tail:]}")
+        if job["log"].strip():
+            lines.append("Output:\n" + job["log"][-tail:].rstrip())
+        return "\n".join(lines) + "\n"
+
+
+# --- built-in handlers ---
+
+def run_shell(context):
+    """Run payload["command"] in a shell (in payload["cwd"]), logging its output.
+
+    The command is killed with its children when the job is cancelled or after JOB_SHELL_TIMEOUT.
+    """
+    process = subprocess.Popen(context.payload["command"], shell=True, cwd=context.payload.get("cwd"),
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace",
+                               start_new_session=True)
+
+    def drain():
+        for line in process.stdout:
+            context.log(line)
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    deadline = time.monotonic() + context.payload.get("timeout", JOB_SHELL_TIMEOUT)
+    try:
+        while process.poll() is None:
+            if time.monotonic() > deadline:
+                raise JobFailed(f"timed out after {context.payload.get('timeout', JOB_SHELL_TIMEOUT):.0f}s")
+            context.check()
+            time.sleep(0.2)
+    finally:
+        if process.poll() is None:
+            kill_process_tree(process)
+            process.wait()
+        reader.join(1.0)
+    if process.returncode != 0:
+        raise JobFailed(f"exit code {process.returncode}")
+    return (context.output().strip().splitlines() or ["(no output)"])[-1]
+
+
+def run_index(context):
+    """index_pdf() with payload {"target", "collection", "shards", "metadata", "force"}; cancellable between batches."""
+    import rag_pdf_loader as rag
+
+    payload = context.payload
+    totals = rag.index_pdf(payload["target"], force=payload.get("force", False),
+                           collection=payload.get("collection") or rag.COLLECTION_NAME,
+                           shards=payload.get("shards"), metadata=payload.get("metadata"),
+                           progress=context.progress, log=context.log)
+    if totals is None:
+        raise JobFailed(context.message or "nothing to index")
+    return (f"Indexed {totals['indexed']} new chunks from {totals['files']} PDF(s) "
+            f"({totals['skipped']} unchanged, {totals['deleted']} removed) in {totals['elapsed']:.1f}s")
+
+
+def run_task(context, registry):
+    """Run payload["command"] ("/<task> args") through a TaskRegistry and return its output."""
+    output = registry.dispatch(context.payload["command"])
+    if output is None or output.startswith("❌"):  # Tasks report bad arguments and failures as text
+        raise JobFailed(output or f"unknown task: {context.payload['command']}")
+    return output
+
+
+def _agent_tasks():
+    from basic_agent_cloud import get_task_registry  # The agent's registry, whose tasks can call the LLM
+    return get_task_registry()
+
+
+def submit_shell(queue, command, timeout=None):
+    """Queue a shell command, run from the current directory."""
+    payload = {"command": command, "cwd": os.getcwd()}
+    if timeout:
+        payload["timeout"] = timeout
+    return queue.submit("shell", payload, label=command)
+
+
+def make_queue(path=JOBS_DB_FILE, workers=JOB_WORKERS, tasks=None):
+    """A queue with the built-in "index", "shell" and "task" handlers.
+
+    `tasks` is the TaskRegistry task jobs run through; by default the agent's, imported by the first task job.
+    """
+    queue = JobQueue(path, workers)
+    queue.register("index", run_index, limit=1, attempts=3)  # One at a time: indexing is CPU-bound and writes Chroma
+    queue.register("shell", run_shell, limit=2)
+    queue.register("task", lambda context: run_task(context, tasks or _agent_tasks()), limit=2, attempts=2)
+    return queue
+
+
+def submit_index(queue, target, collection=None, shards=None, metadata=None, force=False):
+    """Queue an index_pdf() job; the target is made absolute, since workers may run elsewhere."""
+    target = os.path.abspath(target)
+    payload = {"target": target, "collection": collection, "shards": shards, "metadata": metadata, "force": force}
+    return queue.submit("index", payload, label=f"index {target}" + (f" → {collection}" if collection else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("action", choices=["work", "list", "show", "cancel"])
+    parser.add_argument("job_id", nargs="?", type=int)
+    parser.add_argument("--db", default=JOBS_DB_FILE)
+    args = parser.parse_args()
+
+    job_queue = make_queue(args.db)
+    if args.action == "work":
+        job_queue.start()
+        print(f"🧵 {job_queue.workers} worker(s) on {args.db}; Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            job_queue.stop()
+    elif args.action == "list":
+        print(job_queue.report(50))
+    elif args.job_id is None:
+        parser.error(f"{args.action} needs a job ID")
+    elif args.action == "show":
+        print(job_queue.describe(args.job_id))
+    else:
+        print(job_queue.cancel(args.job_id))
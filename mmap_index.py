@@ -0,0 +1,287 @@
+# mmap_index.py
+"""Read-only vector index in plain files, memory-mapped by every process that opens it.
+
+    <dir>/manifest.json     format, sizes, dtype, collections, IVF settings, source generation
+    <dir>/vectors.npy       (n, dim) float16 or int8 unit vectors
+    <dir>/scales.npy        (n,) float32 per-row scale of int8 vectors
+    <dir>/collections.npy   (n,) uint16 collection of each row
+    <dir>/offsets.npy       (n + 1,) uint64 offsets of each row's record in records.bin
+    <dir>/records.bin       JSON {"id", "document", "metadata", "collection"} per row
+    <dir>/id_hashes.npy     (n,) uint64 sorted hashes of the chunk IDs, and
+    <dir>/id_rows.npy       (n,) uint32 the row of each, for lookups by ID
+    <dir>/centroids.npy     (lists, dim) float32 IVF centroids (optional), and
+    <dir>/list_offsets.npy  (lists + 1,) int64 row ranges: rows are stored grouped by list
+
+Opening costs a few small reads; pages are loaded on demand and shared through the page
+cache, so any number of worker processes can serve one index. Search is brute force in
+blocks (or over the nprobe nearest IVF lists), scoring by cosine similarity.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import shutil
+import hashlib
+import argparse
+
+import numpy as np
+
+FORMAT_VERSION = 1
+BLOCK_ROWS = 32768  # Rows converted to float32 and scored per step
+IVF_MIN_ROWS = 50000  # lists="auto" builds IVF lists from this many rows on
+NPROBE = int(os.getenv("RAG_MMAP_NPROBE", "0")) or None  # IVF lists searched per query; None = manifest default
+
+
+def _id_hash(chunk_id):
+    return int.from_bytes(hashlib.blake2b(chunk_id.encode('utf-8'), digest_size=8).digest(), "little")
+
+
+def _normalize(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def _matches(metadata, where):
+    """Equality filter: {"field": value, ...}, optionally wrapped in Chroma's {"$and": [...]}."""
+    if not where:
+        return True
+    if "$and" in where:
+        return all(_matches(metadata, part) for part in where["$and"])
+    for key, value in where.items():
+        if isinstance(value, dict):
+            if set(value) - {"$eq"}:
+                raise ValueError(f"mmap index filters support equality only, got {value}")
+            value = value["$eq"]
+        if (metadata or {}).get(key) != value:
+            return False
+    return True
+
+
+def write_index(path, rows, dtype="float16", lists="auto", generation="", embedding_tag=""):
+    """Write rows of (chunk_id, collection, document, metadata, embedding) as an index at path.
+
+    The index is built next to path and swapped in with a rename, so processes that
+    have the old one open keep reading it undisturbed. Returns the manifest.
+    """
+    if dtype not in ("float16", "int8"):
+        raise ValueError(f"dtype must be float16 or int8, not {dtype}")
+    ids, names, vectors, records = [], [], [], []
+    for chunk_id, name, document, metadata, embedding in rows:
+        ids.append(chunk_id)
+        names.append(name)
+        vectors.append(np.asarray(embedding, dtype=np.float32))
+        records.append(json.dumps({"id": chunk_id, "document": document, "metadata": metadata, "collection": name},
+                                  ensure_ascii=False).encode('utf-8'))
+    if not vectors:
+        raise ValueError("nothing to export")
+    matrix = _normalize(np.stack(vectors))
+    collections = sorted(set(names))
+    collection_ids = np.array([collections.index(name) for name in names], dtype=np.uint16)
+
+    if lists == "auto":
+        lists = int(4 * len(matrix) ** 0.5) if len(matrix) >= IVF_MIN_ROWS else 0
+    lists = min(int(lists or 0), len(matrix))
+    centroids = list_offsets = None
+    order = np.arange(len(matrix))
+    if lists > 1:
+        from rag_router import compute_prototypes
+        centroids = compute_prototypes(matrix, lists, iterations=8)
+        assignment = np.concatenate([np.argmax(matrix[start:start + BLOCK_ROWS] @ centroids.T, axis=1)
+                                     for start in range(0, len(matrix), BLOCK_ROWS)])
+        order = np.argsort(assignment, kind="stable")  # Each list becomes one contiguous row range
+        list_offsets = np.searchsorted(assignment[order], np.arange(lists + 1)).astype(np.int64)
+    matrix = matrix[order]
+
+    tmp_path = path.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        np.save(os.path.join(tmp_path, "scales.npy"), scales.astype(np.float32))
+        stored = np.round(matrix / np.maximum(scales, 1e-12)[:, None]).astype(np.int8)
+    else:
+        stored = matrix.astype(np.float16)
+    np.save(os.path.join(tmp_path, "vectors.npy"), stored)
+    np.save(os.path.join(tmp_path, "collections.npy"), collection_ids[order])
+
+    offsets = np.zeros(len(order) + 1, dtype=np.uint64)
+    with open(os.path.join(tmp_path, "records.bin"), 'wb') as f:
+        for row, source in enumerate(order):
+            f.write(records[source])
+            offsets[row + 1] = offsets[row] + len(records[source])
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+
+    hashes = np.array([_id_hash(ids[source]) for source in order], dtype=np.uint64)
+    by_hash = np.argsort(hashes, kind="stable")
+    np.save(os.path.join(tmp_path, "id_hashes.npy"), hashes[by_hash])
+    np.save(os.path.join(tmp_path, "id_rows.npy"), by_hash.astype(np.uint32))
+    if centroids is not None:
+        np.save(os.path.join(tmp_path, "centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(tmp_path, "list_offsets.npy"), list_offsets)
+
+    manifest = {"format": FORMAT_VERSION, "count": len(order), "dim": int(matrix.shape[1]), "dtype": dtype,
+                "collections": collections, "ivf_lists": lists if centroids is not None else 0,
+                "nprobe": max(min(lists, 4), lists // 16) if centroids is not None else 0,
+                "generation": generation, "embedding_tag": embedding_tag, "created": time.time()}
+    with open(os.path.join(tmp_path, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    old_path = path.rstrip(os.sep) + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+class MmapIndex:
+    """An index written by write_index(), opened read-only with every array memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json"), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"unsupported index format {self.manifest.get('format')} in {path}")
+
+        def load(name):
+            file_path = os.path.join(path, name)
+            return np.load(file_path, mmap_mode="r") if os.path.exists(file_path) else None
+
+        self.vectors = load("vectors.npy")
+        self.scales = load("scales.npy")
+        self.collection_ids = load("collections.npy")
+        self.offsets = load("offsets.npy")
+        self.id_hashes = load("id_hashes.npy")
+        self.id_rows = load("id_rows.npy")
+        self.centroids = load("centroids.npy")
+        self.list_offsets = load("list_offsets.npy")
+        self.collections = self.manifest["collections"]
+        with open(os.path.join(path, "records.bin"), 'rb') as f:
+            self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    @property
+    def generation(self):
+        return self.manifest.get("generation", "")
+
+    def has(self, collections=None):
+        """True if the index holds any of the given collections (default: any)."""
+        if collections is None:
+            return len(self) > 0
+        names = [collections] if isinstance(collections, str) else collections
+        return any(name in self.collections for name in names)
+
+    def record(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self._records[start:end])
+
+    def _collection_mask(self, collections):
+        if collections is None:
+            return None
+        names = [collections] if isinstance(collections, str) else collections
+        wanted = [self.collections.index(name) for name in names if name in self.collections]
+        return np.array(wanted, dtype=np.uint16)
+
+    def _ranges(self, query, nprobe):
+        """Row ranges to scan: everything, or the nprobe IVF lists nearest to the query."""
+        if self.centroids is None:
+            return [(0, len(self))]
+        nprobe = min(nprobe or NPROBE or self.manifest["nprobe"], len(self.centroids))
+        nearest = np.argsort(self.centroids @ query)[::-1][:nprobe]
+        return [(int(self.list_offsets[i]), int(self.list_offsets[i + 1])) for i in sorted(nearest)]
+
+    def _top_rows(self, query, k, wanted, nprobe):
+        """(rows, scores) of the k best rows, best first."""
+        best_rows, best_scores = [], []
+        for start, end in self._ranges(query, nprobe):
+            for block_start in range(start, end, BLOCK_ROWS):
+                block_end = min(block_start + BLOCK_ROWS, end)
+                scores = self.vectors[block_start:block_end].astype(np.float32) @ query
+                if self.scales is not None:
+                    scores *= self.scales[block_start:block_end]
+                if wanted is not None:
+                    scores[~np.isin(self.collection_ids[block_start:block_end], wanted)] = -np.inf
+                if len(scores) > k:
+                    keep = np.argpartition(scores, -k)[-k:]
+                else:
+                    keep = np.arange(len(scores))
+                best_rows.append(keep + block_start)
+                best_scores.append(scores[keep])
+        if not best_rows:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        order = np.argsort(scores)[::-1][:k]
+        order = order[np.isfinite(scores[order])]
+        return rows[order], scores[order]
+
+    def search(self, embedding, k=10, collections=None, where=None, nprobe=None):
+        """Top-k hits as [{"id", "document", "metadata", "collection", "distance"}].
+
+        distance is the squared L2 distance of the unit vectors (2 - 2·cosine), the
+        same scale as Chroma's default. With a `where` filter more rows are scored
+        until k matching ones are found.
+        """
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        wanted = self._collection_mask(collections)
+        if wanted is not None and not len(wanted):
+            return []
+        fetch = k if not where else k * 4
+        while True:
+            rows, scores = self._top_rows(query, min(fetch, len(self)), wanted, nprobe)
+            hits = []
+            for row, score in zip(rows, scores):
+                hit = self.record(int(row))
+                if _matches(hit["metadata"], where):
+                    hit["distance"] = float(2 - 2 * score)
+                    hits.append(hit)
+                    if len(hits) == k:
+                        return hits
+            if fetch >= len(self) or len(rows) < min(fetch, len(self)):
+                return hits
+            fetch *= 4
+
+    def get(self, ids, collections=None, where=None):
+        """Records of the given chunk IDs that are in the index (and match the filters), in order."""
+        hashes = np.array([_id_hash(chunk_id) for chunk_id in ids], dtype=np.uint64)
+        positions = np.searchsorted(self.id_hashes, hashes)
+        names = None if collections is None else ({collections} if isinstance(collections, str) else set(collections))
+        hits = []
+        for chunk_id, hashed, position in zip(ids, hashes, positions):
+            # Every row with this hash: the same chunk ID in several collections, or a hash collision
+            while position < len(self) and self.id_hashes[position] == hashed:
+                hit = self.record(int(self.id_rows[position]))
+                position += 1
+                if (hit["id"] == chunk_id and (names is None or hit["collection"] in names)
+                        and _matches(hit["metadata"], where)):
+                    hits.append(hit)
+        return hits
+
+    def size_bytes(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+
+    def describe(self):
+        manifest = self.manifest
+        search = (f"IVF {manifest['ivf_lists']} lists, nprobe {NPROBE or manifest['nprobe']}"
+                  if manifest["ivf_lists"] else "brute force")
+        return (f"🗺️ Memory-mapped index {self.path}: {len(self)} chunks × {manifest['dim']} dims "
+                f"({manifest['dtype']}, {search}), {self.size_bytes() / 1024 / 1024:.1f} MB, "
+                f"collections: {', '.join(self.collections)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect an exported index (export with rag_pdf_loader.py, option 6)")
+    parser.add_argument("path")
+    parser.add_argument("--show", type=int, default=0, metavar="N", help="print the first N records")
+    args = parser.parse_args()
+    try:
+        index = MmapIndex(args.path)
+    except (OSError, ValueError) as e:
+        sys.exit(f"❌ {e}")
+    print(index.describe())
+    for row in range(min(args.show, len(index))):
+        record = index.record(row)
+        print(f"   {record['id']} [{record['collection']}] {record['document'][:80]!r}")
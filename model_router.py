@@ -0,0 +1,206 @@
+# model_router.py
+import os
+import json
+import time
+import threading
+
+MODEL_STATS_FILE = "model_stats.json"
+WINDOW_SECONDS = 3600  # Rolling window used for latency / error rates
+MAX_EVENTS = 200  # Per-model cap on remembered attempts
+FAILURE_THRESHOLD = 3  # Consecutive failures that open a model's circuit
+BASE_COOLDOWN = 30  # Seconds an opened circuit stays open (doubles on repeated trips)
+MAX_COOLDOWN = 900
+UNKNOWN_TTFT = 2.0  # Assumed time-to-first-token for models without data
+ERROR_PENALTY = 10.0  # Seconds added to a model's score per unit of error rate
+SAVE_INTERVAL = 5.0  # Minimum seconds between stats writes
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class ModelRouter:
+    """Orders fallback models by recent health and keeps failing ones out of rotation.
+
+    Each attempt is recorded as (timestamp, ok, status, latency, ttft). Models are
+    ranked by median time-to-first-token plus a penalty for their error and 429 rates
+    over the rolling window (a 429 counts once, as a rate limit, not as an error).
+    FAILURE_THRESHOLD consecutive failures open a circuit breaker, and a Retry-After
+    header blocks a model for the requested time. Once the cooldown has passed the
+    model is tried again (half-open): a success closes the circuit, a failure re-opens
+    it for twice as long. Stats are persisted to MODEL_STATS_FILE so a restart doesn't
+    forget a model that was failing.
+    """
+
+    def __init__(self, models, stats_file=MODEL_STATS_FILE):
+        self.models = list(models)
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._state = {}
+        self.load()
+
+    def _model_state(self, model):
+        state = self._state.get(model)
+        if state is None:
+            state = self._state[model] = {
+                "events": [], "consecutive_failures": 0, "trips": 0,
+                "open_until": 0.0, "blocked_until": 0.0,
+            }
+        return state
+
+    def _prune(self, state, now):
+        events = state["events"]
+        cutoff = now - WINDOW_SECONDS
+        start = 0
+        while start < len(events) and events[start][0] < cutoff:
+            start += 1
+        if start or len(events) > MAX_EVENTS:
+            state["events"] = events[max(start, len(events) - MAX_EVENTS):]
+
+    # --- recording ---
+    def record_success(self, model, latency, ttft=None):
+        now = time.time()
+        with self._lock:
+            state = self._model_state(model)
+            state["events"].append([now, True, 200, latency, ttft])
+            state["consecutive_failures"] = 0
+            state["trips"] = 0
+            state["open_until"] = 0.0
+            self._prune(state, now)
+        self._maybe_save()
+
+    def record_failure(self, model, status=None, retry_after=None, latency=None):
+        now = time.time()
+        with self._lock:
+            state = self._model_state(model)
+            state["events"].append([now, False, status, latency, None])
+            state["consecutive_failures"] += 1
+            if retry_after:
+                state["blocked_until"] = max(state["blocked_until"], now + retry_after)
+            # A half-open model (tripped before) re-opens on its first failure
+            if state["consecutive_failures"] >= FAILURE_THRESHOLD or state["trips"]:
+                cooldown = min(MAX_COOLDOWN, BASE_COOLDOWN * 2 ** state["trips"])
+                state["open_until"] = now + cooldown
+                state["trips"] += 1
+                state["consecutive_failures"] = 0
+            self._prune(state, now)
+        self._maybe_save()
+
+    # --- routing ---
+    def _available_at(self, state):
+        return max(state["open_until"], state["blocked_until"])
+
+    def _metrics(self, state, now=None):
+        # The window is applied on read too: events are only pruned when a model is tried again
+        cutoff = (now or time.time()) - WINDOW_SECONDS
+        events = [e for e in state["events"] if e[0] >= cutoff]
+        ok = [e for e in events if e[1]]
+        total = len(events)
+        rate_limited = sum(1 for e in events if e[2] == 429)
+        return {
+            "samples": total,
+            "error_rate": (total - len(ok) - rate_limited) / total if total else 0.0,  # Failures other than 429
+            "rate_limit_rate": rate_limited / total if total else 0.0,
+            "ttft_p50": _percentile([e[4] for e in ok if e[4] is not None], 50),
+            "latency_p50": _percentile([e[3] for e in ok if e[3] is not None], 50),
+        }
+
+    def _score(self, model, state, now=None):
+        metrics = self._metrics(state, now)
+        ttft = metrics["ttft_p50"] if metrics["ttft_p50"] is not None else UNKNOWN_TTFT
+        return ttft + ERROR_PENALTY * (metrics["error_rate"] + metrics["rate_limit_rate"])
+
+    def order(self, models=None, include_unavailable=True):
+        """Models to try, best first. Blocked or open-circuit models come last, soonest-available first.
+
+        With include_unavailable=False they are left out, unless nothing else is left to try.
+        """
+        candidates = list(models or self.models)
+        now = time.time()
+        with self._lock:
+            ready, waiting = [], []
+            for position, model in enumerate(candidates):
+                state = self._model_state(model)
+                available_at = self._available_at(state)
+                if available_at > now:
+                    waiting.append((available_at, position, model))
+                else:
+                    ready.append((self._score(model, state, now), position, model))
+        ready = [m for _, _, m in sorted(ready)]
+        waiting = [m for _, _, m in sorted(waiting)]
+        if include_unavailable:
+            return ready + waiting
+        return ready or waiting[:1]
+
+    def is_available(self, model):
+        with self._lock:
+            return self._available_at(self._model_state(model)) <= time.time()
+
+    # --- persistence & reporting ---
+    def load(self):
+        if not self.stats_file or not os.path.exists(self.stats_file):
+            return
+        try:
+            with open(self.stats_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self._lock:
+                self._state.update(data.get("models", {}))
+        except Exception as e:
+            print(f"⚠️ Could not load model stats: {e}")
+
+    def save(self):
+        if not self.stats_file:
+            return
+        try:
+            with self._lock:
+                data = json.dumps({"saved_at": time.time(), "models": self._state})
+                self._last_save = time.time()
+            tmp_path = self.stats_file + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.stats_file)
+        except Exception as e:
+            print(f"⚠️ Could not save model stats: {e}")
+
+    def _maybe_save(self):
+        if time.time() - self._last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def snapshot(self):
+        """Per-model metrics and circuit state, in routing order."""
+        now = time.time()
+        order = self.order()
+        with self._lock:
+            rows = []
+            for model in order:
+                state = self._model_state(model)
+                row = self._metrics(state, now)
+                available_at = self._available_at(state)
+                if available_at > now:
+                    row["state"] = "blocked" if state["blocked_until"] >= state["open_until"] else "open"
+                    row["retry_in"] = available_at - now
+                else:
+                    row["state"] = "half-open" if state["trips"] else "closed"
+                    row["retry_in"] = 0.0
+                row["model"] = model
+                rows.append(row)
+            return rows
+
+    def report(self):
+        """Human-readable table for the /models command."""
+        def fmt(seconds):
+            return f"{seconds * 1000:.0f}ms" if seconds is not None else "–"
+
+        output = "🧠 Model routing (best first):\n" + "=" * 50 + "\n"
+        for i, row in enumerate(self.snapshot(), 1):
+            marker = {"closed": "🟢", "half-open": "🟡"}.get(row["state"], "🔴")
+            output += (f"{i}. {marker} {row['model']} [{row['state']}"
+                       + (f", retry in {row['retry_in']:.0f}s" if row["retry_in"] else "") + "]\n"
+                       f"     TTFT p50 {fmt(row['ttft_p50'])} | latency p50 {fmt(row['latency_p50'])} | "
+                       f"errors {row['error_rate']:.0%} | 429s {row['rate_limit_rate']:.0%} | "
+                       f"{row['samples']} samples\n")
+        return output
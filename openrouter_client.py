@@ -0,0 +1,334 @@
+# openrouter_client.py
+import os
+import json
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+
+import async_runtime
+from sse_parser import SSEParser, DONE
+from instrumentation import metrics
+
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+REQUEST_TIMEOUT = httpx.Timeout(45.0, connect=10.0)
+MAX_CONNECTIONS = 20  # Pooled connections kept open to OpenRouter
+KEEPALIVE_SECONDS = 30.0  # Idle pooled connections are closed after this long
+HEDGE_DELAY = 1.0  # Seconds without a first token before the next model is raced in parallel
+
+
+class ModelError(Exception):
+    """A single model attempt failed (HTTP error, timeout, empty or malformed reply)."""
+
+    def __init__(self, model, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.model = model
+        self.status = status
+        self.retry_after = retry_after
+
+
+class StreamInterrupted(ModelError):
+    """The chosen model's stream broke off after part of the answer had been delivered."""
+
+    def __init__(self, model, message, partial, status=None):
+        super().__init__(model, message, status)
+        self.partial = partial  # Text streamed before the failure
+
+
+class AllModelsFailed(Exception):
+    """Every model in the fallback list failed."""
+
+    def __init__(self, errors):
+        super().__init__("All models are currently unavailable")
+        self.errors = errors
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class OpenRouterClient:
+    """Async OpenRouter chat client with a persistent connection pool and hedged model racing.
+
+    Models are tried in order, but if the current one hasn't produced its first token
+    within hedge_delay seconds the next one is started in parallel. The first model to
+    produce content wins: its tokens are forwarded to on_token and the others are
+    cancelled. A failed attempt starts the next model immediately.
+    """
+
+    def __init__(self, api_key, hedge_delay=HEDGE_DELAY, url=OPENROUTER_URL, router=None, rate_limiter=None):
+        self.api_key = api_key
+        self.hedge_delay = hedge_delay
+        self.url = url
+        self.router = router  # Optional ModelRouter: picks the order and records every attempt
+        self.rate_limiter = rate_limiter  # Optional: `await rate_limiter.acquire(model)` before each attempt
+        self._http = None
+        self._last_used = None  # Loop time a pooled connection was last known to be open
+        self._warming = None
+
+    def _client(self):
+        # Created lazily so the pool is bound to the running (background) event loop
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS,
+                                    keepalive_expiry=KEEPALIVE_SECONDS),
+                headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+            )
+        return self._http
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._last_used = None
+
+    def close(self):
+        async_runtime.run(self.aclose())
+
+    # --- connection warm-up ---
+    def warm_up(self):
+        """Open a pooled connection in the background, ready for the next request.
+
+        Returns a concurrent.futures.Future of the seconds the connect took: 0.0 when a
+        connection was already open, None when it failed (the request will then report it).
+        """
+        return async_runtime.submit(self._warm_up())
+
+    async def _warm_up(self):
+        loop = asyncio.get_running_loop()
+        if self._last_used is not None and loop.time() - self._last_used < KEEPALIVE_SECONDS - 1:
+            return 0.0
+        if self._warming is None or self._warming.done():
+            self._warming = asyncio.ensure_future(self._connect())
+        return await asyncio.shield(self._warming)
+
+    async def _connect(self):
+        # A HEAD request sets up TCP and TLS; the connection then stays in the pool for the real POST
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            with metrics.span("llm.warm_up"):
+                await self._client().request("HEAD", self.url)
+        except httpx.HTTPError:
+            return None
+        self._last_used = loop.time()
+        return self._last_used - started
+
+    # --- single attempt ---
+    async def _send(self, model, payload):
+        """POST the request and return the open (streaming) response, or raise ModelError."""
+        client = self._client()
+        request = client.build_request("POST", self.url, json=dict(payload, model=model))
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TimeoutException:
+            raise ModelError(model, "timeout")
+        except httpx.HTTPError as e:
+            raise ModelError(model, f"connection error: {e}")
+        self._last_used = asyncio.get_running_loop().time()
+
+        if response.status_code != 200:
+            body = (await response.aread()).decode("utf-8", errors="replace")
+            await response.aclose()
+            raise ModelError(model, body[:200], status=response.status_code,
+                             retry_after=_parse_retry_after(response.headers.get("Retry-After")))
+        return response
+
+    async def _iter_content(self, model, response):
+        """Yield content chunks from a streamed (SSE) completion."""
+        parser = SSEParser()
+        async for raw in response.aiter_bytes():
+            for event in parser.feed(raw):
+                if event.data == DONE:
+                    return
+                try:
+                    data = json.loads(event.data)
+                except ValueError:
+                    continue
+                if data.get("error") and not data.get("choices"):
+                    raise ModelError(model, f"stream error: {data['error']}")
+                if data.get("choices"):
+                    content_chunk = data["choices"][0].get("delta", {}).get("content")
+                    if content_chunk:
+                        yield content_chunk
+
+    async def _first_token(self, model, payload, stream):
+        """Run an attempt up to its first content. Returns (response, first_chunk, chunk_iterator)."""
+        with metrics.span("llm.connect", model=model):  # Until response headers arrive
+            response = await self._send(model, payload)
+        try:
+            if not stream:
+                data = json.loads(await response.aread())
+                choices = data.get("choices") or []
+                if not choices:
+                    raise ModelError(model, "unexpected response format")
+                message = choices[0].get("message", {})
+                if message.get("tool_calls"):
+                    await response.aclose()
+                    return response, {"tool_calls": message["tool_calls"]}, None
+                content = (message.get("content") or "").strip()
+                if not content:
+                    raise ModelError(model, "empty response")
+                await response.aclose()
+                return response, content, None
+
+            chunks = self._iter_content(model, response)
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                raise ModelError(model, "empty response")
+            return response, first, chunks
+        except httpx.TimeoutException:
+            await response.aclose()
+            raise ModelError(model, "timeout")
+        except (ModelError, httpx.HTTPError, ValueError) as e:
+            await response.aclose()
+            if isinstance(e, ModelError):
+                raise
+            raise ModelError(model, str(e))
+        except asyncio.CancelledError:
+            await response.aclose()
+            raise
+
+    # --- racing ---
+    async def chat(self, messages, models, stream=True, on_token=None, on_start=None, on_error=None,
+                   on_attempt=None, max_tokens=500, temperature=0.7, hedge=True, tools=None):
+        """Return (model, content) from the first model that answers.
+
+        on_attempt(model) is called when a model is tried, on_error(model, error) when an
+        attempt fails, on_start(model) once a winner is chosen and on_token(chunk) for every
+        streamed chunk of the winner. Raises AllModelsFailed if nobody answers, and
+        StreamInterrupted (counted as a failed attempt) if the winner's stream breaks off
+        midway: its tokens have already been delivered, so there is no failover.
+
+        With `tools` (function-calling schemas) the request is never streamed, and content
+        is {"tool_calls": [...]} instead of text when the model asks to run tools.
+        """
+        if tools:
+            stream = False
+        payload = {"messages": messages, "max_tokens": max_tokens, "temperature": temperature, "stream": stream}
+        if tools:
+            payload["tools"] = tools
+        remaining = self.router.order(models, include_unavailable=False) if self.router else list(models)
+        running = {}
+        errors = []
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        async def attempt(model):
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(model)
+                started[model] = loop.time()  # Time spent waiting for the limiter isn't the model's latency
+            return await self._first_token(model, payload, stream)
+
+        def launch_next():
+            if not remaining:
+                return False
+            model = remaining.pop(0)
+            if on_attempt:
+                on_attempt(model)
+            started[model] = loop.time()
+            running[asyncio.ensure_future(attempt(model))] = model
+            return True
+
+        launch_next()
+        winner = None
+        try:
+            while running and winner is None:
+                delay = self.hedge_delay if hedge and remaining else None
+                done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch_next()  # Hedge: current attempts are slow, race the next model
+                    continue
+                failed = 0
+                for task in done:
+                    model = running.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        if not isinstance(e, ModelError):
+                            e = ModelError(model, f"unexpected error: {e}")
+                        errors.append(e)
+                        failed += 1
+                        metrics.observe("llm.failed", loop.time() - started[model], model=model)
+                        if self.router:
+                            self.router.record_failure(model, e.status, e.retry_after, loop.time() - started[model])
+                        if on_error:
+                            on_error(model, e)
+                        continue
+                    if winner is None:
+                        winner = (model, result)
+                        ttft = loop.time() - started[model]
+                        metrics.observe("llm.first_token", ttft, model=model)
+                    else:
+                        await result[0].aclose()  # Two finished together; keep the first
+                if winner is None:
+                    for _ in range(failed):
+                        launch_next()  # A failure doesn't wait for the hedge delay
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        if winner is None:
+            raise AllModelsFailed(errors)
+
+        model, (response, first, chunks) = winner
+        if isinstance(first, dict):
+            if self.router:
+                self.router.record_success(model, loop.time() - started[model], ttft)
+            return model, first
+        if on_start:
+            on_start(model)
+        parts = [first]
+        if on_token:
+            on_token(first)
+        if chunks is not None:
+            try:
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    if on_token:
+                        on_token(chunk)
+            except (httpx.HTTPError, ModelError) as e:
+                error = StreamInterrupted(model, f"stream interrupted: {e}", "".join(parts),
+                                          e.status if isinstance(e, ModelError) else None)
+                metrics.observe("llm.failed", loop.time() - started[model], model=model)
+                if self.router:
+                    self.router.record_failure(model, error.status, None, loop.time() - started[model])
+                if on_error:
+                    on_error(model, error)
+                raise error from e
+            finally:
+                await response.aclose()
+        self._last_used = loop.time()
+        metrics.observe("llm.total", loop.time() - started[model], model=model)
+        if self.router:
+            self.router.record_success(model, loop.time() - started[model], ttft)
+        return model, "".join(parts)
+
+    def complete(self, messages, models, **kwargs):
+        """Blocking wrapper around chat() for synchronous callers."""
+        return async_runtime.run(self.chat(messages, models, **kwargs))
+
+
+class ChatCompletionsShim:
+    """Minimal `client.chat.completions.create(...)` facade over a complete(messages) callable.
+
+    Lets code written against the OpenAI SDK (tasks/test_plan_generator.py) run on the
+    agent's OpenRouter models; the requested model name is ignored.
+    """
+
+    def __init__(self, complete):
+        self._complete = complete
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model=None, messages=None, **kwargs):
+        options = {key: kwargs[key] for key in ("max_tokens", "temperature") if key in kwargs}
+        used_model, content = self._complete(messages, **options)
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(model=used_model, choices=[SimpleNamespace(index=0, message=message)])
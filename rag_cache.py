@@ -0,0 +1,171 @@
+# rag_cache.py
+import os
+import time
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+DISK_PRUNE_EVERY = 200  # Writes between trims of the on-disk tier
+
+
+def normalize_query(text):
+    """Cache key for a query: case- and whitespace-insensitive."""
+    return " ".join(text.lower().split())
+
+
+class QueryCache:
+    """Two-level LRU cache of query embeddings and formatted retrieval results.
+
+    The memory tier is an OrderedDict LRU. The optional disk tier is a small SQLite
+    file, so answers to common questions survive restarts. Result entries are tagged
+    with the knowledge-base generation and dropped once the collection changes;
+    embeddings only depend on the model and are kept across generations.
+    """
+
+    def __init__(self, max_entries=512, db_path=None, max_disk_entries=20000, embedding_tag=""):
+        self.max_entries = max_entries
+        self.embedding_tag = embedding_tag  # Embedding backend name; vectors of other backends aren't reused
+        self.max_disk_entries = max_disk_entries
+        self.db_path = db_path
+        self._embeddings = OrderedDict()
+        self._results = OrderedDict()
+        self._generation = None
+        self._db = None
+        self._disk_writes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "embedding_hits": 0, "embedding_misses": 0,
+            "result_hits": 0, "result_misses": 0,
+            "disk_hits": 0, "invalidations": 0,
+        }
+
+    # --- disk tier ---
+    def _connect(self):
+        if self.db_path is None:
+            return None
+        if self._db is None:
+            try:
+                os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                                 "(query TEXT PRIMARY KEY, vector BLOB, used REAL)")
+                self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                                 "(query TEXT, n_results INTEGER, generation TEXT, context TEXT, used REAL, "
+                                 "PRIMARY KEY (query, n_results))")
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Query cache disk tier disabled: {e}")
+                self.db_path = None
+                self._db = None
+        return self._db
+
+    def _disk_write(self, sql, params):
+        db = self._connect()
+        if db is None:
+            return
+        try:
+            db.execute(sql, params)
+            self._disk_writes += 1
+            if self._disk_writes % DISK_PRUNE_EVERY == 0:
+                for table in ("embeddings", "results"):
+                    db.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} "
+                               f"ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,))
+            db.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Query cache write failed: {e}")
+
+    # --- memory tier ---
+    def _remember(self, store, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_entries:
+            store.popitem(last=False)
+
+    def _check_generation(self, generation):
+        """Drop cached results when the knowledge base has changed since they were stored."""
+        if generation == self._generation:
+            return
+        if self._generation is not None:
+            self.counters["invalidations"] += 1
+        self._generation = generation
+        self._results.clear()
+        db = self._connect()
+        if db is not None:
+            db.execute("DELETE FROM results WHERE generation != ?", (generation,))
+            db.commit()
+
+    def _embedding_key(self, query_text):
+        key = normalize_query(query_text)
+        return f"{self.embedding_tag}|{key}" if self.embedding_tag else key
+
+    def get_embedding(self, query_text):
+        key = self._embedding_key(query_text)
+        with self._lock:
+            vector = self._embeddings.get(key)
+            if vector is None:
+                db = self._connect()
+                row = db.execute("SELECT vector FROM embeddings WHERE query = ?", (key,)).fetchone() if db else None
+                if row is not None:
+                    vector = array('f', row[0]).tolist()
+                    self.counters["disk_hits"] += 1
+                    self._remember(self._embeddings, key, vector)
+            else:
+                self._embeddings.move_to_end(key)
+            self.counters["embedding_hits" if vector is not None else "embedding_misses"] += 1
+            return vector
+
+    def put_embedding(self, query_text, vector):
+        key = self._embedding_key(query_text)
+        with self._lock:
+            self._remember(self._embeddings, key, list(vector))
+            self._disk_write("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                             (key, array('f', vector).tobytes(), time.time()))
+
+    def get_results(self, query_text, n_results, generation):
+        key = (normalize_query(query_text), n_results)
+        with self._lock:
+            self._check_generation(generation)
+            context = self._results.get(key)
+            if context is None:
+                db = self._connect()
+                row = db.execute("SELECT context FROM results WHERE query = ? AND n_results = ? AND generation = ?",
+                                 (key[0], n_results, generation)).fetchone() if db else None
+                if row is not None:
+                    context = row[0]
+                    self.counters["disk_hits"] += 1
+                    self._remember(self._results, key, context)
+            else:
+                self._results.move_to_end(key)
+            self.counters["result_hits" if context is not None else "result_misses"] += 1
+            return context
+
+    def put_results(self, query_text, n_results, generation, context):
+        key = (normalize_query(query_text), n_results)
+        with self._lock:
+            self._check_generation(generation)
+            self._remember(self._results, key, context)
+            self._disk_write("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                             (key[0], n_results, generation, context, time.time()))
+
+    def clear(self):
+        """Forget everything, including the disk tier."""
+        with self._lock:
+            self._embeddings.clear()
+            self._results.clear()
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM embeddings")
+                db.execute("DELETE FROM results")
+                db.commit()
+
+    def stats(self):
+        """Hit/miss counters plus current sizes."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["embeddings_cached"] = len(self._embeddings)
+            stats["results_cached"] = len(self._results)
+            lookups = stats["result_hits"] + stats["result_misses"]
+            stats["result_hit_rate"] = stats["result_hits"] / lookups if lookups else 0.0
+            return stats
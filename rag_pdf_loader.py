@@ -1,159 +1,1231 @@
 # rag_pdf_loader.py
 import os
-import pdfplumber
-import chromadb
-from sentence_transformers import SentenceTransformer
+import re
+import glob
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from rag_cache import QueryCache
+from embedding_backends import create_backend
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from rag_router import PrototypeStore, compute_prototypes, sample_embeddings
+from mmap_index import MmapIndex, write_index
+from instrumentation import metrics
+
 load_dotenv()
 
 # --- CONFIG ---
-CHROMA_DB_PATH = "rag_db"
-COLLECTION_NAME = "pdf_knowledge"
+CHROMA_DB_PATH = os.getenv("RAG_DB_PATH", "rag_db")
+COLLECTION_NAME = "pdf_knowledge"  # Default collection
+COLLECTIONS_FILE = os.path.join(CHROMA_DB_PATH, "collections.json")  # Named collections and their shard counts
+DEFAULT_SHARDS = int(os.getenv("RAG_SHARDS", "1"))  # Shards of a newly created collection; documents are spread by path hash
+SHARD_WORKERS = int(os.getenv("RAG_SHARD_WORKERS", "8"))  # Threads searching shards in parallel
+RAG_BACKEND = os.getenv("RAG_BACKEND", "chroma")  # "mmap" serves queries from an exported read-only index without chromadb
+MMAP_INDEX_DIR = os.getenv("RAG_MMAP_INDEX", os.path.join(CHROMA_DB_PATH, "mmap_index"))
+MMAP_DTYPE = os.getenv("RAG_MMAP_DTYPE", "float16")  # Stored vector type: "float16" or "int8" (half the size again)
 CHUNK_SIZE = 300  # Smaller chunks for better retrieval
-CHUNK_OVERLAP = 50  # Overlap between chunks to preserve context
+CHUNK_OVERLAP = 50  # Characters of the previous chunk repeated at the start of the next
+EMBED_BATCH_SIZE = 64  # Chunks per encode() / upsert() call
+EMBEDDING_BACKEND = os.getenv("RAG_EMBEDDING_BACKEND", "torch")  # "torch", "onnx" or "onnx-int8" (fastest on CPU)
+EMBEDDING_THREADS = int(os.getenv("RAG_EMBEDDING_THREADS", "0")) or None  # CPU threads for encoding; None = library default
+EMBEDDING_DEVICE = os.getenv("RAG_EMBEDDING_DEVICE") or None  # Torch device, e.g. "cpu" or "cuda"; None = GPU if available
+ONNX_MODEL_DIR = os.getenv("RAG_ONNX_MODEL_DIR")  # Local tokenizer.json + .onnx files for offline hosts
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # Processes used for page extraction
+PAGES_PER_TASK = 20  # Pages handed to an extraction worker at a time
+MANIFEST_FILE = os.path.join(CHROMA_DB_PATH, "index_manifest.json")  # File/chunk hashes of indexed PDFs
+GENERATION_FILE = os.path.join(CHROMA_DB_PATH, "generation")  # Changes whenever the collection does
+QUERY_CACHE_SIZE = 512  # Queries kept in the in-memory LRU
+QUERY_CACHE_PERSIST = True  # Also keep cached queries on disk across restarts
+QUERY_CACHE_DB = os.path.join(CHROMA_DB_PATH, "query_cache.sqlite3")
+KEYWORD_INDEX_DB = os.path.join(CHROMA_DB_PATH, "bm25_index.sqlite3")  # BM25 index of the default collection
+HYBRID_SEARCH = True  # Fuse BM25 keyword hits with vector hits (reciprocal rank fusion)
+HYBRID_CANDIDATES = 20  # Candidates taken from each retriever before fusion
+RRF_K = 60
+RERANK_MODEL = os.getenv("RAG_RERANK_MODEL")  # e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"; unset disables reranking
+RERANK_TOP_N = 10  # Fused candidates passed to the cross-encoder
+ROUTING_PROTOTYPES_FILE = os.path.join(CHROMA_DB_PATH, "routing_prototypes.json")  # Centroids used by rag_router
+
+query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_DB if QUERY_CACHE_PERSIST else None,
+                         embedding_tag=EMBEDDING_BACKEND)
+prototype_store = PrototypeStore(ROUTING_PROTOTYPES_FILE)
+
+# Heavy dependencies (the embedding backend, chromadb) are imported on first use,
+# so importing this module costs milliseconds and sessions that never hit RAG never pay for them.
+embedding_model = None
+chroma_client = None
+keyword_indexes = {}  # (collection name, read_only) -> BM25Index
+shard_pool = None
+mmap_index = None
+rerank_model = None
+_model_lock = threading.Lock()
+_client_lock = threading.Lock()
+_prototype_lock = threading.Lock()
+_rebuild_lock = threading.Lock()
+_prototype_rebuilds = set()  # Collections whose prototypes are being rebuilt in the background
+_warmup_thread = None
+
+
+def get_embedding_model():
+    """Load the embedding backend on first use (downloads on first run, ~90MB)."""
+    global embedding_model
+    if embedding_model is None:
+        with _model_lock:
+            if embedding_model is None:
+                print(f"🔄 Loading embedding model ({EMBEDDING_BACKEND})...")
+                with metrics.span("rag.model_load"):
+                    embedding_model = create_backend(EMBEDDING_BACKEND, EMBEDDING_THREADS, ONNX_MODEL_DIR,
+                                                     EMBEDDING_DEVICE)
+                print("✅ Embedding model loaded!\n")
+    return embedding_model
+
+
+def get_chroma_client():
+    """Return the process-wide Chroma client, creating it on first use."""
+    global chroma_client
+    if chroma_client is None:
+        with _client_lock:
+            if chroma_client is None:
+                import chromadb
+                chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    return chroma_client
+
+
+def _keyword_index_path(name):
+    return KEYWORD_INDEX_DB if name == COLLECTION_NAME else os.path.join(CHROMA_DB_PATH, f"bm25_index.{name}.sqlite3")
+
+
+def get_keyword_index(name=COLLECTION_NAME, read_only=False):
+    """Return a collection's BM25 keyword index, opening it on first use (read_only: an existing file, for search)."""
+    index = keyword_indexes.get((name, read_only))
+    if index is None:
+        with _client_lock:
+            index = keyword_indexes.get((name, read_only))
+            if index is None:
+                if not read_only:
+                    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+                index = keyword_indexes[(name, read_only)] = BM25Index(_keyword_index_path(name), read_only)
+    return index
+
+
+def get_mmap_index():
+    """The exported memory-mapped index (RAG_BACKEND=mmap), opened on first use; None if there is none."""
+    global mmap_index
+    if mmap_index is None:
+        with _client_lock:
+            if mmap_index is None:
+                try:
+                    mmap_index = MmapIndex(MMAP_INDEX_DIR)
+                except (OSError, ValueError) as e:
+                    print(f"📭 No memory-mapped index at {MMAP_INDEX_DIR} ({e}). Export one with option 6.")
+                    return None
+                if mmap_index.generation != get_generation():
+                    print("⚠️ The memory-mapped index is older than the knowledge base; re-export it.")
+    return mmap_index
+
+
+def get_shard_pool():
+    """Thread pool that fans queries out over shards."""
+    global shard_pool
+    if shard_pool is None:
+        with _client_lock:
+            if shard_pool is None:
+                shard_pool = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="rag-shard")
+    return shard_pool
 
-# Load embedding model (downloads on first run, ~90MB)
-print("🔄 Loading embedding model...")
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')  # Fast, lightweight
-print("✅ Embedding model loaded!\n")
+
+def get_rerank_model():
+    """Load the optional cross-encoder used to rerank fused candidates."""
+    global rerank_model
+    if rerank_model is None and RERANK_MODEL:
+        with _model_lock:
+            if rerank_model is None:
+                from sentence_transformers import CrossEncoder
+                print(f"🔄 Loading reranker {RERANK_MODEL}...")
+                rerank_model = CrossEncoder(RERANK_MODEL)
+    return rerank_model
+
+
+def reset_chroma_client():
+    """Drop the shared client so the next use re-opens SQLite and reloads HNSW segments from disk."""
+    global chroma_client
+    with _client_lock:
+        if chroma_client is not None:
+            clear_cache = getattr(chroma_client, "clear_system_cache", None)
+            if clear_cache is not None:
+                clear_cache()
+        chroma_client = None
+
+
+def warm_up(background=True):
+    """Load the embedding model and Chroma client ahead of the first knowledge query.
+
+    With background=True this runs in a daemon thread and returns immediately.
+    """
+    global _warmup_thread
+
+    def _load():
+        try:
+            get_embedding_model()
+            if RAG_BACKEND == "mmap":
+                get_mmap_index()
+            else:
+                retrieval_service.shards()
+        except Exception as e:
+            print(f"⚠️ RAG warm-up failed: {e}")
+
+    if not background:
+        _load()
+        return None
+    if _warmup_thread is None or not _warmup_thread.is_alive():
+        _warmup_thread = threading.Thread(target=_load, name="rag-warmup", daemon=True)
+        _warmup_thread.start()
+    return _warmup_thread
 
 
 def get_embedding(text):
     """Generate embedding using local model."""
     try:
-        embedding = embedding_model.encode(text, convert_to_numpy=True)
-        return embedding.tolist()
+        model = get_embedding_model()
+        with metrics.span("rag.embed"):
+            return model.encode([text])[0].tolist()
     except Exception as e:
         print(f"❌ Embedding error: {e}")
         return None
 
 
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF using pdfplumber."""
-    text = ""
+def is_embedding_model_loaded():
+    return embedding_model is not None
+
+
+def embed_query(text):
+    """Embedding of a user question, served from the query cache when seen before."""
+    embedding = query_cache.get_embedding(text)
+    if embedding is None:
+        embedding = get_embedding(text)
+        if embedding is not None:
+            query_cache.put_embedding(text, embedding)
+    return embedding
+
+
+def get_embeddings(texts, batch_size=EMBED_BATCH_SIZE):
+    """Generate embeddings for a list of texts with batched encode() calls."""
+    try:
+        return get_embedding_model().encode(texts, batch_size=batch_size).tolist()
+    except Exception as e:
+        print(f"❌ Embedding error: {e}")
+        return None
+
+
+def _extract_page_range(file_path, start, end):
+    """Extract the text of pages [start, end). Runs inside a worker process."""
+    import pdfplumber
     with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-    return text
-
-
-def split_into_chunks(text, size=CHUNK_SIZE):
-    """Split text into chunks by paragraphs."""
-    paragraphs = text.split("\n\n")
-    chunks = []
-    current_chunk = ""
-    for para in paragraphs:
-        if len(current_chunk) + len(para) <= size:
-            current_chunk += para + "\n\n"
-        else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = para + "\n\n"
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    return chunks
-
-
-def index_pdf(file_path):
-    """Process PDF, embed chunks, and store in Chroma DB."""
-    if not os.path.exists(file_path):
-        print(f"❌ File not found: {file_path}")
-        return
+        return [page.extract_text() or "" for page in pdf.pages[start:end]]
 
-    print(f"📄 Loading PDF: {file_path}")
-    text = extract_text_from_pdf(file_path)
-    
-    if not text.strip():
-        print("❌ No text extracted from PDF!")
+
+def iter_pages(file_path, executor=None, workers=None):
+    """Yield (page_number, text) in page order, one page range in memory at a time.
+
+    With an executor, a bounded window of page ranges (two per worker; `workers`
+    defaults to the executor's pool size) is extracted ahead in worker processes,
+    so a 2,000-page PDF never has more than a few ranges of text pending.
+    """
+    import pdfplumber
+    with pdfplumber.open(file_path) as pdf:
+        page_count = len(pdf.pages)
+
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count))
+              for start in range(0, page_count, PAGES_PER_TASK)]
+    if executor is None or len(ranges) <= 1:
+        for start, end in ranges:
+            for offset, text in enumerate(_extract_page_range(file_path, start, end)):
+                yield start + offset + 1, text
         return
-    
-    chunks = split_into_chunks(text)
-    print(f"✂️ Split into {len(chunks)} chunks")
-
-    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-    collection = client.get_or_create_collection(name=COLLECTION_NAME)
-
-    successful = 0
-    for i, chunk in enumerate(chunks):
-        print(f"🔢 Embedding chunk {i+1}/{len(chunks)}...", end=' ')
-        embedding = get_embedding(chunk)
-        if embedding is None:
-            print("⚠️ Skipped")
+
+    workers = workers or getattr(executor, "_max_workers", EXTRACT_WORKERS)
+    remaining = iter(ranges)
+    pending = deque()
+    for start, end in remaining:
+        pending.append((start, executor.submit(_extract_page_range, file_path, start, end)))
+        if len(pending) >= workers * 2:
+            break
+    while pending:
+        start, future = pending.popleft()
+        following = next(remaining, None)
+        if following:
+            pending.append((following[0], executor.submit(_extract_page_range, file_path, *following)))
+        for offset, text in enumerate(future.result()):
+            yield start + offset + 1, text
+
+
+def extract_pages(file_path, executor=None):
+    """Extract the text of every page as a list."""
+    return [text for _, text in iter_pages(file_path, executor)]
+
+
+def extract_text_from_pdf(file_path, executor=None):
+    """Extract text from PDF using pdfplumber."""
+    return "".join(page_text + "\n" for _, page_text in iter_pages(file_path, executor) if page_text)
+
+
+def _split_units(text, size):
+    """Paragraphs of text; paragraphs longer than size are broken into lines, then words."""
+    for para in text.split("\n\n"):
+        para = para.strip()
+        if len(para) <= size:
+            if para:
+                yield para
             continue
-        
-        collection.add(
-            ids=[f"{os.path.basename(file_path)}_{i}"],
-            documents=[chunk],
-            embeddings=[embedding],
-            metadatas=[{"source": file_path, "chunk_index": i}]
-        )
-        successful += 1
-        print("✅")
-
-    print(f"\n✅ PDF indexed successfully! ({successful}/{len(chunks)} chunks)")
-
-
-def query_knowledge(query_text, n_results=3):
-    """Query the knowledge base."""
-    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-    
+        for line in para.splitlines():
+            line = line.strip()
+            if len(line) <= size:
+                if line:
+                    yield line
+                continue
+            piece = ""
+            for word in line.split():
+                if piece and len(piece) + 1 + len(word) > size:
+                    yield piece
+                    piece = word
+                else:
+                    piece = f"{piece} {word}" if piece else word
+            if piece:
+                yield piece
+
+
+def _overlap_tail(text, overlap):
+    """The last `overlap` characters of text, starting on a word boundary."""
+    if overlap <= 0 or not text:
+        return ""
+    if len(text) <= overlap:
+        return text
+    tail = text[-overlap:]
+    if not text[-overlap - 1].isspace():
+        _, _, tail = tail.partition(" ")
+    return tail.strip()
+
+
+def iter_chunks(pages, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Chunk (page_number, text) pairs on the fly; yields (chunk, first_page, last_page).
+
+    Each chunk holds up to `size` characters of new text, prefixed by up to `overlap`
+    characters from the end of the previous chunk. Only the chunk being built is kept.
+    """
+    current, fresh, first_page, last_page = "", False, None, None
+    for page_number, text in pages:
+        for unit in _split_units(text or "", size):
+            if fresh and len(current) + 1 + len(unit) > size:
+                yield current, first_page, last_page
+                current, fresh = _overlap_tail(current, overlap), False
+                first_page = last_page if current else None
+            if first_page is None:
+                first_page = page_number
+            current = f"{current}\n{unit}" if current else unit
+            fresh, last_page = True, page_number
+    if fresh:
+        yield current, first_page, last_page
+
+
+def split_into_chunks(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Split text into overlapping chunks by paragraphs."""
+    return [chunk for chunk, _, _ in iter_chunks([(1, text)], size, overlap)]
+
+
+def collect_pdf_paths(target):
+    """Resolve a PDF file, a directory (searched recursively) or a glob pattern to PDF paths."""
+    if os.path.isdir(target):
+        paths = [os.path.join(root, name)
+                 for root, _, names in os.walk(target)
+                 for name in names if name.lower().endswith(".pdf")]
+    elif glob.has_magic(target):
+        paths = [p for p in glob.glob(target, recursive=True) if os.path.isfile(p)]
+    else:
+        paths = [target] if os.path.isfile(target) else []
+    return sorted(paths)
+
+
+def load_manifest():
+    """Load the index manifest: per collection, the file hash, mtime and chunk hashes of each indexed PDF."""
+    if os.path.exists(MANIFEST_FILE):
+        try:
+            with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if "collections" not in manifest:  # Version 1 tracked the default collection only
+                manifest = {"version": 2, "collections": {COLLECTION_NAME: {"files": manifest.get("files", {})}}}
+            return manifest
+        except Exception as e:
+            print(f"⚠️ Could not read index manifest, re-indexing everything: {e}")
+    return {"version": 2, "collections": {}}
+
+
+def save_manifest(manifest):
+    """Write the manifest atomically so an interrupted run never leaves it half-written."""
+    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def load_collections():
+    """{name: {"shards": n, "metadata": {...}}} of every collection created through index_pdf."""
+    try:
+        with open(COLLECTIONS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except OSError:
+        return {}
+    except ValueError as e:
+        print(f"⚠️ Could not read {COLLECTIONS_FILE}: {e}")
+        return {}
+
+
+def save_collections(collections):
+    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    tmp_path = COLLECTIONS_FILE + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(collections, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, COLLECTIONS_FILE)
+
+
+def is_valid_collection_name(name):
+    # Chroma's naming rules, minus the suffix reserved for extra shards
+    return bool(re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9._-]{1,40}[A-Za-z0-9]", name)) and not re.search(r"_shard\d+$", name)
+
+
+def shard_names(name, shards):
+    """Chroma collection names of a collection's shards. Shard 0 keeps the plain name, so an
+    unsharded collection (including one indexed before sharding existed) is its own shard 0."""
+    return [name if i == 0 else f"{name}_shard{i}" for i in range(shards)]
+
+
+def _manifest_files(manifest, name):
+    return manifest["collections"].setdefault(name, {"files": {}})["files"]
+
+
+def _doc_id(file_path):
+    return hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:12]
+
+
+def _shard_of(chunk_or_doc_id, shards):
+    """Shard holding a document: chunk IDs start with the document ID, a hash of its path."""
+    try:
+        return int(chunk_or_doc_id.split("_", 1)[0], 16) % shards
+    except ValueError:
+        return 0  # Old basename_i IDs were never sharded
+
+
+def get_generation():
+    """Current knowledge-base generation ("" if nothing was indexed through index_pdf yet)."""
+    try:
+        with open(GENERATION_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def bump_generation(generation=None):
+    """Mark the knowledge base as changed so cached query results get invalidated."""
+    generation = generation or str(time.time_ns())
+    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    with open(GENERATION_FILE, 'w', encoding='utf-8') as f:
+        f.write(generation)
+    retrieval_service.mark_local_change(generation)
+
+
+class RetrievalService:
+    """Long-lived owner of the shard handles used to answer queries.
+
+    Handles are looked up once and reused. They are only refreshed when the generation
+    marker changes; if the change came from another process (e.g. the indexer menu),
+    the shared client is re-opened too so its in-memory HNSW indexes aren't stale.
+    Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._handles = {}  # Chroma collection name -> handle (None if missing)
+        self._collections = None
+        self._generation = None
+        self._local_generations = set()
+        self.reloads = 0
+
+    def mark_local_change(self, generation):
+        """Record a generation written by this process (the open client already sees it)."""
+        with self._lock:
+            self._local_generations.add(generation)
+
+    def _refresh(self):
+        generation = get_generation()
+        if generation == self._generation and self._collections is not None:
+            return
+        with self._lock:
+            if generation != self._generation or self._collections is None:
+                if self._generation is not None and generation not in self._local_generations:
+                    reset_chroma_client()
+                self._handles = {}
+                # Knowledge bases indexed before collections.json existed are the default collection
+                self._collections = load_collections() or {COLLECTION_NAME: {"shards": 1}}
+                self._generation = generation
+                self.reloads += 1
+
+    def _handle(self, chroma_name):
+        handle = self._handles.get(chroma_name, False)
+        if handle is False:
+            with self._lock, metrics.span("rag.open_collection"):
+                try:
+                    handle = get_chroma_client().get_collection(name=chroma_name)
+                except Exception:
+                    handle = None
+                self._handles[chroma_name] = handle
+        return handle
+
+    def collections(self):
+        """Registered collections as {name: {"shards": n, ...}}."""
+        self._refresh()
+        return dict(self._collections)
+
+    def layout(self, names=None):
+        """[(collection name, [shard handle or None, ...])] for the given names (default: all collections)."""
+        self._refresh()
+        if names is None:
+            names = list(self._collections)
+        elif isinstance(names, str):
+            names = [names]
+        layout = []
+        for name in names:
+            config = self._collections.get(name)
+            if config is not None:
+                layout.append((name, [self._handle(shard) for shard in shard_names(name, config["shards"])]))
+        return layout
+
+    def shards(self, names=None):
+        """[(collection name, handle)] of every existing shard of the given collections."""
+        return [(name, handle) for name, handles in self.layout(names) for handle in handles if handle is not None]
+
+    def available(self, names=None):
+        """True if any of the given collections (default: any) has been indexed (or exported, with RAG_BACKEND=mmap)."""
+        if RAG_BACKEND == "mmap":
+            index = get_mmap_index()
+            return index is not None and index.has(names)
+        return bool(self.shards(names))
+
+    def collection(self, name=COLLECTION_NAME):
+        """Shard 0 of a collection, or None if it hasn't been indexed yet."""
+        layout = self.layout(name)
+        return layout[0][1][0] if layout else None
+
+
+retrieval_service = RetrievalService()
+
+
+def _file_hash(file_path):
+    """SHA-256 of a file, read in 1MB blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _chunk_id(doc_id, chunk, seen):
+    """Stable chunk ID from the document path hash and chunk content.
+
+    Unchanged chunks keep their ID when text is inserted before them, and files that
+    share a basename in different folders no longer collide. `seen` counts repeated
+    content within the document. Returns (chunk_id, content_hash).
+    """
+    content_hash = hashlib.sha1(chunk.encode('utf-8')).hexdigest()
+    occurrence = seen.get(content_hash, 0)
+    seen[content_hash] = occurrence + 1
+    return f"{doc_id}_{content_hash[:16]}" + (f"_{occurrence}" if occurrence else ""), content_hash
+
+
+def _remove_document(shards, manifest, file_path, name=COLLECTION_NAME):
+    """Delete every chunk of a document from its shard and drop it from the manifest."""
+    entry = _manifest_files(manifest, name).pop(file_path, None)
+    if entry and entry["chunks"]:
+        shards[_shard_of(_doc_id(file_path), len(shards))].delete(ids=list(entry["chunks"]))
+        get_keyword_index(name).remove(list(entry["chunks"]))
+        return len(entry["chunks"])
+    return 0
+
+
+def _index_single_pdf(file_path, shards, executor, batch_size, manifest, force=False, name=COLLECTION_NAME,
+                      metadata=None, progress=None, log=print, stats=None):
+    """Extract, chunk, embed and upsert one PDF into its shard, embedding only chunks the manifest doesn't know.
+
+    progress(message), if given, is called after every embedded batch; log(text) takes the status lines.
+    The counts go into `stats` (a new dict by default), so a caller still sees the writes made before an error.
+    """
+    stats = {} if stats is None else stats
+    stats.update({"pages": 0, "chunks": 0, "indexed": 0, "deleted": 0, "skipped": 0,
+                  "extract_time": 0.0, "embed_time": 0.0, "write_time": 0.0})
+    given_path, file_path = file_path, os.path.abspath(file_path)
+    doc_id = _doc_id(file_path)
+    collection = shards[_shard_of(doc_id, len(shards))]
+    keyword_index = get_keyword_index(name)
+    entry = _manifest_files(manifest, name).get(file_path)
+    file_stat = os.stat(file_path)
+
+    if entry and not force:
+        if entry["mtime"] == file_stat.st_mtime and entry["size"] == file_stat.st_size:
+            log(f"⏭️ Unchanged: {file_path}")
+            stats["skipped"] = 1
+            return stats
+        file_hash = _file_hash(file_path)
+        if entry["file_hash"] == file_hash:
+            log(f"⏭️ Unchanged (touched): {file_path}")
+            entry["mtime"] = file_stat.st_mtime
+            stats["skipped"] = 1
+            return stats
+    else:
+        file_hash = _file_hash(file_path)
+
+    if entry is None:
+        # First time through the manifest: drop chunks left by the old basename_i ID scheme
+        legacy = collection.get(where={"source": {"$in": sorted({given_path, file_path})}}, include=[])["ids"]
+        if legacy:
+            collection.delete(ids=legacy)
+            keyword_index.remove(legacy)
+            stats["deleted"] += len(legacy)
+        known = {}
+    else:
+        known = {} if force else entry["chunks"]
+
+    log(f"📄 Loading PDF: {file_path}")
+    started = time.perf_counter()
+    seen, indexed_chunks = {}, {}
+    new_batch, kept_batch = [], []
+
+    def count_pages(pages):
+        for page in pages:
+            stats["pages"] += 1
+            yield page
+
+    def flush_kept():
+        # Unchanged text may have moved; refresh its position without re-embedding
+        write_started = time.perf_counter()
+        collection.update(ids=[chunk_id for chunk_id, _ in kept_batch],
+                          metadatas=[metadata for _, metadata in kept_batch])
+        stats["write_time"] += time.perf_counter() - write_started
+        kept_batch.clear()
+
+    def flush_new():
+        first = stats["indexed"] + 1
+        label = f"🔢 Embedding chunks {first}-{first + len(new_batch) - 1}..."
+        embed_started = time.perf_counter()
+        embeddings = get_embeddings([chunk for _, _, chunk, _ in new_batch], batch_size)
+        stats["embed_time"] += time.perf_counter() - embed_started
+        if embeddings is None:
+            log(f"{label} ⚠️ Skipped")
+        else:
+            write_started = time.perf_counter()
+            collection.upsert(
+                ids=[chunk_id for chunk_id, _, _, _ in new_batch],
+                documents=[chunk for _, _, chunk, _ in new_batch],
+                embeddings=embeddings,
+                metadatas=[metadata for _, _, _, metadata in new_batch]
+            )
+            keyword_index.add([chunk_id for chunk_id, _, _, _ in new_batch],
+                              [chunk for _, _, chunk, _ in new_batch])
+            stats["write_time"] += time.perf_counter() - write_started
+            stats["indexed"] += len(new_batch)
+            indexed_chunks.update((chunk_id, content_hash) for chunk_id, content_hash, _, _ in new_batch)
+            log(f"{label} ✅")
+        new_batch.clear()
+        if progress:
+            progress(f"{os.path.basename(file_path)}: {stats['pages']} pages read, {stats['indexed']} chunks embedded")
+
+    # Pages stream through the chunker into bounded embed/upsert batches
+    for index, (chunk, first_page, last_page) in enumerate(iter_chunks(count_pages(iter_pages(file_path, executor)))):
+        chunk_id, content_hash = _chunk_id(doc_id, chunk, seen)
+        chunk_metadata = dict(metadata or {}, source=file_path, chunk_index=index, content_hash=content_hash,
+                              page=first_page, page_end=last_page)
+        stats["chunks"] += 1
+        if chunk_id in known:
+            kept_batch.append((chunk_id, chunk_metadata))
+            indexed_chunks[chunk_id] = content_hash
+            if len(kept_batch) >= batch_size:
+                flush_kept()
+        else:
+            new_batch.append((chunk_id, content_hash, chunk, chunk_metadata))
+            if len(new_batch) >= batch_size:
+                flush_new()
+    if kept_batch:
+        flush_kept()
+    if new_batch:
+        flush_new()
+    stats["extract_time"] = time.perf_counter() - started - stats["embed_time"] - stats["write_time"]
+
+    previous = entry["chunks"] if entry else {}
+    orphans = sorted(set(previous) - set(indexed_chunks))  # All of them if the new version has no text
+    if not stats["chunks"] and not previous:
+        log("❌ No text extracted from PDF!")
+    else:
+        log(f"✂️ Split {stats['pages']} pages into {stats['chunks']} chunks ({stats['indexed']} new, "
+            f"{len(indexed_chunks) - stats['indexed']} unchanged, {len(orphans)} removed)")
+    if orphans:
+        write_started = time.perf_counter()
+        collection.delete(ids=orphans)
+        keyword_index.remove(orphans)
+        stats["write_time"] += time.perf_counter() - write_started
+        stats["deleted"] += len(orphans)
+
+    _manifest_files(manifest, name)[file_path] = {
+        "file_hash": file_hash,
+        "mtime": file_stat.st_mtime,
+        "size": file_stat.st_size,
+        "chunks": indexed_chunks,
+    }
+    save_manifest(manifest)
+    return stats
+
+
+def _prune_missing(shards, manifest, target, name=COLLECTION_NAME, log=print):
+    """Remove documents under an indexed directory that no longer exist on disk."""
+    if not os.path.isdir(target):
+        return 0
+    prefix = os.path.join(os.path.abspath(target), "")
+    deleted = 0
+    for file_path in [p for p in _manifest_files(manifest, name) if p.startswith(prefix) and not os.path.exists(p)]:
+        log(f"🗑️ Removing deleted document: {file_path}")
+        deleted += _remove_document(shards, manifest, file_path, name)
+    return deleted
+
+
+def rebuild_keyword_index(name=COLLECTION_NAME, shards=None, log=print):
+    """(Re)build a collection's BM25 index from every chunk already stored in its shards."""
+    shards = shards or [shard for _, shard in retrieval_service.shards(name)]
+    if not shards:
+        log("📭 No knowledge base found.")
+        return 0
+    index = get_keyword_index(name)
+    index.clear()
+    total = 0
+    for shard in shards:
+        count = shard.count()
+        for offset in range(0, count, 1000):
+            items = shard.get(limit=1000, offset=offset, include=["documents"])
+            index.add(items["ids"], items["documents"])
+        total += count
+    log(f"🔤 Keyword index of {name} rebuilt ({total} chunks)")
+    return total
+
+
+def _collection_generation(name):
+    """Generation at which index_pdf last changed this collection ("" if unknown)."""
+    return retrieval_service.collections().get(name, {}).get("generation", "")
+
+
+def rebuild_routing_prototypes(name=COLLECTION_NAME, log=print):
+    """(Re)compute the prototype vectors rag_router scores prompts for this collection against."""
+    generation = _collection_generation(name)  # Read first: a change during the rebuild triggers another one
+    shards = retrieval_service.shards(name)
+    if not shards:
+        return None
+    with _prototype_lock, metrics.span("rag.build_prototypes"):
+        vectors = sample_embeddings([shard for _, shard in shards])
+        centroids = compute_prototypes(vectors) if len(vectors) else []
+        entry = prototype_store.save(name, generation, EMBEDDING_BACKEND, centroids, len(vectors))
+    log(f"🧭 Routing prototypes of {name} rebuilt ({len(centroids)} from {len(vectors)} chunks)")
+    return entry
+
+
+def _prototypes_stale(name, entry):
+    return (entry is None or entry["generation"] != _collection_generation(name)
+            or entry["embedding_tag"] != EMBEDDING_BACKEND)
+
+
+def _rebuild_prototypes_in_background(name):
+    """Rebuild a collection's prototypes in a daemon thread, unless a rebuild is already running."""
+    with _rebuild_lock:
+        if name in _prototype_rebuilds:
+            return
+        _prototype_rebuilds.add(name)
+
+    def _rebuild():
+        try:
+            rebuild_routing_prototypes(name)
+        except Exception as e:
+            print(f"⚠️ Routing prototypes of {name} could not be rebuilt: {e}")
+        finally:
+            with _rebuild_lock:
+                _prototype_rebuilds.discard(name)
+
+    threading.Thread(target=_rebuild, name=f"prototypes-{name}", daemon=True).start()
+
+
+def routing_prototypes():
+    """{collection name: prototype matrix, or None when it has no usable prototypes yet}.
+
+    Prototypes are built when a collection is published (index_pdf). Stale ones, e.g. a
+    collection indexed before routing existed, are rebuilt in the background, never on
+    the routing path: old centroids keep serving meanwhile, and a collection without
+    usable ones (none yet, or another embedding backend's) maps to None.
+    """
+    entries = prototype_store.load()
+    if RAG_BACKEND == "mmap":  # Read-only: use the prototypes shipped with the export
+        return {name: entry["centroids"] for name, entry in entries.items() if len(entry["centroids"])}
+    prototypes = {}
+    for name in retrieval_service.collections():
+        entry = entries.get(name)
+        if _prototypes_stale(name, entry):
+            _rebuild_prototypes_in_background(name)
+            if entry is not None and entry["embedding_tag"] != EMBEDDING_BACKEND:
+                entry = None  # Centroids of another embedding model can't be compared with this query
+        prototypes[name] = None if entry is None else entry["centroids"]
+    return prototypes
+
+
+def refresh_routing_prototypes():
+    """Rebuild the stale prototypes of every collection now (offline, e.g. before an export)."""
+    entries = prototype_store.load()
+    for name in retrieval_service.collections():
+        if _prototypes_stale(name, entries.get(name)):
+            rebuild_routing_prototypes(name)
+
+
+def _publish_collection(collections, name, log=print):
+    """Give a changed collection a new generation, so caches drop its stale results, and refresh its prototypes."""
+    generation = str(time.time_ns())
+    collections[name]["generation"] = generation  # Lets other collections keep their routing prototypes
+    save_collections(collections)
+    bump_generation(generation)
+    rebuild_routing_prototypes(name, log)
+
+
+def index_pdf(target, batch_size=EMBED_BATCH_SIZE, workers=EXTRACT_WORKERS, force=False,
+              collection=COLLECTION_NAME, shards=None, metadata=None, progress=None, log=print):
+    """Process a PDF file, directory or glob, embed new chunks in batches and upsert them into Chroma DB.
+
+    Unchanged files are skipped and only new or edited chunks are embedded, unless force=True.
+    `collection` names the knowledge base; a new one is split into `shards` Chroma
+    collections (default RAG_SHARDS), each document going wholly to one shard.
+    `metadata` is stored on every chunk so queries can filter on it (where={"department": "hr"});
+    it is applied when a file is (re-)indexed, so pass force=True to retag unchanged files.
+    progress(fraction, message), if given, is called before each file and after each embedded
+    batch; an exception it raises (a cancelled job) stops indexing, keeping the files already done.
+    log(text) receives the status lines (print by default; a background job passes its own log).
+    """
+    if not is_valid_collection_name(collection):
+        log(f"❌ Invalid collection name: {collection!r} (3-42 letters, digits, '.', '_' or '-')")
+        return None
+    paths = collect_pdf_paths(target)
+    if not paths:
+        log(f"❌ File not found: {target}")
+        return None
+
+    client = get_chroma_client()
+    collections = load_collections()
+    if not collections and retrieval_service.collection() is not None:
+        collections[COLLECTION_NAME] = {"shards": 1}  # Indexed before collections existed: one unsharded collection
+        save_collections(collections)
+    config = collections.get(collection)
+    if config is None:
+        config = collections[collection] = {"shards": max(1, shards or DEFAULT_SHARDS)}
+        if metadata:
+            config["metadata"] = metadata
+        save_collections(collections)
+        log(f"🗂️ Collection {collection}: {config['shards']} shard(s)")
+    elif shards and shards != config["shards"]:
+        log(f"⚠️ {collection} already has {config['shards']} shard(s); clear it to change that")
+    handles = [client.get_or_create_collection(name=shard) for shard in shard_names(collection, config["shards"])]
+    manifest = load_manifest()
+    if get_keyword_index(collection).count() == 0 and any(handle.count() for handle in handles):
+        rebuild_keyword_index(collection, handles, log)
+
+    totals = {"files": len(paths), "pages": 0, "chunks": 0, "indexed": 0, "deleted": 0, "skipped": 0,
+              "extract_time": 0.0, "embed_time": 0.0, "write_time": 0.0}
+    started = time.perf_counter()
+    executor = None
+    if workers > 1:
+        # Forking a threaded process (e.g. from a job worker) can copy held locks into the children
+        context = None if threading.current_thread() is threading.main_thread() else multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
     try:
-        collection = client.get_collection(name=COLLECTION_NAME)
-    except:
+        for done, path in enumerate(paths):
+            report, stats = None, {}
+            if progress:
+                progress(done / len(paths), os.path.basename(path))
+                report = lambda message, done=done: progress(done / len(paths), message)
+            _index_single_pdf(path, handles, executor, batch_size, manifest, force, collection, metadata,
+                              report, log, stats)
+            for key, value in stats.items():
+                totals[key] += value
+    except Exception:
+        # A failed or cancelled run keeps the chunks it wrote: publish them, if there are any
+        if totals["indexed"] or totals["deleted"] or stats.get("indexed") or stats.get("deleted"):
+            _publish_collection(collections, collection, log)
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    totals["deleted"] += _prune_missing(handles, manifest, target, collection, log)
+    save_manifest(manifest)
+    if totals["indexed"] or totals["deleted"]:
+        _publish_collection(collections, collection, log)
+    totals["elapsed"] = elapsed = max(time.perf_counter() - started, 1e-9)
+
+    log(f"\n✅ Indexed {totals['indexed']} new chunks from {len(paths)} PDF(s) into {collection} "
+          f"({totals['skipped']} unchanged, {totals['deleted']} stale chunks removed)")
+    log(f"⏱️ {elapsed:.2f}s total | {totals['pages'] / elapsed:.1f} pages/s | "
+          f"{totals['indexed'] / elapsed:.1f} chunks/s")
+    log(f"   extract {totals['extract_time']:.2f}s | embed {totals['embed_time']:.2f}s | "
+          f"write {totals['write_time']:.2f}s")
+    return totals
+
+
+def export_mmap_index(path=MMAP_INDEX_DIR, dtype=MMAP_DTYPE, lists="auto", collections=None):
+    """Write the collections (default: all) as a memory-mapped index for RAG_BACKEND=mmap.
+
+    `lists` is the number of IVF lists ("auto": IVF from 50k chunks on, 0: brute force).
+    Routing prototypes are refreshed first so a read-only deployment ships current ones.
+    """
+    shards = retrieval_service.shards(collections)
+    if not shards:
+        print("📭 No knowledge base found.")
+        return None
+    refresh_routing_prototypes()
+
+    def rows():
+        for name, shard in shards:
+            count = shard.count()
+            for offset in range(0, count, 1000):
+                items = shard.get(limit=1000, offset=offset, include=["documents", "metadatas", "embeddings"])
+                for i, chunk_id in enumerate(items["ids"]):
+                    yield chunk_id, name, items["documents"][i], items["metadatas"][i], items["embeddings"][i]
+
+    started = time.perf_counter()
+    manifest = write_index(path, rows(), dtype, lists, get_generation(), EMBEDDING_BACKEND)
+    size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    search = f"IVF with {manifest['ivf_lists']} lists" if manifest["ivf_lists"] else "brute force"
+    print(f"🗺️ Exported {manifest['count']} chunks to {path} ({dtype}, {search}, "
+          f"{size / 1024 / 1024:.1f} MB) in {time.perf_counter() - started:.2f}s")
+    print("   Serve it with RAG_BACKEND=mmap")
+    return manifest
+
+
+def _chroma_where(where):
+    """Chroma accepts one field per filter dict: {"a": 1, "b": 2} becomes {"$and": [{"a": 1}, {"b": 2}]}."""
+    if where and len(where) > 1 and not any(key.startswith("$") for key in where):
+        return {"$and": [{key: value} for key, value in where.items()]}
+    return where or None
+
+
+def _search_shard(name, shard, query_embedding, n_results, where):
+    """Top-n hits of one shard as [{"id", "document", "metadata", "collection", "distance"}]."""
+    options = {"where": where} if where else {}
+    with metrics.span("rag.shard_search", shard=shard.name):
+        results = shard.query(query_embeddings=[query_embedding], n_results=n_results, **options)
+    ids = results["ids"][0] if results.get("ids") else []
+    metadatas = (results.get("metadatas") or [[None] * len(ids)])[0]
+    return [{"id": chunk_id, "document": results["documents"][0][i], "metadata": metadatas[i],
+             "collection": name, "distance": results["distances"][0][i]} for i, chunk_id in enumerate(ids)]
+
+
+def _fan_out(function, calls):
+    """Run function(*args) for each args tuple, in the shard pool when there is more than one."""
+    if len(calls) == 1:
+        return [function(*calls[0])]
+    return list(get_shard_pool().map(lambda args: function(*args), calls))
+
+
+def _keyword_candidates(query_text, n_results, layout, where):
+    """BM25 hits of every searched collection, merged by score: ([chunk_id], {chunk_id: (name, shard)}).
+
+    A hit's shard follows from its document ID; with a `where` filter, hits that don't
+    match it are dropped (one get() per shard).
+    """
+    scored, owners = [], {}
+    for name, handles in layout:
+        for chunk_id, score in get_keyword_index(name).search(query_text, n_results):
+            shard = handles[_shard_of(chunk_id, len(handles))]
+            if shard is not None:
+                scored.append((score, chunk_id))
+                owners[chunk_id] = (name, shard)
+    ranked = [chunk_id for _, chunk_id in sorted(scored, reverse=True)[:n_results]]
+    if where and ranked:
+        matching = set()
+        for name, shard, ids in _group_by_shard(ranked, owners):
+            matching.update(shard.get(ids=ids, where=where, include=[])["ids"])
+        ranked = [chunk_id for chunk_id in ranked if chunk_id in matching]
+    return ranked, owners
+
+
+def _group_by_shard(chunk_ids, owners):
+    groups = {}
+    for chunk_id in chunk_ids:
+        name, shard = owners[chunk_id]
+        groups.setdefault(shard.name, (name, shard, []))[2].append(chunk_id)
+    return list(groups.values())
+
+
+def _fuse(query_text, n_results, found, dense_ids, keyword_ids, fetch, rerank):
+    """Reciprocal rank fusion of the dense and keyword rankings, then the optional cross-encoder.
+
+    `found` maps chunk IDs to hits already read; fetch(ids) returns hits for the others.
+    """
+    ranked = reciprocal_rank_fusion([dense_ids, keyword_ids], k=RRF_K)
+    reranker = get_rerank_model() if rerank else None
+    top = ranked[:max(n_results, RERANK_TOP_N)] if reranker else ranked[:n_results]
+    missing = [chunk_id for chunk_id in top if chunk_id not in found]
+    if missing:
+        found.update((hit["id"], hit) for hit in fetch(missing))
+    hits = [found[chunk_id] for chunk_id in top if chunk_id in found]
+
+    if reranker and hits:
+        with metrics.span("rag.rerank"):
+            scores = reranker.predict([(query_text, hit["document"]) for hit in hits])
+        hits = [hit for _, hit in sorted(zip(scores, hits), key=lambda pair: pair[0], reverse=True)]
+    return hits[:n_results]
+
+
+def retrieve(query_text, n_results=3, query_embedding=None, hybrid=HYBRID_SEARCH, rerank=True,
+             collections=None, where=None):
+    """Ranked chunks for a query as [{"id", "document", "metadata", "collection"}], or None without a collection.
+
+    Every shard of the given collections (default: all) is searched in parallel and the
+    per-shard top-k are merged by distance into one dense ranking. That is fused with BM25
+    keyword hits via reciprocal rank fusion, so exact regulation numbers, policy IDs and
+    acronyms are found even when the embedding misses them. `where` is a Chroma metadata
+    filter applied to both. If RERANK_MODEL is set, a cross-encoder reorders the fused top-N.
+    With RAG_BACKEND=mmap the exported memory-mapped index is searched instead of Chroma.
+    """
+    where = _chroma_where(where)
+    if RAG_BACKEND == "mmap":
+        return _retrieve_mmap(query_text, n_results, query_embedding, hybrid, rerank, collections, where)
+    layout = retrieval_service.layout(collections)
+    shards = [(name, shard) for name, handles in layout for shard in handles if shard is not None]
+    if not shards:
+        return None
+    if query_embedding is None:
+        query_embedding = get_embedding(query_text)
+        if query_embedding is None:
+            return []
+
+    candidates = max(n_results, HYBRID_CANDIDATES) if hybrid else n_results
+    with metrics.span("rag.vector_search"):
+        per_shard = _fan_out(_search_shard, [(name, shard, query_embedding, candidates, where)
+                                             for name, shard in shards])
+    found = {}
+    for hit in sorted((hit for hits in per_shard for hit in hits), key=lambda hit: hit["distance"]):
+        found.setdefault(hit["id"], hit)
+    dense_ids = list(found)[:candidates]
+    if not hybrid:
+        return [found[chunk_id] for chunk_id in dense_ids[:n_results]]
+
+    with metrics.span("rag.keyword_search"):
+        keyword_ids, owners = _keyword_candidates(query_text, candidates, layout, where)
+
+    def fetch(ids):
+        hits = []
+        for name, shard, group in _group_by_shard(ids, owners):
+            items = shard.get(ids=group, include=["documents", "metadatas"])
+            hits += [{"id": chunk_id, "document": items["documents"][i], "metadata": items["metadatas"][i],
+                      "collection": name} for i, chunk_id in enumerate(items["ids"])]
+        return hits
+
+    return _fuse(query_text, n_results, found, dense_ids, keyword_ids, fetch, rerank)
+
+
+def _retrieve_mmap(query_text, n_results, query_embedding, hybrid, rerank, collections, where):
+    """retrieve() over the memory-mapped index; BM25 hits are looked up in it by chunk ID."""
+    index = get_mmap_index()
+    if index is None or not index.has(collections):
+        return None
+    if query_embedding is None:
+        query_embedding = get_embedding(query_text)
+        if query_embedding is None:
+            return []
+
+    candidates = max(n_results, HYBRID_CANDIDATES) if hybrid else n_results
+    with metrics.span("rag.vector_search"):
+        dense = index.search(query_embedding, candidates, collections, where)
+    if not hybrid:
+        return dense[:n_results]
+    found = {hit["id"]: hit for hit in dense}
+    dense_ids = list(found)
+
+    with metrics.span("rag.keyword_search"):
+        names = index.collections if collections is None else (
+            [collections] if isinstance(collections, str) else collections)
+        # Shipped BM25 files are optional, and opened read-only: never create or convert one in a deployment
+        scored = [(score, chunk_id) for name in names
+                  if name in index.collections and os.path.exists(_keyword_index_path(name))
+                  for chunk_id, score in get_keyword_index(name, read_only=True).search(query_text, candidates)]
+        # The same chunk ID can score in several collections (one PDF indexed into each): rank it once
+        ranked = list(dict.fromkeys(chunk_id for _, chunk_id in sorted(scored, reverse=True)))[:candidates]
+        keyword_hits = index.get(ranked, collections, where)  # Drops hits outside the filters or the export
+    found.update((hit["id"], hit) for hit in keyword_hits)
+    return _fuse(query_text, n_results, found, dense_ids, list(dict.fromkeys(hit["id"] for hit in keyword_hits)),
+                 lambda ids: [], rerank)
+
+
+def format_hits(hits):
+    """Format retrieved chunks as the context block handed to the model."""
+    context = ""
+    for i, hit in enumerate(hits, 1):
+        context += f"\n📄 Result {i}:\n{hit['document']}\n"
+        context += "-" * 80 + "\n"
+    return context
+
+
+@metrics.timed("rag.query")
+def query_knowledge(query_text, n_results=3, query_embedding=None, collection=None, where=None):
+    """Query the knowledge base, answering repeated questions from the query cache.
+
+    Pass query_embedding when the question was already embedded (e.g. by rag_router).
+    `collection` is a name or list of names (default: every collection) and `where` a
+    Chroma metadata filter, e.g. {"department": "hr"}.
+    """
+    generation = get_generation()
+    cache_key = query_text
+    if collection or where:
+        cache_key += "\x1f" + json.dumps([collection, where], sort_keys=True)  # Scoped results are cached apart
+    cached = query_cache.get_results(cache_key, n_results, generation)
+    if cached is not None:
+        print("⚡ Knowledge base answer served from cache")
+        return cached
+
+    if not retrieval_service.available(collection):
         return "📭 No knowledge base found. Index a PDF first!"
 
     print("🔍 Searching knowledge base...")
-    query_embedding = get_embedding(query_text)
+    if query_embedding is None:
+        query_embedding = embed_query(query_text)
     if query_embedding is None:
         return "⚠️ Cannot generate embedding for query."
 
-    results = collection.query(
-        query_embeddings=[query_embedding], 
-        n_results=n_results
-    )
-    
-    docs = results.get("documents")
-    if not docs or not docs[0]:
-        return "📭 No relevant info found in knowledge base."
+    hits = retrieve(query_text, n_results, query_embedding, collections=collection, where=where)
+    if hits is None:
+        return "📭 No knowledge base found. Index a PDF first!"
     
-    # Format results nicely
-    context = ""
-    for i, doc in enumerate(docs[0], 1):
-        context += f"\n📄 Result {i}:\n{doc}\n"
-        context += "-" * 80 + "\n"
+    if not hits:
+        context = "📭 No relevant info found in knowledge base."
+        query_cache.put_results(cache_key, n_results, generation, context)
+        return context
     
+    context = format_hits(hits)
+    query_cache.put_results(cache_key, n_results, generation, context)
     return context
 
 
-def list_indexed_documents():
-    """List all documents in the knowledge base."""
-    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-    
+def _vector_index_bytes(shard):
+    """Bytes of a shard's HNSW segment on disk (Chroma keeps it in a folder named after the segment)."""
     try:
-        collection = client.get_collection(name=COLLECTION_NAME)
-        items = collection.get()
-        
-        if not items or not items['ids']:
-            print("📭 No documents indexed yet.")
-            return
-        
-        # Extract unique sources
+        db = sqlite3.connect(f"file:{os.path.join(CHROMA_DB_PATH, 'chroma.sqlite3')}?mode=ro", uri=True)
+        try:
+            rows = db.execute("SELECT id FROM segments WHERE collection = ? AND scope = 'VECTOR'",
+                              (str(shard.id),)).fetchall()
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return None
+    total = 0
+    for (segment_id,) in rows:
+        folder = os.path.join(CHROMA_DB_PATH, segment_id)
+        if os.path.isdir(folder):
+            total += sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+    return total
+
+
+def _probe_latency(shard, runs=5):
+    """Median seconds of a top-10 search with one of the shard's own vectors (after a warm-up query)."""
+    sample = shard.get(limit=1, include=["embeddings"])
+    if sample.get("embeddings") is None or not len(sample["embeddings"]):
+        return None
+    vector = sample["embeddings"][0]
+    vector = vector.tolist() if hasattr(vector, "tolist") else vector
+    shard.query(query_embeddings=[vector], n_results=10)  # Loads the HNSW index if it isn't yet
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        shard.query(query_embeddings=[vector], n_results=10)
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def shard_stats(probe=True):
+    """Per shard: collection, shard, chunks, documents (sources), index bytes on disk and search latency.
+
+    "probe_seconds" is measured on the spot; "p50_seconds"/"p95_seconds"/"searches" come from
+    the queries this process has answered so far (None before the first one).
+    """
+    live = {row["labels"].get("shard"): row for row in metrics.snapshot() if row["name"] == "rag.shard_search"}
+    stats = []
+    for name, shard in retrieval_service.shards():
         sources = set()
-        for metadata in items.get('metadatas', []): # type: ignore
-            if metadata and 'source' in metadata:
-                sources.add(metadata['source'])
-        
-        print(f"\n📚 Knowledge Base Stats:")
-        print(f"   Total chunks: {len(items['ids'])}")
-        print(f"   Documents: {len(sources)}")
-        print(f"\n📄 Indexed documents:")
-        for source in sorted(sources):
+        count = shard.count()
+        for offset in range(0, count, 1000):
+            items = shard.get(limit=1000, offset=offset, include=["metadatas"])
+            sources.update(metadata["source"] for metadata in items["metadatas"] if metadata and "source" in metadata)
+        row = live.get(shard.name) or {}
+        stats.append({"collection": name, "shard": shard.name, "chunks": count, "documents": sorted(sources),
+                      "index_bytes": _vector_index_bytes(shard),
+                      "probe_seconds": _probe_latency(shard) if probe and count else None,
+                      "searches": row.get("count", 0), "p50_seconds": row.get("p50"), "p95_seconds": row.get("p95")})
+    return stats
+
+
+def _format_bytes(size):
+    if size is None:
+        return "?"
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _format_ms(seconds):
+    return f"{seconds * 1000:.1f}" if seconds is not None else "–"
+
+
+def _parse_filter(text):
+    """"key=value key2=value2" → {"key": "value", ...} (metadata tags or a where filter); None if empty."""
+    pairs = [item.split("=", 1) for item in text.split() if "=" in item]
+    return {key: int(value) if value.isdigit() else value for key, value in pairs} or None
+
+
+def list_indexed_documents():
+    """List every collection and shard with its size, footprint, search latency and documents."""
+    if RAG_BACKEND == "mmap":
+        index = get_mmap_index()
+        if index is not None:
+            print(index.describe())
+        return
+    try:
+        stats = shard_stats()
+    except Exception as e:
+        print(f"📭 No knowledge base found. ({e})")
+        return
+    if not any(row["chunks"] for row in stats):
+        print("📭 No documents indexed yet.")
+        return
+
+    print(f"\n📚 Knowledge Base Stats:")
+    print(f"   {'shard':<28}{'chunks':>8}{'docs':>6}{'on disk':>11}{'probe ms':>10}{'p50 ms':>8}{'p95 ms':>8}")
+    for row in stats:
+        print(f"   {row['shard'][:27]:<28}{row['chunks']:>8}{len(row['documents']):>6}"
+              f"{_format_bytes(row['index_bytes']):>11}{_format_ms(row['probe_seconds']):>10}"
+              f"{_format_ms(row['p50_seconds']):>8}{_format_ms(row['p95_seconds']):>8}")
+    database = os.path.join(CHROMA_DB_PATH, "chroma.sqlite3")
+    if os.path.exists(database):
+        print(f"   Shared document store (chroma.sqlite3): {_format_bytes(os.path.getsize(database))}")
+    for name in sorted({row["collection"] for row in stats}):
+        rows = [row for row in stats if row["collection"] == name]
+        keyword_db = get_keyword_index(name).path
+        keyword_size = sum(os.path.getsize(path) for path in (keyword_db, keyword_db + "-wal") if os.path.exists(path))
+        print(f"\n📄 {name}: {sum(row['chunks'] for row in rows)} chunks in {len(rows)} shard(s), "
+              f"keyword index {_format_bytes(keyword_size)}")
+        for source in sorted(source for row in rows for source in row["documents"]):
             print(f"   • {source}")
-    except:
-        print("📭 No knowledge base found.")
 
 
 if __name__ == "__main__":
@@ -163,17 +1235,27 @@ if __name__ == "__main__":
     print("2️⃣ Query the stored knowledge")
     print("3️⃣ List indexed documents")
     print("4️⃣ Clear knowledge base")
-    choice = input("\nSelect option (1-4): ").strip()
+    print("5️⃣ Rebuild keyword (BM25) index and routing prototypes")
+    print("6️⃣ Export a memory-mapped index for read-only deployments")
+    print("7️⃣ Queue indexing as a background job")
+    choice = input("\nSelect option (1-7): ").strip()
 
     if choice == "1":
-        path = input("Enter PDF path: ").strip()
+        path = input("Enter PDF path, directory or glob: ").strip()
         # Remove quotes if user copied path with quotes
         path = path.strip('"').strip("'")
-        index_pdf(path)
+        collection = input(f"Collection [{COLLECTION_NAME}]: ").strip() or COLLECTION_NAME
+        shards = None
+        if collection not in load_collections():
+            shards = int(input(f"Shards for a new collection [{DEFAULT_SHARDS}]: ").strip() or DEFAULT_SHARDS)
+        tags = _parse_filter(input("Metadata tags, e.g. department=hr (optional): "))
+        index_pdf(path, collection=collection, shards=shards, metadata=tags)
     
     elif choice == "2":
         query = input("Enter your question: ").strip()
-        context = query_knowledge(query)
+        collection = input("Collection (blank = all): ").strip() or None
+        where = _parse_filter(input("Filter, e.g. department=hr (optional): "))
+        context = query_knowledge(query, collection=collection, where=where)
         print("\n📚 Context found:\n")
         print(context)
     
@@ -192,5 +1274,28 @@ if __name__ == "__main__":
         else:
             print("❌ Cancelled.")
     
+    elif choice == "5":
+        for name in retrieval_service.collections():
+            if retrieval_service.available(name):
+                rebuild_keyword_index(name)
+                rebuild_routing_prototypes(name)
+
+    elif choice == "6":
+        dtype = input(f"Vector type, float16 or int8 [{MMAP_DTYPE}]: ").strip() or MMAP_DTYPE
+        lists = input("IVF lists, 0 for brute force [auto]: ").strip() or "auto"
+        export_mmap_index(dtype=dtype, lists=lists if lists == "auto" else int(lists))
+
+    elif choice == "7":
+        from job_queue import make_queue, submit_index
+        path = input("Enter PDF path, directory or glob: ").strip().strip('"').strip("'")
+        collection = input(f"Collection [{COLLECTION_NAME}]: ").strip() or COLLECTION_NAME
+        shards = None
+        if collection not in load_collections():
+            shards = int(input(f"Shards for a new collection [{DEFAULT_SHARDS}]: ").strip() or DEFAULT_SHARDS)
+        tags = _parse_filter(input("Metadata tags, e.g. department=hr (optional): "))
+        job_id = submit_index(make_queue(), path, collection, shards, tags)
+        print(f"🧵 Queued as job #{job_id}. The running agent picks it up (or start `python job_queue.py work`);")
+        print(f"   follow it with /job {job_id} in the agent or `python job_queue.py show {job_id}`.")
+    
     else:
         print("❌ Invalid choice.")
\ No newline at end of file
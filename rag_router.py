@@ -0,0 +1,273 @@
+# rag_router.py
+"""Decide per prompt whether the knowledge base is worth querying.
+
+Each collection is summarised by a few prototype vectors (spherical k-means centroids
+of its chunk embeddings, built by index_pdf). A prompt is routed to retrieval when its
+embedding's best cosine similarity to a prototype reaches RAG_ROUTE_THRESHOLD. The
+embedding is handed on to query_knowledge and the response cache, so it is computed once.
+While the embedding model is still loading, a word-level keyword check decides instead.
+"""
+import os
+import re
+import json
+import time
+import threading
+from collections import Counter
+
+import numpy as np
+
+from instrumentation import metrics
+
+ROUTE_THRESHOLD = float(os.getenv("RAG_ROUTE_THRESHOLD", "0.3"))  # Cosine similarity to a prototype that triggers RAG
+PROTOTYPES_PER_COLLECTION = 16  # k-means centroids kept per collection
+PROTOTYPE_SAMPLE = 20000  # Chunk embeddings read to build them; larger collections are sampled page by page
+ROUTING_LOG = os.getenv("RAG_ROUTING_LOG", "rag_routing.jsonl")  # JSONL log of routing decisions; "" disables
+ROUTING_LOG_MAX_BYTES = int(os.getenv("RAG_ROUTING_LOG_MAX_BYTES", str(10 * 2**20)))  # Rotated to <log>.1 past this
+
+KNOWLEDGE_KEYWORDS = {"explain", "describe", "summarize", "who", "what", "when", "where", "why", "how", "define",
+                      "regulation", "policy", "rule", "procedure"}
+
+
+def is_knowledge_query(prompt: str) -> bool:
+    """Keyword fallback used before the embedding model is loaded. Matches whole words only."""
+    return not KNOWLEDGE_KEYWORDS.isdisjoint(re.findall(r"[a-z]+", prompt.lower()))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def compute_prototypes(vectors, k=PROTOTYPES_PER_COLLECTION, iterations=10, seed=0):
+    """Spherical k-means: k unit centroids summarising the directions of `vectors`."""
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    if len(vectors) <= k:
+        return vectors
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = np.bincount(assignment, minlength=k) == 0
+        sums[empty] = centroids[empty]  # Keep a centroid that lost all its members where it was
+        centroids = _normalize(sums)
+    return centroids
+
+
+def sample_embeddings(collections, limit=PROTOTYPE_SAMPLE, page_size=1000):
+    """Up to `limit` stored embeddings from the given shards, read in pages spread evenly over each."""
+    batches = []
+    for collection in collections:
+        offsets = list(range(0, collection.count(), page_size))
+        pages = max(1, limit // len(collections) // page_size)
+        if len(offsets) > pages:
+            offsets = [offsets[i * len(offsets) // pages] for i in range(pages)]
+        for offset in offsets:
+            items = collection.get(limit=page_size, offset=offset, include=["embeddings"])
+            if items.get("embeddings") is not None and len(items["embeddings"]):
+                batches.append(np.asarray(items["embeddings"], dtype=np.float32))
+    return np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+
+
+class PrototypeStore:
+    """Prototype vectors per collection in one JSON file, tagged with the generation they were built from."""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """{collection: {"generation", "embedding_tag", "chunks", "centroids"}}; re-read only when the file changed."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return {}
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        raw = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"⚠️ Could not read routing prototypes: {e}")
+                    raw = {}
+                self._entries = {name: dict(entry, centroids=np.asarray(entry["centroids"], dtype=np.float32))
+                                 for name, entry in raw.items()}
+                self._mtime = mtime
+            return dict(self._entries)
+
+    def save(self, name, generation, embedding_tag, centroids, chunks):
+        """Store one collection's prototypes (written atomically) and return its entry."""
+        entry = {"generation": generation, "embedding_tag": embedding_tag, "chunks": chunks,
+                 "centroids": np.round(np.asarray(centroids, dtype=np.float32), 5).tolist()}
+        with self._lock:
+            raw = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        raw = json.load(f)
+                except (OSError, ValueError):
+                    raw = {}
+            raw[name] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(raw, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = None
+        return dict(entry, centroids=np.asarray(entry["centroids"], dtype=np.float32))
+
+
+class RouteDecision:
+    """Outcome of routing one prompt; `embedding` is reused by retrieval and the response cache."""
+
+    __slots__ = ("retrieve", "reason", "score", "embedding", "collections", "seconds")
+
+    def __init__(self, retrieve, reason, score=None, embedding=None, collections=None):
+        self.retrieve = retrieve
+        self.reason = reason  # "similarity", "keyword" (model not loaded yet), "no-prototypes" or "no-index"
+        self.score = score  # Best cosine similarity to a prototype
+        self.embedding = embedding
+        self.collections = collections or []  # Collections scoring above the threshold
+        self.seconds = 0.0
+
+
+class RagRouter:
+    """Routes prompts to retrieval or straight to the model, and keeps count of what that saved.
+
+    Every decision is compared with what the old keyword heuristic would have done;
+    prompts it would have sent to retrieval but the router skipped are the saving,
+    priced at the mean measured retrieval time.
+    """
+
+    def __init__(self, threshold=ROUTE_THRESHOLD, log_path=ROUTING_LOG, log_max_bytes=ROUTING_LOG_MAX_BYTES):
+        self.threshold = threshold
+        self.log_path = log_path or None
+        self.log_max_bytes = log_max_bytes
+        self._log_size = None  # Bytes in the current log file, read from disk on the first write
+        self.counters = Counter()
+        self.route_seconds = 0.0
+        self.retrieval_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def route(self, prompt):
+        """RouteDecision for a prompt, embedding it if the model is ready."""
+        import rag_pdf_loader as rag  # rag_pdf_loader imports this module
+
+        started = time.perf_counter()
+        with metrics.span("rag.route"):
+            if not rag.retrieval_service.available():
+                decision = RouteDecision(False, "no-index")
+            elif not rag.is_embedding_model_loaded():
+                decision = RouteDecision(is_knowledge_query(prompt), "keyword")
+            else:
+                embedding = rag.embed_query(prompt)
+                if embedding is None:
+                    decision = RouteDecision(is_knowledge_query(prompt), "keyword")
+                else:
+                    decision = self.decide(embedding)
+        decision.seconds = time.perf_counter() - started
+        return decision
+
+    def decide(self, embedding):
+        """RouteDecision for an already computed query embedding."""
+        import rag_pdf_loader as rag
+
+        prototypes = rag.routing_prototypes()
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = {name: float(np.max(centroids @ query)) for name, centroids in prototypes.items()
+                  if centroids is not None and len(centroids) and centroids.shape[1] == query.shape[0]}
+        unrouted = sorted(name for name, centroids in prototypes.items() if centroids is None)
+        if not scores and not unrouted:
+            return RouteDecision(False, "no-index", embedding=embedding)
+        best = max(scores.values()) if scores else None
+        above = sorted((name for name, score in scores.items() if score >= self.threshold),
+                       key=scores.get, reverse=True)
+        if unrouted:  # Prototypes still being built: search those collections rather than guess
+            return RouteDecision(True, "no-prototypes", best, embedding, above + unrouted)
+        return RouteDecision(best >= self.threshold, "similarity", best, embedding, above)
+
+    def record(self, decision, prompt, retrieval_seconds=None):
+        """Count a decision and append it to the routing log."""
+        lowered = prompt.lower()
+        legacy = any(keyword in lowered for keyword in KNOWLEDGE_KEYWORDS)  # The substring check routing replaced
+        with self._lock:
+            self.counters["decisions"] += 1
+            self.counters["retrieved" if decision.retrieve else "skipped"] += 1
+            self.counters[f"reason:{decision.reason}"] += 1
+            if not decision.retrieve and legacy:
+                self.counters["skipped_vs_keywords"] += 1
+            if decision.retrieve and not legacy:
+                self.counters["added_vs_keywords"] += 1
+            self.route_seconds += decision.seconds
+            if retrieval_seconds is not None:
+                self.counters["timed_retrievals"] += 1
+                self.retrieval_seconds += retrieval_seconds
+            if self.log_path:
+                record = {"ts": round(time.time(), 3), "decision": "retrieve" if decision.retrieve else "skip",
+                          "reason": decision.reason, "score": decision.score, "threshold": self.threshold,
+                          "keywords": legacy, "collections": decision.collections,
+                          "route_ms": round(decision.seconds * 1000, 3),
+                          "retrieval_ms": None if retrieval_seconds is None else round(retrieval_seconds * 1000, 3),
+                          "prompt": prompt[:80]}
+                try:
+                    self._append_log(json.dumps(record, ensure_ascii=False) + "\n")
+                except OSError as e:
+                    print(f"⚠️ Routing log disabled: {e}")
+                    self.log_path = None
+
+    def _append_log(self, line):
+        """Append a line, first moving a full log to <log>.1 (replacing the previous one). Caller holds the lock."""
+        data = line.encode("utf-8")
+        if self._log_size is None:
+            self._log_size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        if self._log_size and self._log_size + len(data) > self.log_max_bytes:
+            os.replace(self.log_path, self.log_path + ".1")
+            self._log_size = 0
+        with open(self.log_path, 'ab') as f:
+            f.write(data)
+        self._log_size += len(data)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            decisions = counters.get("decisions", 0)
+            timed = counters.get("timed_retrievals", 0)
+            mean_retrieval = self.retrieval_seconds / timed if timed else None
+            return {
+                "decisions": decisions,
+                "retrieved": counters.get("retrieved", 0),
+                "skipped": counters.get("skipped", 0),
+                "reasons": {key.split(":", 1)[1]: value for key, value in counters.items() if key.startswith("reason:")},
+                "skipped_vs_keywords": counters.get("skipped_vs_keywords", 0),
+                "added_vs_keywords": counters.get("added_vs_keywords", 0),
+                "mean_route_seconds": self.route_seconds / decisions if decisions else None,
+                "mean_retrieval_seconds": mean_retrieval,
+                "estimated_saved_seconds": (counters.get("skipped_vs_keywords", 0) * mean_retrieval
+                                            if mean_retrieval is not None else None),
+            }
+
+    def report(self):
+        """Summary for the /routing command."""
+        stats = self.stats()
+        if not stats["decisions"]:
+            return "📭 No prompts routed yet."
+        reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(stats["reasons"].items()))
+        output = "🧭 RAG routing:\n" + "=" * 50 + "\n"
+        output += (f"Prompts:   {stats['retrieved']} retrieved / {stats['skipped']} skipped "
+                   f"(threshold {self.threshold:.2f}; {reasons})\n")
+        output += (f"vs keywords: {stats['skipped_vs_keywords']} lookups avoided, "
+                   f"{stats['added_vs_keywords']} questions the keywords missed\n")
+        output += f"Routing:   {stats['mean_route_seconds'] * 1000:.1f} ms avg (includes the query embedding)\n"
+        if stats["mean_retrieval_seconds"] is not None:
+            output += (f"Retrieval: {stats['mean_retrieval_seconds'] * 1000:.1f} ms avg → "
+                       f"~{stats['estimated_saved_seconds']:.2f}s saved\n")
+        if self.log_path:
+            output += f"Log:       {self.log_path}\n"
+        return output
+
+
+router = RagRouter()
@@ -0,0 +1,169 @@
+# response_cache.py
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+
+from rag_cache import normalize_query
+
+RESPONSE_CACHE_DB = "response_cache.db"
+SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.93"))  # Cosine similarity for a near-duplicate
+RESPONSE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))  # Seconds an answer stays servable
+MAX_RESPONSES = 2000  # Least recently used answers beyond this are evicted
+HISTORY_TURNS = int(os.getenv("RESPONSE_CACHE_HISTORY_TURNS", "2"))  # Recent exchanges that scope an answer
+
+
+def cache_scope(system_prompt, rag_context="", history=None, turns=HISTORY_TURNS):
+    """Answers are only shared between requests with the same system prompt, RAG context and recent history.
+
+    `history` is the conversation sent with the question; only its last `turns` user/assistant
+    exchanges count (not the summary), so a follow-up such as "why?" is answered from cache only
+    after the same exchange, and later turns of a long session can still hit.
+    """
+    recent = [message for message in history or [] if message["role"] != "system"]
+    digest = hashlib.sha1()
+    for message in recent[-2 * turns:] if turns > 0 else []:
+        digest.update(f"{message['role']}\0{message['content']}\0".encode('utf-8'))
+    rag_hash = hashlib.sha1(rag_context.encode('utf-8')).hexdigest()
+    return hashlib.sha1(f"{system_prompt}\0{rag_hash}\0{digest.hexdigest()}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Semantic cache of LLM answers in SQLite, in front of the OpenRouter call.
+
+    A lookup first tries the normalized question text (no embedding needed), then the
+    cosine similarity of the question embedding against the answers stored under the
+    same scope (system prompt + RAG context + hash of the last `history_turns` exchanges).
+    Vectors of a scope are kept in memory as one normalized matrix and reloaded only
+    when the scope changes on disk.
+    """
+
+    def __init__(self, db_path=RESPONSE_CACHE_DB, threshold=SIMILARITY_THRESHOLD,
+                 ttl=RESPONSE_TTL, max_entries=MAX_RESPONSES, history_turns=HISTORY_TURNS):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.history_turns = history_turns
+        self._db = None
+        self._scopes = {}  # scope -> (version, ids, matrix)
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0,
+                         "bypassed": 0, "stores": 0, "evictions": 0}
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                             "id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, question TEXT NOT NULL, "
+                             "vector BLOB, model TEXT, answer TEXT NOT NULL, created REAL, used REAL, "
+                             "hits INTEGER NOT NULL DEFAULT 0)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_scope ON responses (scope, question)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_used ON responses (used)")
+            self._db.commit()
+        return self._db
+
+    def _scope_matrix(self, db, scope):
+        """(ids, matrix) of the vectors stored under a scope."""
+        version = db.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM responses WHERE scope = ?",
+                             (scope,)).fetchone()
+        cached = self._scopes.get(scope)
+        if cached is None or cached[0] != version:
+            rows = db.execute("SELECT id, vector FROM responses WHERE scope = ? AND vector IS NOT NULL",
+                              (scope,)).fetchall()
+            ids = [row_id for row_id, _ in rows]
+            matrix = np.stack([np.frombuffer(vector, dtype=np.float32) for _, vector in rows]) if rows else None
+            cached = self._scopes[scope] = (version, ids, matrix)
+        return cached[1], cached[2]
+
+    def _hit(self, db, row_id, kind, similarity):
+        db.execute("UPDATE responses SET used = ?, hits = hits + 1 WHERE id = ?", (time.time(), row_id))
+        db.commit()
+        model, answer = db.execute("SELECT model, answer FROM responses WHERE id = ?", (row_id,)).fetchone()
+        self.counters[kind] += 1
+        return {"model": model, "answer": answer, "similarity": similarity, "exact": kind == "exact_hits"}
+
+    def lookup(self, question, system_prompt, rag_context="", embed=None, history=None):
+        """Return (hit, vector): hit is {"model", "answer", "similarity", "exact"} or None.
+
+        embed(question) is only called when there is no exact match; the vector is
+        returned so the caller can store the fresh answer without encoding twice.
+        """
+        scope = cache_scope(system_prompt, rag_context, history, self.history_turns)
+        key = normalize_query(question)
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT id FROM responses WHERE scope = ? AND question = ? AND created > ? "
+                             "ORDER BY id DESC LIMIT 1", (scope, key, cutoff)).fetchone()
+            if row is not None:
+                return self._hit(db, row[0], "exact_hits", 1.0), None
+
+        vector = self._normalize(embed(question)) if embed else None
+        with self._lock:
+            db = self._connect()
+            if vector is not None:
+                ids, matrix = self._scope_matrix(db, scope)
+                if matrix is not None and matrix.shape[1] == vector.shape[0]:
+                    similarities = matrix @ vector
+                    for position in np.argsort(similarities)[::-1]:
+                        if similarities[position] < self.threshold:
+                            break
+                        fresh = db.execute("SELECT 1 FROM responses WHERE id = ? AND created > ?",
+                                           (ids[position], cutoff)).fetchone()
+                        if fresh:
+                            return self._hit(db, ids[position], "semantic_hits", float(similarities[position])), vector
+            self.counters["misses"] += 1
+        return None, vector
+
+    @staticmethod
+    def _normalize(vector):
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def store(self, question, system_prompt, rag_context, model, answer, vector=None, history=None):
+        """Save an answer, then drop expired entries and trim to max_entries by last use."""
+        vector = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            scope = cache_scope(system_prompt, rag_context, history, self.history_turns)
+            db.execute("INSERT INTO responses (scope, question, vector, model, answer, created, used) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (scope, normalize_query(question), vector.tobytes() if vector is not None else None,
+                        model, answer, now, now))
+            evicted = db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,)).rowcount
+            evicted += db.execute("DELETE FROM responses WHERE id IN (SELECT id FROM responses "
+                                  "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+            db.commit()
+            self.counters["stores"] += 1
+            self.counters["evictions"] += evicted
+
+    def note_bypass(self):
+        with self._lock:
+            self.counters["bypassed"] += 1
+
+    def clear(self):
+        with self._lock:
+            db = self._connect()
+            db.execute("DELETE FROM responses")
+            db.commit()
+            self._scopes.clear()
+
+    def stats(self):
+        """Hit/miss counters, hit rate, the number of stored answers and the history window."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["history_turns"] = self.history_turns
+            stats["entries"] = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            hits = stats["exact_hits"] + stats["semantic_hits"]
+            lookups = hits + stats["misses"]
+            stats["hit_rate"] = hits / lookups if lookups else 0.0
+            return stats
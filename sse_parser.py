@@ -0,0 +1,175 @@
+# sse_parser.py
+"""Incremental Server-Sent Events parsing and token sinks for streamed completions.
+
+SSEParser is fed raw network chunks (bytes) as they arrive and returns complete events.
+It follows the SSE framing rules: lines end in LF, CRLF or CR (even when split across
+chunks), an empty line dispatches the event, several `data:` lines are joined with "\n",
+and `:` comment lines (OpenRouter's keep-alive "OPENROUTER PROCESSING") are skipped.
+Framing works on the byte buffer (a partial line is never decoded or re-scanned as text);
+only field values are decoded.
+
+Sinks receive the decoded tokens: start(model) once, write(chunk) per token, close() at
+the end. Their bound methods plug straight into OpenRouterClient.chat(on_start=..., on_token=...).
+"""
+import sys
+
+DONE = "[DONE]"
+
+
+class SSEEvent:
+    __slots__ = ("event", "data", "id")
+
+    def __init__(self, event, data, event_id):
+        self.event = event  # "message" unless the server set an `event:` field
+        self.data = data  # Data lines joined with "\n"
+        self.id = event_id
+
+    def __repr__(self):
+        return f"SSEEvent({self.event!r}, {self.data!r})"
+
+
+class SSEParser:
+    """Byte-level incremental SSE parser: feed(chunk) -> list of completed SSEEvents."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data = []
+        self._event = None
+        self.last_event_id = None
+        self.retry = None  # Reconnection delay (ms) announced by the server
+        self.comments = 0  # Keep-alive comment lines seen
+
+    def feed(self, chunk):
+        buffer = self._buffer
+        buffer += chunk
+        end = max(buffer.rfind(b"\n"), buffer.rfind(b"\r"))
+        if end == len(buffer) - 1 and buffer[end] == 13:  # Trailing CR: maybe half of a CRLF
+            end = max(buffer.rfind(b"\n", 0, end), buffer.rfind(b"\r", 0, end))
+        if end < 0:
+            return []
+        block = buffer[:end + 1]  # Every complete line
+        del buffer[:end + 1]
+
+        events = []
+        emit = events.append
+        data = self._data
+        event_type = self._event
+        # bytes.splitlines() breaks on exactly the SSE line ends (LF, CRLF, CR), unlike str.splitlines()
+        for line in block.splitlines():
+            if not line:
+                if data:
+                    emit(SSEEvent(event_type or "message", data[0] if len(data) == 1 else "\n".join(data),
+                                  self.last_event_id))
+                    data = []
+                event_type = None
+            elif line.startswith(b"data:"):
+                data.append((line[6:] if line[5:6] == b" " else line[5:]).decode("utf-8", "replace"))
+            elif line[0] == 58:  # ":" comment / keep-alive
+                self.comments += 1
+            else:
+                self._data, self._event = data, event_type
+                self._field(line)
+                data, event_type = self._data, self._event
+        self._data, self._event = data, event_type
+        return events
+
+    def _field(self, line):
+        name, colon, value = line.partition(b":")
+        if colon and value[:1] == b" ":
+            value = value[1:]
+        value = value.decode("utf-8", "replace")
+        if name == b"data":
+            self._data.append(value)
+        elif name == b"event":
+            self._event = value
+        elif name == b"id":
+            if "\0" not in value:
+                self.last_event_id = value
+        elif name == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+        # Unknown fields are ignored, as the spec requires
+
+    def close(self):
+        """End of stream: an event without its terminating blank line is discarded."""
+        self._buffer.clear()
+        self._data = []
+        self._event = None
+
+
+class TokenSink:
+    """Receives the winning model's name once, then every streamed chunk."""
+
+    def start(self, model):
+        pass
+
+    def write(self, chunk):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TerminalSink(TokenSink):
+    def __init__(self, stream=None, header="\n💡 (🧠 Model: {model})\n"):
+        self.stream = stream or sys.stdout
+        self.header = header
+        self._write = self.stream.write
+        self._flush = self.stream.flush
+
+    def start(self, model):
+        self._write(self.header.format(model=model))
+        self._flush()
+
+    def write(self, chunk):
+        self._write(chunk)
+        self._flush()
+
+
+class FileSink(TokenSink):
+    """Appends the streamed answer to a transcript file."""
+
+    def __init__(self, path, header="\n--- {model} ---\n"):
+        self.header = header
+        self._file = open(path, "a", encoding="utf-8")
+        self.write = self._file.write  # Buffered by the file object; no per-token syscall
+
+    def start(self, model):
+        self._file.write(self.header.format(model=model))
+
+    def close(self):
+        self._file.write("\n")
+        self._file.close()
+
+
+class QueueSink(TokenSink):
+    """Hands tokens to another thread (the HTTP server's response writer) as ("token", chunk)."""
+
+    def __init__(self, events):
+        self._put = events.put
+
+    def start(self, model):
+        self._put(("start", model))
+
+    def write(self, chunk):
+        self._put(("token", chunk))
+
+
+class TeeSink(TokenSink):
+    """Forwards to several sinks, e.g. the terminal plus a transcript file."""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+        self._writes = tuple(sink.write for sink in sinks)
+
+    def start(self, model):
+        for sink in self.sinks:
+            sink.start(model)
+
+    def write(self, chunk):
+        for write in self._writes:
+            write(chunk)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
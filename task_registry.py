@@ -0,0 +1,191 @@
+# task_registry.py
+import ast
+import shlex
+import inspect
+import pkgutil
+import importlib
+import importlib.util
+
+TASK_PACKAGE = "tasks"  # Every module here lists its tasks in a literal TASKS list, read without importing it
+ENTRY_POINT_GROUP = "basic_agent.tasks"  # Installed packages can add tasks under this entry point group
+
+
+class TaskSpec:
+    """A task the agent can run: where it lives, how to call it and how to describe it to the LLM.
+
+    `target` is "module:function"; the module is imported on the first call, not at registration.
+    """
+
+    def __init__(self, name, target, description="", parameters=None, required=None, needs_client=False):
+        self.name = name
+        self.target = target
+        self.description = description
+        self.parameters = parameters  # JSON-schema properties; None = derive from the signature on first use
+        self.required = required if required is not None else list(parameters or {})
+        self.needs_client = needs_client  # First argument is an OpenAI-style chat client
+        self._function = None
+
+    @property
+    def command(self):
+        return f"/{self.name}"
+
+    def load(self):
+        if self._function is None:
+            module_name, _, attribute = self.target.partition(":")
+            self._function = getattr(importlib.import_module(module_name), attribute)
+            if self.parameters is None:
+                self._describe_from_signature()
+        return self._function
+
+    def _describe_from_signature(self):
+        names = list(inspect.signature(self._function).parameters)
+        if self.needs_client:
+            names = names[1:]
+        self.parameters = {name: {"type": "string"} for name in names}
+        self.required = names
+        self.description = self.description or inspect.getdoc(self._function) or self.name
+
+    def schema(self):
+        """OpenAI function-calling schema for this task."""
+        if self.parameters is None:
+            self.load()
+        return {"type": "function", "function": {
+            "name": self.name,
+            "description": self.description,
+            "parameters": {"type": "object", "properties": self.parameters, "required": self.required},
+        }}
+
+
+def _read_task_list(path):
+    """The literal TASKS list in a module's source, parsed rather than imported."""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "TASKS"
+                                                for target in node.targets):
+            return ast.literal_eval(node.value)
+    return []
+
+
+def discover_tasks(package=TASK_PACKAGE):
+    """TaskSpecs for the TASKS lists of a package's modules (tasks/ by default), importing none of them.
+
+    Each entry is a dict: {"name", "function", "description", "parameters", "needs_client"}.
+    """
+    spec = importlib.util.find_spec(package)
+    if spec is None or not spec.submodule_search_locations:
+        print(f"⚠️ Task package {package} not found")
+        return []
+    specs = []
+    for module_info in sorted(pkgutil.iter_modules(spec.submodule_search_locations), key=lambda info: info.name):
+        module_name = f"{package}.{module_info.name}"
+        try:
+            entries = _read_task_list(module_info.module_finder.find_spec(module_name).origin)
+        except (OSError, SyntaxError, ValueError) as e:
+            print(f"⚠️ Could not read the tasks of {module_name}: {e}")
+            continue
+        for entry in entries:
+            specs.append(TaskSpec(entry["name"], f"{module_name}:{entry['function']}", entry.get("description", ""),
+                                  entry.get("parameters"), needs_client=entry.get("needs_client", False)))
+    return specs
+
+
+class TaskRegistry:
+    """Command table for the tasks/ modules and installed task plugins.
+
+    Registration is pure data: the tasks/ modules are found with pkgutil and their
+    TASKS lists parsed, and nothing is imported until a task runs (or, for plugins
+    without a declared schema, until the LLM needs its schema). Entry points are only
+    scanned when a command isn't found in the table, so start-up cost stays flat no
+    matter how many tasks are installed. Lookups are a single dict access.
+    """
+
+    def __init__(self, specs=None, client_factory=None, entry_point_group=ENTRY_POINT_GROUP):
+        self._table = {}
+        self._client_factory = client_factory
+        self._entry_point_group = entry_point_group
+        self._discovered = entry_point_group is None
+        for spec in discover_tasks() if specs is None else specs:
+            self.register(spec)
+
+    def register(self, spec):
+        self._table[spec.command] = spec
+
+    def _discover(self):
+        """Add plugin tasks from package entry points (names and targets only)."""
+        if self._discovered:
+            return
+        self._discovered = True
+        try:
+            from importlib.metadata import entry_points
+            found = entry_points(group=self._entry_point_group)
+        except Exception as e:
+            print(f"⚠️ Could not scan task plugins: {e}")
+            return
+        for entry_point in found:
+            if f"/{entry_point.name}" not in self._table:
+                self.register(TaskSpec(entry_point.name, entry_point.value))
+
+    def get(self, command):
+        spec = self._table.get(command)
+        if spec is None and not self._discovered:
+            self._discover()
+            spec = self._table.get(command)
+        return spec
+
+    def specs(self):
+        self._discover()
+        return list(self._table.values())
+
+    def tool_schemas(self):
+        """Function-calling schemas of every task, for the `tools` field of a chat request."""
+        return [spec.schema() for spec in self.specs()]
+
+    def call(self, name, arguments=None):
+        """Run a task by name with keyword arguments and return its output as text."""
+        spec = self.get(f"/{name}")
+        if spec is None:
+            return f"❌ Unknown task: {name}"
+        try:
+            function = spec.load()
+            args = [self._client_factory()] if spec.needs_client else []
+            result = function(*args, **(arguments or {}))
+        except Exception as e:
+            return f"❌ Task {name} failed: {e}"
+        if isinstance(result, (list, tuple)):
+            return "\n".join(str(item) for item in result) or "(empty)"
+        return str(result)
+
+    def dispatch(self, user_input):
+        """Run `/task arg ...` if it names a task; None otherwise."""
+        command, _, argument = user_input.strip().partition(" ")
+        if not command.startswith("/"):
+            return None
+        spec = self.get(command)
+        if spec is None:
+            return None
+        if spec.parameters is None:
+            try:
+                spec.load()
+            except Exception as e:
+                return f"❌ Task {spec.name} failed to load: {e}"
+        names = list(spec.parameters)
+        if len(names) == 1:
+            values = [argument.strip()] if argument.strip() else []
+        else:
+            try:
+                values = shlex.split(argument)
+            except ValueError:
+                values = argument.split()
+        missing = spec.required[len(values):]
+        if missing:
+            return f"❌ Usage: {command} " + " ".join(f"<{name}>" for name in names)
+        return self.call(spec.name, dict(zip(names, values)))
+
+    def describe(self):
+        """One line per task for /tasks (doesn't import anything but plugin metadata)."""
+        lines = []
+        for spec in self.specs():
+            usage = " ".join(f"<{name}>" for name in spec.parameters or {})
+            lines.append(f"{spec.command} {usage}".ljust(28) + f"– {spec.description or spec.target}")
+        return "🧰 Tasks:\n" + "=" * 50 + "\n" + "\n".join(lines) + "\n"
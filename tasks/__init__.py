@@ -0,0 +1,3 @@
+# tasks/__init__.py
+"""Agent tasks. Each module lists its commands in a literal TASKS list, which task_registry
+reads with pkgutil and ast; a module is only imported when one of its tasks first runs."""
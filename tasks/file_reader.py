@@ -14,3 +14,12 @@ def read_file(filename):
             return f.read()
     except Exception as e:
         return f"⚠️ Error reading file: {e}"
+
+
+TASKS = [
+    {"name": "list_files", "function": "list_files",
+     "description": "List the files in the agent's working directory.", "parameters": {}},
+    {"name": "read_file", "function": "read_file",
+     "description": "Read a text file from the agent's working directory.",
+     "parameters": {"filename": {"type": "string", "description": "Path of the file to read"}}},
+]
@@ -5,3 +5,8 @@ def get_disk_usage():
     total, used, free = shutil.disk_usage("/")
     return f"💾 Disk Usage: {used // (2**30)}GB used / {total // (2**30)}GB total"
 
+
+TASKS = [
+    {"name": "disk_usage", "function": "get_disk_usage",
+     "description": "Report used and total disk space of the root filesystem.", "parameters": {}},
+]
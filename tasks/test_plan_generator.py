@@ -9,3 +9,11 @@ def create_test_plan(client, feature):
         ]
     )
     return response.choices[0].message.content
+
+
+TASKS = [
+    {"name": "test_plan", "function": "create_test_plan",
+     "description": "Write a concise QA test plan (objectives, scenarios, data points) for a feature.",
+     "parameters": {"feature": {"type": "string", "description": "The feature to plan tests for"}},
+     "needs_client": True},
+]
@@ -0,0 +1,40 @@
+# tests/test_response_cache.py
+"""Answers are scoped by recent conversation history, so follow-ups are never shared across sessions."""
+from response_cache import ResponseCache
+
+SYSTEM = "You are a helpful assistant."
+HISTORY_A = [{"role": "user", "content": "What is the data retention policy?"},
+             {"role": "assistant", "content": "Records are kept for seven years."}]
+HISTORY_B = [{"role": "user", "content": "How do I claim travel expenses?"},
+             {"role": "assistant", "content": "Submit the form within 30 days."}]
+
+
+def embed(text):
+    return [1.0, 0.0, 0.0]  # Every question looks identical to the semantic lookup
+
+
+def test_sessions_with_different_history_do_not_share_answers(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.db"))
+    hit, vector = cache.lookup("why?", SYSTEM, embed=embed, history=HISTORY_A)
+    assert hit is None
+    cache.store("why?", SYSTEM, "", "model-a", "Because of tax law.", vector, history=HISTORY_A)
+
+    hit, _ = cache.lookup("why?", SYSTEM, embed=embed, history=HISTORY_B)
+    assert hit is None  # Neither an exact nor a semantic match from session A
+    hit, _ = cache.lookup("Why?", SYSTEM, embed=embed, history=[])
+    assert hit is None
+
+    hit, _ = cache.lookup("why?", SYSTEM, embed=embed, history=[dict(message) for message in HISTORY_A])
+    assert hit is not None and hit["answer"] == "Because of tax law."
+
+
+def test_only_the_recent_exchanges_scope_an_answer(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.db"), history_turns=1)
+    summary = {"role": "system", "content": "Summary of the earlier conversation:\n- user: hello"}
+    cache.store("why?", SYSTEM, "", "model-a", "Because of tax law.", [1.0, 0.0, 0.0],
+                history=[summary] + HISTORY_B + HISTORY_A)
+
+    hit, _ = cache.lookup("why?", SYSTEM, embed=embed, history=HISTORY_A)
+    assert hit is not None  # A later turn of another session, after the same last exchange
+    hit, _ = cache.lookup("why?", SYSTEM, embed=embed, history=HISTORY_A + HISTORY_B)
+    assert hit is None
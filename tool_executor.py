@@ -0,0 +1,201 @@
+# tool_executor.py
+import os
+import time
+import signal
+import asyncio
+
+import httpx
+
+import async_runtime
+
+TOOL_WORKERS = 8  # Tool calls running at once across all sessions
+TOOL_TIMEOUTS = {"read": 5.0, "fetch": 10.0, "run": 10.0}  # Seconds per call
+MAX_TOOL_OUTPUT = 1000  # Characters kept per source
+READ_BLOCK = 8192  # Bytes/characters read at a time from files, sockets and pipes
+MAX_HTTP_CONNECTIONS = 10
+
+
+class ToolResult:
+    """Output of one tool call on one target."""
+
+    def __init__(self, tool, target, output, ok=True, truncated=False, elapsed=0.0):
+        self.tool = tool
+        self.target = target
+        self.output = output
+        self.ok = ok
+        self.truncated = truncated
+        self.elapsed = elapsed
+
+
+class _Capture:
+    """Keeps the first `limit` characters of a stream and only counts the rest."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+
+    def feed(self, text):
+        room = self.limit - self.size
+        if room <= 0:
+            self.truncated = self.truncated or bool(text)
+            return False
+        if len(text) > room:
+            text, self.truncated = text[:room], True
+        self.parts.append(text)
+        self.size += len(text)
+        return not self.truncated
+
+    def text(self):
+        return "".join(self.parts)
+
+
+def kill_process_tree(process):
+    """Kill a timed-out command together with the children its shell started."""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+class ToolExecutor:
+    """Runs /read, /fetch and /run calls on the shared async runtime.
+
+    At most `workers` calls run at once, each under its tool's timeout. URLs are
+    fetched over one pooled HTTP client. Outputs are read incrementally and cut at
+    `max_output` characters, so a huge file, page or command output is never loaded whole.
+    """
+
+    def __init__(self, workers=TOOL_WORKERS, timeouts=None, max_output=MAX_TOOL_OUTPUT):
+        self.workers = workers
+        self.timeouts = dict(TOOL_TIMEOUTS, **(timeouts or {}))
+        self.max_output = max_output
+        self._semaphore = None
+        self._http = None
+
+    def _client(self):
+        # Created lazily so the pool is bound to the background event loop
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeouts["fetch"], connect=5.0), follow_redirects=True,
+                limits=httpx.Limits(max_connections=MAX_HTTP_CONNECTIONS,
+                                    max_keepalive_connections=MAX_HTTP_CONNECTIONS),
+            )
+        return self._http
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def close(self):
+        async_runtime.run(self.aclose())
+
+    # --- tools ---
+    def _read_file(self, path):
+        capture = _Capture(self.max_output)
+        with open(path, "r", encoding="utf-8") as f:
+            while True:
+                block = f.read(READ_BLOCK)
+                if not block or not capture.feed(block):
+                    break
+            if not capture.truncated:
+                capture.truncated = bool(f.read(1))
+        return capture
+
+    async def _read(self, path):
+        try:
+            capture = await asyncio.to_thread(self._read_file, path)
+        except Exception as e:
+            return f"❌ File read error: {e}", False, False
+        return capture.text(), True, capture.truncated
+
+    async def _fetch(self, url):
+        capture = _Capture(self.max_output)
+        try:
+            async with self._client().stream("GET", url) as response:
+                if response.status_code != 200:
+                    capture.limit = 200
+                async for text in response.aiter_text(READ_BLOCK):
+                    if not capture.feed(text):
+                        break  # Closing the response drops the rest of the body
+        except Exception as e:
+            return f"❌ Fetch error: {e}", False, False
+        if response.status_code != 200:
+            return f"❌ HTTP {response.status_code} - {capture.text()}", False, False
+        return capture.text(), True, capture.truncated
+
+    async def _run(self, command):
+        try:
+            process = await asyncio.create_subprocess_shell(
+                command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                start_new_session=True)
+        except Exception as e:
+            return f"❌ Command error: {e}", False, False
+
+        async def drain(stream, capture):
+            # Keep reading past the limit so the command never blocks on a full pipe
+            while True:
+                block = await stream.read(READ_BLOCK)
+                if not block:
+                    break
+                capture.feed(block.decode("utf-8", errors="replace"))
+
+        stdout, stderr = _Capture(self.max_output), _Capture(self.max_output)
+        try:
+            await asyncio.gather(drain(process.stdout, stdout), drain(process.stderr, stderr))
+            await process.wait()
+        finally:
+            if process.returncode is None:
+                kill_process_tree(process)
+                await process.wait()
+        for capture in (stdout, stderr):
+            if capture.text().strip():
+                return capture.text().strip(), True, capture.truncated
+        return "✅ Command executed successfully (no output)", True, False
+
+    async def _call(self, tool, target):
+        handler = {"read": self._read, "fetch": self._fetch, "run": self._run}[tool]
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                output, ok, truncated = await asyncio.wait_for(handler(target), self.timeouts[tool])
+            except asyncio.TimeoutError:
+                output, ok, truncated = f"⏱️ {tool} timed out after {self.timeouts[tool]:.0f}s", False, False
+            return ToolResult(tool, target, output, ok, truncated, time.perf_counter() - started)
+
+    async def gather(self, calls):
+        """Run (tool, target) calls concurrently; results come back in call order."""
+        return await asyncio.gather(*(self._call(tool, target) for tool, target in calls))
+
+    def execute(self, calls):
+        """Blocking wrapper around gather() for the CLI and server threads."""
+        return async_runtime.run(self.gather(calls))
+
+    def call(self, tool, target):
+        return self.execute([(tool, target)])[0]
+
+
+def format_results(results):
+    """One block per result, for showing to the user."""
+    if len(results) == 1:
+        result = results[0]
+        return result.output + ("\n…[truncated]" if result.truncated else "")
+    blocks = []
+    for result in results:
+        status = "✅" if result.ok else "❌"
+        blocks.append(f"{status} {result.tool} {result.target} ({result.elapsed:.2f}s)\n{result.output}"
+                      + ("\n…[truncated]" if result.truncated else ""))
+    return "\n\n".join(blocks)
+
+
+def merge_for_prompt(results):
+    """Successful outputs as one context block for the next prompt."""
+    sections = [f"[{result.tool} {result.target}]\n{result.output}" for result in results if result.ok]
+    return "\n\n".join(sections)